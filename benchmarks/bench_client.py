@@ -0,0 +1,105 @@
+"""Overhead of the client itself, measured in-process: nothing goes over
+the network, requests are answered by the loopback transports"""
+import pytest
+
+from python_http_client import Client, Hooks, LoopbackTransport
+from python_http_client.jsoncodec import available_codecs
+
+from conftest import DOCUMENT, DOCUMENT_BYTES
+
+HOST = 'http://api.test.com'
+HEADERS = {'Authorization': 'Bearer SG.key', 'User-Agent': 'bench'}
+
+
+@pytest.fixture
+def loopback():
+    return Client(host=HOST, version=3, request_headers=HEADERS,
+                  transport=LoopbackTransport(body=DOCUMENT_BYTES))
+
+
+@pytest.mark.benchmark(group='url')
+def test_url_prefix(benchmark):
+    client = Client(host=HOST, version=3).templates._('abc').versions
+    benchmark(client._build_url_prefix)
+
+
+@pytest.mark.benchmark(group='url')
+def test_url_cached(benchmark):
+    client = Client(host=HOST, version=3).templates._('abc').versions
+    benchmark(client._build_url, None)
+
+
+@pytest.mark.benchmark(group='url')
+def test_url_query_params(benchmark):
+    client = Client(host=HOST, version=3).templates
+    benchmark(client._build_url, {'limit': 100, 'offset': 200, 'q': 'a b'})
+
+
+@pytest.mark.benchmark(group='chaining')
+def test_attribute_chain(benchmark):
+    client = Client(host=HOST, version=3)
+    benchmark(lambda: client.templates.versions.content)
+
+
+@pytest.mark.benchmark(group='chaining')
+def test_dynamic_segment(benchmark):
+    client = Client(host=HOST, version=3)
+    benchmark(lambda: client.templates._('abc').versions)
+
+
+@pytest.mark.benchmark(group='json')
+@pytest.mark.parametrize('codec', sorted(available_codecs))
+def test_json_encode(benchmark, codec):
+    benchmark(available_codecs[codec]().dumps, DOCUMENT)
+
+
+@pytest.mark.benchmark(group='json')
+@pytest.mark.parametrize('codec', sorted(available_codecs))
+def test_json_decode(benchmark, codec):
+    benchmark(available_codecs[codec]().loads, DOCUMENT_BYTES)
+
+
+@pytest.mark.benchmark(group='call')
+def test_get(benchmark, loopback):
+    benchmark(loopback.templates.get)
+
+
+@pytest.mark.benchmark(group='call')
+def test_get_with_hooks(benchmark):
+    client = Client(host=HOST, version=3, request_headers=HEADERS,
+                    transport=LoopbackTransport(body=DOCUMENT_BYTES),
+                    hooks=Hooks(after_response=lambda *args: None))
+    benchmark(client.templates.get)
+
+
+@pytest.mark.benchmark(group='call')
+def test_get_to_dict(benchmark, loopback):
+    benchmark(lambda: loopback.templates.get(
+        query_params={'limit': 20}).to_dict)
+
+
+@pytest.mark.benchmark(group='call')
+def test_endpoint_get(benchmark, loopback):
+    benchmark(loopback.endpoint('/templates').get)
+
+
+@pytest.mark.benchmark(group='call')
+def test_post_json(benchmark, loopback):
+    benchmark(loopback.templates.post, request_body=DOCUMENT)
+
+
+@pytest.mark.benchmark(group='call')
+def test_async_get(benchmark, loop):
+    pytest.importorskip('aiohttp')
+    from python_http_client import AsyncClient, AsyncLoopbackTransport
+    client = AsyncClient(HOST, version=3, request_headers=HEADERS,
+                         transport=AsyncLoopbackTransport(
+                             body=DOCUMENT_BYTES))
+    templates = client.templates
+
+    async def calls():
+        for _ in range(100):
+            await templates.get()
+
+    # 100 calls a round, the event loop is entered once per round
+    benchmark(lambda: loop.run_until_complete(calls()))
@@ -0,0 +1,115 @@
+"""Throughput of the clients against the local stand-in server"""
+import asyncio
+import tracemalloc
+
+import pytest
+
+from python_http_client import (
+    Client, ConnectionPool, PooledSocketTransport)
+
+# Calls per round of the throughput benchmarks
+CALLS = 100
+# Body size of the streaming benchmarks
+LARGE = 16 * 1024 * 1024
+
+
+def _sequential(client):
+    for _ in range(CALLS):
+        client.json.get().to_dict
+
+
+@pytest.mark.benchmark(group='throughput')
+def test_sync_sequential(benchmark, client):
+    benchmark(_sequential, client)
+
+
+@pytest.mark.benchmark(group='throughput')
+def test_sync_threads(benchmark, client):
+    requests = [('GET', '/json')] * CALLS
+    benchmark(lambda: [response.to_dict
+                       for response in client.map(requests, max_workers=10)])
+
+
+@pytest.mark.benchmark(group='throughput')
+def test_async_concurrent(benchmark, loop, session, server):
+    from python_http_client import AsyncClient
+    client = AsyncClient(server.url, client_session=session).json
+    semaphore = asyncio.Semaphore(10)
+
+    async def call():
+        async with semaphore:
+            return (await client.get()).to_dict
+
+    async def calls():
+        await asyncio.gather(*(call() for _ in range(CALLS)))
+
+    benchmark(lambda: loop.run_until_complete(calls()))
+
+
+@pytest.mark.benchmark(group='connection reuse')
+def test_keep_alive(benchmark, client):
+    benchmark(_sequential, client)
+
+
+@pytest.mark.benchmark(group='connection reuse')
+def test_new_connection_per_call(benchmark, server):
+    client = Client(host=server.url,
+                    connection_pool=ConnectionPool(max_lifetime=0))
+    benchmark(_sequential, client)
+
+
+@pytest.mark.benchmark(group='connection reuse')
+def test_pooled_sockets(benchmark, server):
+    client = Client(host=server.url, transport=PooledSocketTransport())
+    benchmark(_sequential, client)
+
+
+def _peak_memory(function):
+    """
+    :return: tuple of (return value of function, peak of the memory
+             allocated while it ran, in bytes)
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _stream(client):
+    size = 0
+    with client.large.get(query_params={'size': LARGE},
+                          stream=True) as response:
+        for chunk in response.iter_bytes(65536):
+            size += len(chunk)
+    return size
+
+
+def _buffer(client):
+    return len(client.large.get(query_params={'size': LARGE}).body)
+
+
+@pytest.mark.benchmark(group='streaming')
+def test_stream_large_body(benchmark, client):
+    assert benchmark(_stream, client) == LARGE
+
+
+@pytest.mark.benchmark(group='streaming')
+def test_buffer_large_body(benchmark, client):
+    assert benchmark(_buffer, client) == LARGE
+
+
+@pytest.mark.benchmark(group='memory')
+@pytest.mark.parametrize('read', [_stream, _buffer],
+                         ids=['stream', 'buffer'])
+def test_large_body_memory_peak(benchmark, client, read):
+    size, peak = benchmark.pedantic(
+        _peak_memory, args=(lambda: read(client),), rounds=3)
+    assert size == LARGE
+    # Saved with the timings, so that the peaks can be compared too
+    benchmark.extra_info['peak_bytes'] = peak
+    if read is _stream:
+        assert peak < LARGE // 16
+    else:
+        assert peak >= LARGE
@@ -0,0 +1,115 @@
+"""Fixtures of the benchmark suite: a local stand-in for the API, served
+over keep-alive HTTP/1.1 from a thread, and clients pointed at it"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from python_http_client import Client
+
+# Body of /json, about the size of a typical API listing
+DOCUMENT = {
+    'result': [
+        {'id': i, 'name': 'template {}'.format(i), 'active': i % 2 == 0,
+         'versions': [{'id': 'v{}'.format(j), 'subject': 'Hello'}
+                      for j in range(3)]}
+        for i in range(20)
+    ],
+    '_metadata': {'count': 20, 'next': None},
+}
+DOCUMENT_BYTES = json.dumps(DOCUMENT).encode('utf-8')
+
+# Bytes written at a time by /large
+_BLOCK = b'x' * 65536
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    """GET /json answers DOCUMENT, GET /large?size=N answers N bytes and
+    anything else an empty JSON object. POST answers the size of the
+    request body."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would hold back on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/large':
+            size = int(parse_qs(url.query)['size'][0])
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            while size > 0:
+                block = _BLOCK[:size]
+                self.wfile.write(block)
+                size -= len(block)
+            return
+        self._reply(DOCUMENT_BYTES if url.path == '/json' else b'{}')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self._reply(json.dumps({'length': length}).encode('utf-8'))
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Room for the concurrent benchmarks
+    request_queue_size = 128
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+@pytest.fixture(scope='session')
+def server():
+    server = BenchServer(('127.0.0.1', 0), BenchHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    return Client(host=server.url)
+
+
+@pytest.fixture(scope='module')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def session(loop):
+    aiohttp = pytest.importorskip('aiohttp')
+    session = loop.run_until_complete(_new_session(aiohttp))
+    yield session
+    loop.run_until_complete(session.close())
+
+
+async def _new_session(aiohttp):
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=10))
@@ -1,12 +1,30 @@
 import os
 import sys
 
+from .cache import CacheBackend, FileCache, MemoryCache  # noqa
 from .client import Client  # noqa
+from .hooks import Hooks, Timings  # noqa
+from .jsoncodec import JSONCodec  # noqa
+from .multipart import MultipartEncoder  # noqa
+from .pool import ConnectionPool  # noqa
+from .ratelimit import RateLimiter  # noqa
+from .retry import Retry  # noqa
+from .singleflight import SingleFlight  # noqa
+from .transport import (  # noqa
+    LoopbackTransport, PooledSocketTransport, Transport, UrllibTransport)
 
-if sys.version_info >= (3, 5):
+# The async client relies on contextvars and asyncio.get_running_loop
+if sys.version_info >= (3, 7):
     try:
         from .async_client import (
             AsyncClient, AiohttpClientSessionError)  # noqa
+        from .async_transport import (
+            AsyncLoopbackTransport, AsyncTransport, AiohttpTransport)  # noqa
+    except ImportError:
+        # aiohttp isn't installed
+        pass
+    try:
+        from .http2 import HTTP2Transport  # noqa
     except ImportError:
         pass
 
@@ -1,14 +1,20 @@
 """Asynchronous Python HTTP Client Module"""
-from io import StringIO
+import asyncio
 import http
-from typing import Optional
-from urllib.error import URLError, HTTPError
+from typing import Iterable, Optional
 
-from aiohttp import ClientSession
-from aiohttp.client_exceptions import ClientConnectionError
+from aiohttp import ClientSession, TCPConnector
+from multidict import CIMultiDict, CIMultiDictProxy
 
-from .client import Client, Response
-from .exceptions import handle_error
+from .async_transport import AiohttpTransport, aiter_chunks, current_timings
+from .body import body_length
+from .client import Client, Response, _split_lines
+from .jsoncodec import default_codec
+from .jsonstream import ArrayItemParser
+from .ratelimit import select_limiter
+from .retry import _monotonic
+from .exceptions import error_from_response
+from .hooks import Timings
 
 
 class AiohttpClientSessionError(ValueError):
@@ -18,30 +24,184 @@ class AiohttpClientSessionError(ValueError):
 class AsyncResponse(Response):
     """Holds the response from an async API call."""
 
-    def __init__(self, code, body, headers):
+    __slots__ = ()
+
+    def __init__(self, code, body, headers, codec=None):
         self._status_code = code
         self._body = body
         self._headers = headers
+        self._codec = codec or default_codec
+
+    async def iter_json_items(self, path=None, chunk_size=65536):
+        """Decode the items of a JSON array in the body one at a time,
+           like AsyncStreamingResponse.iter_json_items.
+
+        :param path: Dotted keys leading to the array (e.g. 'result'),
+                     or None if the body itself is the array
+        :param chunk_size: Number of bytes parsed at a time
+        """
+        parser = ArrayItemParser(path)
+        for chunk in self._iter_body(chunk_size):
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.close():
+            yield item
+
+
+class AsyncStreamingResponse(AsyncResponse):
+    """Holds an async response whose body is read on demand.
+
+    The connection goes back to the session's pool once the body has been
+    read to the end or the response is closed.
+    """
+
+    __slots__ = ('_response',)
+
+    def __init__(self, response, codec=None):
+        super().__init__(response.status, None, response.headers, codec)
+        self._response = response
+
+    @property
+    def raw(self):
+        """aiohttp.StreamReader reading the body from the connection"""
+        return self._response.content
+
+    @property
+    def body(self):
+        """
+        :return: response body, once read with await read()
+        """
+        if self._body is None:
+            raise RuntimeError(
+                'The body of a streamed response must be read first: '
+                'await response.read()')
+        return self._body
+
+    async def read(self):
+        """Read the rest of the body and keep it as self.body
+
+        :return: bytes
+        """
+        if self._body is None:
+            self._body = await self._response.read()
+            timings = self.timings
+            if timings is not None:
+                timings.bytes_received = len(self._body)
+                timings.body_end = _monotonic()
+        return self._body
+
+    async def iter_bytes(self, chunk_size=8192):
+        """Iterate over the body in chunks of at most chunk_size bytes"""
+        timings = self.timings
+        async for chunk in self._response.content.iter_chunked(chunk_size):
+            if timings is not None:
+                timings.bytes_received += len(chunk)
+            yield chunk
+        if timings is not None:
+            timings.body_end = _monotonic()
+
+    async def iter_lines(self, chunk_size=8192):
+        """Iterate over the body line by line, without line endings"""
+        pending = b''
+        async for chunk in self.iter_bytes(chunk_size):
+            lines, pending = _split_lines(pending, chunk)
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+    async def iter_json_items(self, path=None, chunk_size=65536):
+        """Decode the items of a JSON array in the body one at a time,
+           without building the whole document.
+
+        :param path: Dotted keys leading to the array (e.g. 'result'),
+                     or None if the body itself is the array
+        :param chunk_size: Number of bytes parsed at a time
+        """
+        parser = ArrayItemParser(path)
+        async for chunk in self.iter_bytes(chunk_size):
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.close():
+            yield item
+
+    def __aiter__(self):
+        return self.iter_bytes()
+
+    def close(self):
+        """Release the connection, discarding any unread body"""
+        self._response.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+async def _counted(chunks, timings):
+    """Count the bytes of chunks in timings.bytes_sent as they go out"""
+    async for chunk in chunks:
+        timings.bytes_sent += len(chunk)
+        yield chunk
+
+
+# Marks the end of a batch in iter_batch's queue
+_BATCH_DONE = object()
 
 
 class AsyncClient(Client):
-    """Main async python HTTP client class"""
+    """Main async python HTTP client class
+
+    Used as an async context manager, it opens a ClientSession over a
+    TCPConnector configured by connector_options, shared with every client
+    derived from it, and closes it on exit.
+    """
+
+    # aiohttp negotiates and decodes compressed responses itself
+    _accept_encoding = None
+
+    # Settings of the TCPConnector of the sessions opened by the client,
+    # overridden by connector_options
+    default_connector_options = {
+        # Connections open at once, and to a single host
+        'limit': 100,
+        'limit_per_host': 10,
+        # Seconds host names stay resolved
+        'ttl_dns_cache': 300,
+        # Seconds an idle connection is kept open
+        'keepalive_timeout': 30,
+    }
+
+    _settings = Client._settings | {'connector_options'}
+
     def __init__(
-        self, *args, client_session: Optional[ClientSession] = None, **kwargs
+        self, *args, client_session: Optional[ClientSession] = None,
+        connector_options: Optional[dict] = None, **kwargs
     ):
         """Create async Python HTTP client instance
 
         :param ClientSession client_session: aiohttp.ClientSession instance,
-                                             optional, defaults to None
+                                             optional, defaults to None.
+                                             It is left open on exit.
+        :param dict connector_options: aiohttp.TCPConnector arguments of
+                                       the session opened when the client is
+                                       entered, over default_connector_options
         """
 
+        # [session, whether the client opened it], shared with every client
+        # derived from this one so that they see the session opened later
+        self._session = [client_session, False]
+        self.connector_options = dict(
+            self.default_connector_options, **(connector_options or {}))
+        # AiohttpTransport over client_session
+        self._session_transport = None
         super().__init__(*args, **kwargs)
-        self._aiohttp_client_session = client_session
 
     @property
     def client_session(self):
         """aiohttp.ClientSession instance"""
-        return self._aiohttp_client_session
+        return self._session[0]
 
     @client_session.setter
     def client_session(self, session: ClientSession):
@@ -55,51 +215,281 @@ class AsyncClient(Client):
                                            or another external has already
                                            been applied
         """
-        if self._aiohttp_client_session:
+        if self._session[0]:
             raise AiohttpClientSessionError(
                 'aiohttp.ClientSession instance has already been set')
-        self._aiohttp_client_session = session
-
-    def _build_client(self, name=None):
-        url_path = self._url_path + [name] if name else self._url_path
-        return AsyncClient(
-            host=self.host,
-            client_session=self.client_session,
-            version=self._version,
-            request_headers=self.request_headers,
-            url_path=url_path,
-            append_slash=self.append_slash,
-            timeout=self.timeout)
-
-    async def _make_request(self, request, timeout=None):
-        if not self.client_session:
+        self._session[:] = [session, False]
+
+    async def __aenter__(self):
+        if self.client_session is None and self.transport is None:
+            connector = TCPConnector(**self.connector_options)
+            self._session[:] = [ClientSession(connector=connector), True]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the session opened by the client, shutting down the idle
+        connections of its connector. A session given by the caller is
+        left open."""
+        session, owned = self._session
+        if owned:
+            self._session[:] = [None, False]
+            await session.close()
+
+    def _default_transport(self):
+        # Built from client_session on first use, it may be set later
+        return None
+
+    def _get_transport(self):
+        if self.transport is not None:
+            return self.transport
+        session = self.client_session
+        if not session:
             raise AiohttpClientSessionError(
-                'aiohttp.ClientSession instance is required')
-        timeout = timeout or self.timeout
+                'aiohttp.ClientSession instance is required: pass '
+                'client_session or use the client in "async with"')
+        transport = self._session_transport
+        if transport is None or transport.session is not session:
+            transport = self._session_transport = AiohttpTransport(session)
+        return transport
+
+    async def _make_request(self, request, timeout=None, stream=False):
+        if self.hooks:
+            return await self._make_traced_request(request, timeout, stream)
+        return await self._open(request, timeout, stream)
+
+    async def _make_traced_request(self, request, timeout, stream):
+        hooks = self.hooks
+        transport = self._get_transport()
+        if isinstance(transport, AiohttpTransport):
+            transport.enable_tracing()
+        timings = request.timings = Timings()
+        hooks.fire('before_request', request, timings)
+        length = body_length(request.data)
+        if length is None:
+            request.data = _counted(aiter_chunks(request.data), timings)
+        else:
+            timings.bytes_sent = length
+        # The time spent in the hooks isn't part of the call
+        timings.start = _monotonic()
+        token = current_timings.set(timings)
         try:
-            async with self.client_session.request(
-                request.get_method(),
-                request.get_full_url(),
-                headers={
-                    key: str(value) for key, value in request.headers.items()
-                },
-                data=request.data,
-                timeout=timeout,
-            ) as response:
-                code = response.status
-                headers = response.headers
-                body = await response.text()
-                if code >= http.HTTPStatus.BAD_REQUEST:
-                    raise HTTPError(
-                        request.get_full_url(),
-                        code,
-                        body,
-                        headers,
-                        StringIO(body),
-                    )
-        except ClientConnectionError as e:
-            raise URLError(e.args[1].strerror)
-        except HTTPError as e:
-            raise handle_error(e)
+            response = await self._open(request, timeout, stream, timings)
+        except Exception as err:
+            hooks.fire('on_error', request, err, timings)
+            raise
+        finally:
+            current_timings.reset(token)
+        response._timings = timings
+        hooks.fire('after_response', request, response, timings)
+        return response
+
+    @staticmethod
+    async def _read_traced(response, timings):
+        """Read the body, timing it"""
+        if timings.first_byte is None:
+            timings.first_byte = _monotonic()
+        body = await response.read()
+        timings.bytes_received = len(body)
+        timings.body_end = _monotonic()
+        return body
+
+    async def _open(self, request, timeout, stream, timings=None):
+        transport = self._get_transport()
+        timeout = timeout or self.timeout
+        context = transport.request(
+            request.get_method(),
+            request.get_full_url(),
+            headers=request.headers,
+            data=request.data,
+            timeout=timeout,
+        )
+        if stream:
+            response = await context.__aenter__()
+            code = response.status
+            if code < http.HTTPStatus.BAD_REQUEST:
+                if timings is not None and timings.first_byte is None:
+                    timings.first_byte = _monotonic()
+                # Released by AsyncStreamingResponse.close
+                return AsyncStreamingResponse(response, codec=self.codec)
+            try:
+                if timings is None:
+                    body = await response.read()
+                else:
+                    body = await self._read_traced(response, timings)
+            finally:
+                response.release()
         else:
-            return AsyncResponse(code, body, headers)
+            async with context as response:
+                code = response.status
+                if timings is None:
+                    body = await response.read()
+                else:
+                    body = await self._read_traced(response, timings)
+        if code >= http.HTTPStatus.BAD_REQUEST and self.raise_errors:
+            raise error_from_response(
+                code, response.reason, response.headers, body,
+                codec=self.codec)
+        return AsyncResponse(code, body, response.headers, codec=self.codec)
+
+    async def _make_managed_request(self, request, timeout, stream):
+        limiter = select_limiter(self.rate_limiter, self._url_path)
+        started = _monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter is not None:
+                wait = limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            try:
+                response = await self._make_request(
+                    request, timeout=timeout, stream=stream)
+            except Exception as err:
+                if limiter is not None:
+                    limiter.update(getattr(err, 'headers', None))
+                delay = self._retry_delay(request, attempt, err, started)
+                if delay is None:
+                    raise
+                failure = err
+            else:
+                if limiter is not None:
+                    limiter.update(response.headers)
+                if self.raise_errors or response.status_code < 400:
+                    return response
+                # Error status of a client that doesn't raise
+                delay = self._retry_delay(
+                    request, attempt, response, started)
+                if delay is None:
+                    return response
+                failure = response
+            if self.hooks:
+                self.hooks.fire('on_retry', request, failure, attempt, delay,
+                                request.timings)
+            await asyncio.sleep(delay)
+
+    async def _make_coalesced_request(self, request, timeout):
+        tasks = self.single_flight.tasks
+        key = (asyncio.get_running_loop(), self._coalescing_key(request))
+        task = tasks.get(key)
+        if task is None:
+            if self.cache is not None:
+                call = self._make_cached_request(request, timeout)
+            else:
+                call = self._make_managed_request(request, timeout, False)
+            task = tasks[key] = asyncio.ensure_future(call)
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        # A cancelled caller must not cancel the call of the others
+        return await asyncio.shield(task)
+
+    async def _make_cached_request(self, request, timeout):
+        url = request.get_full_url()
+        entry = self.cache.lookup('GET', url, request.headers)
+        if entry is not None:
+            if entry.is_fresh():
+                return self._cached_response(entry)
+            request.headers.update(entry.validators())
+        response = await self._make_managed_request(request, timeout, False)
+        if entry is not None and response.status_code == 304:
+            entry = self.cache.refresh(
+                'GET', url, request.headers, entry, response.headers)
+            return self._cached_response(entry)
+        self.cache.store('GET', url, request.headers, response.status_code,
+                         response.body, response.headers)
+        return response
+
+    def _cached_response(self, entry):
+        headers = CIMultiDictProxy(CIMultiDict(entry.headers))
+        return AsyncResponse(
+            entry.status_code, entry.body, headers, codec=self.codec)
+
+    async def batch(
+        self, requests: Iterable, concurrency: int = 10,
+        per_host: Optional[int] = None
+    ):
+        """Send many API calls, at most concurrency of them at a time
+
+        Each request is a tuple of (method, target) or
+        (method, target, kwargs): the HTTP verb, a URL path below this
+        client (e.g. '/mail/send') or an AsyncClient, and the keyword
+        arguments of the verb method (request_body, query_params, ...).
+        requests may be a lazy iterable, it is only consumed as fast as
+        the calls go out.
+
+        :param requests: the API calls to make
+        :param int concurrency: upper bound of calls in flight
+        :param int per_host: upper bound of calls in flight to any single
+                             host, optional
+        :return: list of Response objects, or of the exception raised by
+                 the call, in the order of requests
+        """
+        results = {}
+
+        async def deliver(index, result):
+            results[index] = result
+
+        await self._run_batch(requests, concurrency, per_host, deliver)
+        return [results[index] for index in range(len(results))]
+
+    async def iter_batch(
+        self, requests: Iterable, concurrency: int = 10,
+        per_host: Optional[int] = None
+    ):
+        """Like batch, but yield (index, result) pairs as the calls
+        complete. At most concurrency finished results are held back
+        when the consumer falls behind.
+        """
+        queue = asyncio.Queue()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def deliver(index, result):
+            await slots.acquire()
+            queue.put_nowait((index, result))
+
+        async def run():
+            try:
+                await self._run_batch(
+                    requests, concurrency, per_host, deliver)
+            finally:
+                queue.put_nowait(_BATCH_DONE)
+
+        runner = asyncio.ensure_future(run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _BATCH_DONE:
+                    break
+                slots.release()
+                yield item
+            # Surface errors raised while consuming requests
+            runner.result()
+        finally:
+            runner.cancel()
+
+    async def _run_batch(self, requests, concurrency, per_host, deliver):
+        calls = enumerate(requests)
+        clients = {}
+        host_limits = {}
+
+        async def call(request):
+            client, method, kwargs = self._resolve_call(request, clients)
+            if per_host is None:
+                return await client._send(method, **kwargs)
+            limit = host_limits.get(client.host)
+            if limit is None:
+                limit = host_limits[client.host] = asyncio.Semaphore(
+                    per_host)
+            async with limit:
+                return await client._send(method, **kwargs)
+
+        async def worker():
+            for index, request in calls:
+                try:
+                    result = await call(request)
+                except Exception as e:
+                    result = e
+                await deliver(index, result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
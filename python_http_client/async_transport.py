@@ -0,0 +1,222 @@
+"""Transports sending the requests built by AsyncClient"""
+import asyncio
+from collections.abc import AsyncIterable, Iterator
+from contextvars import ContextVar
+from urllib.error import URLError
+
+from aiohttp import TraceConfig
+from aiohttp.client_exceptions import ClientConnectionError
+from multidict import CIMultiDict, CIMultiDictProxy
+
+from .body import CHUNK_SIZE, EncodedBody, iter_chunks
+from .retry import _monotonic
+from .transport import _Routes
+
+# Timings of the attempt the current task is making, for the trace config
+current_timings = ContextVar('current_timings', default=None)
+
+
+class AsyncTransport:
+    """Sends a request for AsyncClient._make_request.
+
+    request() returns an async context manager yielding the response and
+    releasing it on exit, like aiohttp.ClientSession.request. Responses
+    follow the subset of aiohttp.ClientResponse used by AsyncClient:
+    status, reason, headers (case-insensitive), read() (the whole body, as
+    bytes), content (with read() and iter_chunked()) and release().
+    Connection failures are raised as urllib.error.URLError.
+    """
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        """
+        :param str method: HTTP verb
+        :param str url: Full URL
+        :param dict headers: Request headers
+        :param data: Request body: bytes-like, a file object, an
+                     EncodedBody, an iterator or async iterable of bytes,
+                     or None
+        :param timeout: Seconds to wait for the server, or None
+        :return: async context manager yielding the response
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Release the resources (e.g. connections) held by the transport"""
+
+
+async def aiter_chunks(body, chunk_size=CHUNK_SIZE):
+    """Iterate over a request body in chunks of bytes. Files are read in
+    the default executor, the event loop doesn't wait on the disk.
+
+    :param body: bytes-like, file object, EncodedBody, iterator or async
+                 iterable of bytes
+    :param int chunk_size: Number of bytes read at a time from files
+    :return: async generator of bytes-like objects
+    """
+    if isinstance(body, EncodedBody):
+        for segment in body.segments():
+            async for chunk in aiter_chunks(segment, chunk_size):
+                yield chunk
+    elif isinstance(body, AsyncIterable):
+        async for chunk in body:
+            yield chunk
+    elif hasattr(body, 'read'):
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, body.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in iter_chunks(body, chunk_size):
+            yield chunk
+
+
+class _AiohttpRequest:
+    """Turns aiohttp connection errors into URLError"""
+
+    __slots__ = ('_context',)
+
+    def __init__(self, context):
+        self._context = context
+
+    async def __aenter__(self):
+        try:
+            return await self._context.__aenter__()
+        except ClientConnectionError as e:
+            # ClientConnectorError carries the OSError of the socket
+            os_error = e.args[1] if len(e.args) > 1 else None
+            raise URLError(getattr(os_error, 'strerror', None) or str(e))
+
+    def __aexit__(self, *exc_info):
+        return self._context.__aexit__(*exc_info)
+
+
+def _recorder(phase):
+    async def record(session, context, params):
+        timings = current_timings.get()
+        if timings is not None:
+            setattr(timings, phase, _monotonic())
+    return record
+
+
+def _build_trace_config():
+    config = TraceConfig()
+    config.on_dns_resolvehost_start.append(_recorder('dns_start'))
+    config.on_dns_resolvehost_end.append(_recorder('dns_end'))
+    # aiohttp opens TCP and TLS in one step, tls_* stay unset
+    config.on_connection_create_start.append(_recorder('connect_start'))
+    config.on_connection_create_end.append(_recorder('connect_end'))
+    config.on_request_headers_sent.append(_recorder('request_sent'))
+    config.on_request_chunk_sent.append(_recorder('request_sent'))
+    config.on_request_end.append(_recorder('first_byte'))
+    config.freeze()
+    return config
+
+
+# Records the phases of the calls of AsyncClients with hooks, inert for
+# any other request of the session
+trace_config = _build_trace_config()
+
+
+class AiohttpTransport(AsyncTransport):
+    """Sends requests through an aiohttp.ClientSession, the default of
+    AsyncClient"""
+
+    def __init__(self, session):
+        """
+        :param ClientSession session: Session sending the requests
+        """
+        self.session = session
+
+    def enable_tracing(self):
+        """Add trace_config to the session, so that the calls of clients
+        with hooks get the DNS, connect and request phases timed"""
+        configs = self.session.trace_configs
+        if trace_config not in configs:
+            configs.append(trace_config)
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        if isinstance(data, (Iterator, EncodedBody)):
+            # aiohttp streams async iterables only
+            data = aiter_chunks(data)
+        return _AiohttpRequest(self.session.request(
+            method, url, headers=headers, data=data, timeout=timeout))
+
+    async def close(self):
+        await self.session.close()
+
+
+class _LoopbackContent:
+    """The subset of aiohttp.StreamReader read by AsyncClient"""
+
+    __slots__ = ('_body', '_position')
+
+    def __init__(self, body):
+        self._body = body
+        self._position = 0
+
+    async def read(self, n=-1):
+        start = self._position
+        end = len(self._body) if n < 0 else start + n
+        self._position = min(end, len(self._body))
+        return self._body[start:end]
+
+    async def readany(self):
+        return await self.read()
+
+    async def iter_chunked(self, n):
+        while self._position < len(self._body):
+            yield await self.read(n)
+
+    def at_eof(self):
+        return self._position >= len(self._body)
+
+
+class LoopbackResponse:
+    """Response served from memory by AsyncLoopbackTransport, its own
+    async context manager"""
+
+    __slots__ = ('status', 'reason', 'headers', 'content', '_body')
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = _LoopbackContent(body)
+        self._body = None
+
+    async def read(self):
+        if self._body is None:
+            self._body = await self.content.read()
+        return self._body
+
+    async def text(self, encoding='utf-8'):
+        return (await self.read()).decode(encoding)
+
+    def release(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AsyncLoopbackTransport(_Routes, AsyncTransport):
+    """Serves canned responses from memory, without any network I/O.
+
+    Measures the overhead of the AsyncClient itself and stands in for a
+    server in tests. Error statuses raise like they would over the
+    network.
+    """
+
+    def _prepare(self, canned):
+        status, reason, headers, body = canned
+        return (status, reason,
+                CIMultiDictProxy(CIMultiDict(headers.items())), body)
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        self.last_request = (method, url, headers, data)
+        return LoopbackResponse(*self._lookup(method, url))
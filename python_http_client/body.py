@@ -0,0 +1,136 @@
+"""Request bodies sent as they are: bytes-like objects, files, iterators
+of bytes, and bodies encoding themselves such as MultipartEncoder"""
+import io
+
+from collections.abc import AsyncIterable, Iterator
+
+# Sent without a copy
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+# Bytes read from a file body at a time
+CHUNK_SIZE = 65536
+
+
+class EncodedBody(object):
+    """Base of request bodies that encode themselves as they are sent
+       (e.g. MultipartEncoder): the concatenation of segments(), under
+       content_type, with a Content-Length when every segment has a
+       known size."""
+
+    # Content-Type header of the body
+    content_type = None
+
+    def segments(self):
+        """
+        :return: list of bytes-like objects, files, iterators or async
+                 iterables of bytes, the same objects on every call
+        """
+        raise NotImplementedError
+
+    @property
+    def length(self):
+        """
+        :return: integer, size of the body in bytes, or None if it is only
+                 known once sent
+        """
+        total = 0
+        for segment in self.segments():
+            length = body_length(segment)
+            if length is None:
+                return None
+            total += length
+        return total
+
+    @property
+    def replayable(self):
+        """
+        :return: True if the body can be sent again, e.g. by a retry
+        """
+        return all(is_replayable(segment) for segment in self.segments())
+
+    def __iter__(self):
+        for segment in self.segments():
+            for chunk in iter_chunks(segment):
+                yield chunk
+
+
+def is_raw_body(body):
+    """
+    :param body: request_body of an API call
+    :return: True if body is sent as is rather than encoded as JSON:
+             bytes-like, a file object, an EncodedBody, an iterator of
+             bytes or, for AsyncClient, an async iterable of bytes
+    """
+    return isinstance(body, (EncodedBody,) + BINARY_TYPES) or \
+        hasattr(body, 'read') or isinstance(body, Iterator) or \
+        isinstance(body, AsyncIterable)
+
+
+def is_replayable(body):
+    """
+    :return: True if body can be sent again, e.g. by a retry
+    """
+    if isinstance(body, EncodedBody):
+        return body.replayable
+    return body is None or isinstance(body, BINARY_TYPES)
+
+
+def body_length(body):
+    """
+    :param body: Request body, or None
+    :return: integer, size of body in bytes, or None if it is only known
+             once sent (iterators, files that can't seek)
+    """
+    if body is None:
+        return 0
+    if isinstance(body, BINARY_TYPES):
+        return memoryview(body).nbytes
+    if isinstance(body, EncodedBody):
+        return body.length
+    if hasattr(body, 'read'):
+        try:
+            if body.seekable():
+                position = body.tell()
+                end = body.seek(0, io.SEEK_END)
+                body.seek(position)
+                return end - position
+        except (AttributeError, OSError, ValueError):
+            pass
+    return None
+
+
+def iter_chunks(body, chunk_size=CHUNK_SIZE):
+    """Iterate over a request body in chunks of bytes
+
+    :param body: bytes-like, file object, EncodedBody or iterator of bytes
+    :param chunk_size: Number of bytes read at a time from files and
+                       sliced at a time from bytes-like objects
+    :type chunk_size: integer
+    :return: generator of bytes-like objects
+    """
+    if isinstance(body, BINARY_TYPES):
+        view = memoryview(body).cast('B')
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    elif hasattr(body, 'read'):
+        read = body.read
+        chunk = read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = read(chunk_size)
+    else:
+        for chunk in body:
+            yield chunk
+
+
+def counted(chunks, timings):
+    """Count the bytes of chunks in timings.bytes_sent as they go out
+
+    :param chunks: iterable of bytes
+    :param timings: Timings of the attempt sending them
+    :type timings: Timings
+    :return: generator of the chunks
+    """
+    for chunk in chunks:
+        timings.bytes_sent += len(chunk)
+        yield chunk
@@ -0,0 +1,448 @@
+"""HTTP caching of GET responses"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+from http.client import HTTPMessage
+
+# Headers describing the body itself, not refreshed by a 304 response
+_BODY_HEADERS = frozenset(
+    ['content-length', 'content-encoding', 'transfer-encoding'])
+
+# Atomic on every platform
+_replace = os.replace
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return mktime_tz(date)
+
+
+def _parse_cache_control(value):
+    """
+    :param value: Cache-Control header value
+    :type value: string
+    :return: dict of directive -> argument (None for bare directives)
+    """
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def _parse_vary(value):
+    return tuple(name.strip() for name in (value or '').split(',')
+                 if name.strip())
+
+
+def _expires_at(headers, now):
+    """Time until which a response is fresh, according to its headers
+
+    :return: float, Unix time
+    """
+    cache_control = _parse_cache_control(headers.get('Cache-Control'))
+    if 'no-cache' in cache_control:
+        return 0
+    date = _parse_date(headers.get('Date')) or now
+    try:
+        lifetime = int(cache_control['max-age'])
+    except (KeyError, TypeError, ValueError):
+        expires = _parse_date(headers.get('Expires'))
+        lifetime = expires - date if expires is not None else 0
+    try:
+        age = int(headers.get('Age') or 0)
+    except ValueError:
+        age = 0
+    age += max(0, now - date)
+    return now + lifetime - age
+
+
+class CacheEntry(object):
+    """A cached response and what is needed to revalidate it. Reads like
+       a urllib response (getcode, read, info), so Response can wrap it."""
+
+    def __init__(self, status_code, body, headers, expires):
+        """
+        :param status_code: Status code of the response
+        :type status_code: integer
+        :param body: Body of the response
+        :param headers: Headers of the response
+        :type headers: list of (name, value) tuples
+        :param expires: Unix time until which the entry is fresh
+        :type expires: float
+        """
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+        self.expires = expires
+
+    @property
+    def size(self):
+        """
+        :return: integer, approximate size in bytes
+        """
+        return len(self.body or b'') + sum(
+            len(name) + len(value) for name, value in self.headers)
+
+    def get_header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def is_fresh(self, now=None):
+        """
+        :return: boolean, True if the entry can be used without asking
+                 the server
+        """
+        return (now or time.time()) < self.expires
+
+    def validators(self):
+        """
+        :return: dict of the conditional request headers revalidating
+                 the entry, spelled like Client request headers
+        """
+        headers = {}
+        etag = self.get_header('ETag')
+        if etag is not None:
+            headers['If-none-match'] = etag
+        last_modified = self.get_header('Last-Modified')
+        if last_modified is not None:
+            headers['If-modified-since'] = last_modified
+        return headers
+
+    def http_message(self):
+        """
+        :return: HTTPMessage holding the headers, like those of a urllib
+                 response
+        """
+        message = HTTPMessage()
+        for name, value in self.headers:
+            message[name] = value
+        return message
+
+    def getcode(self):
+        return self.status_code
+
+    def read(self):
+        return self.body
+
+    def info(self):
+        return self.http_message()
+
+
+class CacheBackend(object):
+    """Storage of cached responses.
+
+    Subclasses implement get, set, delete and clear; the caching rules
+    (freshness, Vary, revalidation) live here.
+    """
+
+    def get(self, key):
+        """
+        :param key: Cache key
+        :type key: string
+        :return: the stored value, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, size):
+        """
+        :param key: Cache key
+        :type key: string
+        :param value: Picklable value
+        :param size: Approximate size of the value in bytes
+        :type size: integer
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _variant_key(base, vary, request_headers):
+        values = [
+            '{}: {}'.format(name, request_headers.get(name.capitalize(), ''))
+            for name in vary if name.lower() != 'authorization'
+        ]
+        authorization = request_headers.get('Authorization')
+        if authorization is not None:
+            # Backends are shared, so a response is only served back to
+            # the same credentials. The key, stored by FileCache, keeps
+            # a digest rather than the secret.
+            values.append('Authorization: ' + hashlib.sha256(
+                str(authorization).encode('utf-8')).hexdigest())
+        # Never equal to base, even without any Vary header
+        return '\n'.join([base, ''] + values)
+
+    def _save(self, method, url, request_headers, entry, vary):
+        base = '{} {}'.format(method, url)
+        # The base key lists the request headers selecting the variant
+        self.set(base, vary, len(base))
+        self.set(self._variant_key(base, vary, request_headers),
+                 entry, entry.size)
+
+    def lookup(self, method, url, request_headers):
+        """
+        :param method: HTTP verb, upper case
+        :type method: string
+        :param url: Full URL of the call
+        :type url: string
+        :param request_headers: Headers of the request, as sent by Client
+        :type request_headers: dictionary
+        :return: CacheEntry, or None
+        """
+        base = '{} {}'.format(method, url)
+        vary = self.get(base)
+        if vary is None:
+            return None
+        return self.get(self._variant_key(base, vary, request_headers))
+
+    def store(self, method, url, request_headers,
+              status_code, body, headers):
+        """Cache a response if its headers allow it
+
+        :param headers: Headers of the response
+        :type headers: HTTPMessage or mapping with items()
+        :return: CacheEntry, or None if the response can't be cached
+        """
+        if status_code != 200:
+            return None
+        cache_control = _parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cache_control:
+            return None
+        vary = _parse_vary(headers.get('Vary'))
+        if '*' in vary:
+            return None
+        entry = CacheEntry(status_code, body, list(headers.items()),
+                           _expires_at(headers, time.time()))
+        if not entry.is_fresh() and not entry.validators():
+            # Neither usable as is nor revalidatable
+            return None
+        self._save(method, url, request_headers, entry, vary)
+        return entry
+
+    def refresh(self, method, url, request_headers, entry, headers):
+        """Update an entry from the headers of a 304 response
+
+        :param entry: The entry that was revalidated
+        :type entry: CacheEntry
+        :param headers: Headers of the 304 response
+        :return: CacheEntry
+        """
+        updated = dict((name.lower(), value)
+                       for name, value in headers.items()
+                       if name.lower() not in _BODY_HEADERS)
+        merged = [(name, value) for name, value in entry.headers
+                  if name.lower() not in updated]
+        merged.extend((name, value) for name, value in headers.items()
+                      if name.lower() in updated)
+        refreshed = CacheEntry(entry.status_code, entry.body, merged, 0)
+        message = refreshed.http_message()
+        refreshed.expires = _expires_at(message, time.time())
+        self._save(method, url, request_headers, refreshed,
+                   _parse_vary(message.get('Vary')))
+        return refreshed
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe in-memory cache evicting the least recently used
+       entries beyond max_size bytes."""
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        """
+        :param max_size: Upper bound of the size of the cached bodies
+                         and headers, in bytes
+        :type max_size: integer
+        """
+        self.max_size = max_size
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # key -> (value, size), least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = (value, size)
+            return value
+
+    def set(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # Locks can't be pickled, only the configuration travels
+        return {'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+class FileCache(CacheBackend):
+    """Cache storing one file per entry in a directory, evicting the least
+       recently used files beyond max_size bytes. The directory can be
+       shared by several processes."""
+
+    suffix = '.cache'
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """
+        :param directory: Directory holding the cache files, created if
+                          missing
+        :type directory: string
+        :param max_size: Upper bound of the total size of the cache files,
+                         in bytes
+        :type max_size: integer
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._reset()
+
+    def _reset(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._lock = threading.Lock()
+        # Estimated total size of the files, rescanned on eviction
+        self._size = sum(size for _, _, size in self._files())
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + self.suffix)
+
+    def _files(self):
+        """
+        :return: list of (last access, path, size), oldest first
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        return files
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                stored_key, value = pickle.load(cache_file)
+            # The modification time tracks the last access
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError,
+                pickle.UnpicklingError):
+            return None
+        return value if stored_key == key else None
+
+    def set(self, key, value, size):
+        path = self._path(key)
+        data = pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_size:
+            self.delete(key)
+            return
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(data)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            # Readers see either the old file or the new one
+            _replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        files = self._files()
+        self._size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            for _, path, _ in self._files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
@@ -1,33 +1,50 @@
 """HTTP Client library"""
-import json
+import collections
+import time
+from functools import partial
+import http.client as httplib
+import urllib.request as urllib
+from types import MappingProxyType as _frozen
+from urllib.error import HTTPError
+from urllib.parse import urlencode
 
-
-try:
-    # Python 3
-    import urllib.request as urllib
-    from urllib.parse import urlencode
-    from urllib.error import HTTPError
-except ImportError:
-    # Python 2
-    import urllib2 as urllib
-    from urllib2 import HTTPError
-    from urllib import urlencode
-
-from .exceptions import handle_error
+from .body import (
+    BINARY_TYPES, EncodedBody, body_length, counted, is_raw_body,
+    is_replayable, iter_chunks)
+from .compression import (
+    ACCEPT_ENCODING, DecodingReader, compress_body, content_encoding,
+    decode_body, get_decoder, request_encodings)
+from .exceptions import error_from_response
+from .hooks import CountingReader, Timings, get_hooks, set_current_timings
+from .jsoncodec import default_codec, get_codec
+from .jsonstream import ArrayItemParser
+from .pool import ConnectionPool, PooledHTTPHandler, PooledHTTPSHandler
+from .ratelimit import get_rate_limiter, select_limiter
+from .retry import _monotonic, get_retry
+from .singleflight import get_single_flight
+from .transport import UrllibTransport
 
 
 class Response(object):
     """Holds the response from an API call."""
 
-    def __init__(self, response):
+    # _dict caches to_dict and stays unset until it is first read,
+    # _timings is only set on the responses of clients with hooks
+    __slots__ = ('_status_code', '_body', '_headers', '_codec', '_dict',
+                 '_timings')
+
+    def __init__(self, response, codec=None):
         """
         :param response: The return value from a open call
                          on a urllib.build_opener()
         :type response:  urllib response object
+        :param codec: JSON codec decoding the body in to_dict
+        :type codec: JSONCodec
         """
         self._status_code = response.getcode()
         self._body = response.read()
         self._headers = response.info()
+        self._codec = codec or default_codec
 
     @property
     def status_code(self):
@@ -50,15 +67,279 @@ class Response(object):
         """
         return self._headers
 
+    @property
+    def timings(self):
+        """
+        :return: Timings of the call, if the client has hooks registered,
+                 else None
+        """
+        return getattr(self, '_timings', None)
+
     @property
     def to_dict(self):
         """
-        :return: dict of response from the API
+        :return: dict of response from the API, decoded on first access
         """
-        if self.body:
-            return json.loads(self.body.decode('utf-8'))
-        else:
-            return None
+        try:
+            return self._dict
+        except AttributeError:
+            pass
+        body = self.body
+        timings = self.timings
+        if timings is not None:
+            timings.decode_start = _monotonic()
+        self._dict = self._codec.loads(body) if body else None
+        if timings is not None:
+            timings.decode_end = _monotonic()
+        return self._dict
+
+    def raise_for_status(self):
+        """Raise the error of an error status (>= 400), for the responses
+           of clients that don't raise them
+
+        :raises HTTPError: of the class of the status code (e.g.
+                           NotFoundError), with the standard reason phrase
+        """
+        status_code = self.status_code
+        if status_code >= 400:
+            raise error_from_response(
+                status_code, httplib.responses.get(status_code, ''),
+                self.headers, self.body, codec=self._codec)
+
+    def iter_json_items(self, path=None, chunk_size=65536):
+        """Decode the items of a JSON array in the body one at a time,
+           without building the whole document.
+
+        :param path: Dotted keys leading to the array (e.g. 'result'),
+                     or None if the body itself is the array
+        :type path: string
+        :param chunk_size: Number of bytes parsed at a time
+        :type chunk_size: integer
+        :return: generator of decoded items
+        """
+        parser = ArrayItemParser(path)
+        for chunk in self._iter_body(chunk_size):
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.close():
+            yield item
+
+    def _iter_body(self, chunk_size):
+        body = self.body or b''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        view = memoryview(body)
+        for start in range(0, len(body), chunk_size):
+            yield view[start:start + chunk_size]
+
+
+def _split_lines(pending, chunk):
+    """Split a chunk of a byte stream into complete lines
+
+    :param pending: Incomplete last line of the previous chunk
+    :type pending: bytes
+    :param chunk: Next chunk of the stream
+    :type chunk: bytes
+    :return: tuple of (list of complete lines, incomplete last line)
+    """
+    lines = (pending + chunk).split(b'\n')
+    pending = lines.pop()
+    return [line.rstrip(b'\r') for line in lines], pending
+
+
+class StreamingResponse(Response):
+    """Holds a response whose body is read from the connection on demand.
+
+    The connection goes back to the pool once the body has been read to
+    the end or the response is closed.
+    """
+
+    __slots__ = ('_raw',)
+
+    def __init__(self, response, codec=None):
+        """
+        :param response: The return value from a open call
+                         on a urllib.build_opener()
+        :type response:  urllib response object
+        :param codec: JSON codec decoding the body in to_dict
+        :type codec: JSONCodec
+        """
+        self._status_code = response.getcode()
+        self._body = None
+        self._headers = response.info()
+        self._codec = codec or default_codec
+        self._raw = response
+
+    @property
+    def raw(self):
+        """
+        :return: file-like object reading the body from the connection
+        """
+        return self._raw
+
+    @property
+    def body(self):
+        """
+        :return: the rest of the response body, read on first access
+        """
+        if self._body is None:
+            self._body = self._raw.read()
+        return self._body
+
+    def iter_bytes(self, chunk_size=8192):
+        """Iterate over the body in chunks of at most chunk_size bytes
+
+        :param chunk_size: Number of bytes read at a time
+        :type chunk_size: integer
+        :return: generator of bytes
+        """
+        read = self._raw.read
+        chunk = read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = read(chunk_size)
+
+    def iter_lines(self, chunk_size=8192):
+        """Iterate over the body line by line, without line endings
+
+        :param chunk_size: Number of bytes read at a time
+        :type chunk_size: integer
+        :return: generator of bytes
+        """
+        pending = b''
+        for chunk in self.iter_bytes(chunk_size):
+            lines, pending = _split_lines(pending, chunk)
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+    def _iter_body(self, chunk_size):
+        if self._body is not None:
+            return Response._iter_body(self, chunk_size)
+        return self.iter_bytes(chunk_size)
+
+    def close(self):
+        """Release the connection, discarding any unread body"""
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _normalize_headers(headers):
+    """Spell header names and values the way urllib.Request stores them
+
+    :param headers: HTTP headers
+    :type headers: dictionary
+    :return: dictionary
+    """
+    return dict((key.capitalize(), str(value))
+                for key, value in headers.items())
+
+
+def _read_only_headers(headers):
+    """
+    :param headers: HTTP headers
+    :type headers: dictionary
+    :return: read-only copy of headers, or headers itself if it already
+             is one
+    """
+    if isinstance(headers, _frozen):
+        return headers
+    return _frozen(dict(headers))
+
+
+class _Request(urllib.Request):
+    """urllib Request carrying its HTTP verb"""
+
+    # Timings of the last attempt at sending it, kept by clients with hooks
+    timings = None
+
+    # False if error statuses are returned by the transport rather than
+    # raised, see Transport
+    raise_errors = True
+
+    def __init__(self, url, data, headers, method):
+        """
+        :param headers: Headers already normalized by _normalize_headers,
+                        owned by the request from now on
+        :type headers: dictionary
+        """
+        urllib.Request.__init__(self, url, data=data)
+        self.headers = headers
+        self.method = method
+
+    def get_method(self):
+        return self.method
+
+
+class _HTTPErrorProcessor(urllib.HTTPErrorProcessor):
+    """Hands error statuses (>= 400) of requests whose raise_errors is
+       False back as they are, rather than raising them as HTTPError.
+       Redirects are still followed."""
+
+    def http_response(self, request, response):
+        if response.getcode() >= 400 and \
+                not getattr(request, 'raise_errors', True):
+            return response
+        return urllib.HTTPErrorProcessor.http_response(
+            self, request, response)
+
+    https_response = http_response
+
+
+class Endpoint(object):
+    """The API calls of a fixed URL, bound once by Client.endpoint().
+       The verb methods take the same parameters as client.<verb>()."""
+
+    __slots__ = ('_send',)
+
+    def __init__(self, client):
+        """
+        :param client: Client whose URL path is the endpoint
+        :type client: Client
+        """
+        self._send = client._send
+
+    def get(self, request_body=None, query_params=None,
+            request_headers=None, timeout=None, stream=False):
+        return self._send('GET', request_body, query_params,
+                          request_headers, timeout, stream)
+
+    def post(self, request_body=None, query_params=None,
+             request_headers=None, timeout=None, stream=False):
+        return self._send('POST', request_body, query_params,
+                          request_headers, timeout, stream)
+
+    def put(self, request_body=None, query_params=None,
+            request_headers=None, timeout=None, stream=False):
+        return self._send('PUT', request_body, query_params,
+                          request_headers, timeout, stream)
+
+    def patch(self, request_body=None, query_params=None,
+              request_headers=None, timeout=None, stream=False):
+        return self._send('PATCH', request_body, query_params,
+                          request_headers, timeout, stream)
+
+    def delete(self, request_body=None, query_params=None,
+               request_headers=None, timeout=None, stream=False):
+        return self._send('DELETE', request_body, query_params,
+                          request_headers, timeout, stream)
+
+
+def _call(client, method, kwargs):
+    try:
+        return client._send(method, **kwargs)
+    except Exception as e:
+        return e
+
+
+def _indexed_call(index, client, method, kwargs):
+    return index, _call(client, method, kwargs)
 
 
 class Client(object):
@@ -67,13 +348,45 @@ class Client(object):
     # These are the supported HTTP verbs
     methods = {'delete', 'get', 'patch', 'post', 'put'}
 
+    # Sent unless request_headers say otherwise, when decompress is True
+    _accept_encoding = ACCEPT_ENCODING
+
+    # Upper bound of the children memoized per client, so that dynamic
+    # segments reached through getattr() can't grow it without limit
+    max_memoized_children = 256
+
+    # Attributes the URL prefix, the base headers and the children (see
+    # _build_client) are built from: assigning one drops all three
+    _settings = frozenset([
+        'host', 'request_headers', '_version', '_url_path', 'append_slash',
+        'timeout', 'connection_pool', 'opener', 'codec', 'retry',
+        'rate_limiter', 'cache', 'single_flight', 'decompress',
+        'compress_requests', 'compress_min_size', 'transport', 'hooks',
+        'raise_errors'])
+
     def __init__(self,
                  host,
                  request_headers=None,
                  version=None,
                  url_path=None,
                  append_slash=False,
-                 timeout=None):
+                 timeout=None,
+                 connection_pool=None,
+                 opener=None,
+                 handlers=None,
+                 trust_env=True,
+                 ssl_context=None,
+                 codec=None,
+                 retry=None,
+                 rate_limiter=None,
+                 cache=None,
+                 single_flight=None,
+                 decompress=True,
+                 compress_requests=None,
+                 compress_min_size=1024,
+                 transport=None,
+                 hooks=None,
+                 raise_errors=True):
         """
         :param host: Base URL for the api. (e.g. https://api.sendgrid.com)
         :type host:  string
@@ -87,15 +400,143 @@ class Client(object):
         :type version: integer
         :param url_path: A list of the url path segments
         :type url_path: list of strings
+        :param connection_pool: Pool of keep-alive connections, shared
+                                with every Client derived from this one
+        :type connection_pool: ConnectionPool
+        :param opener: Pre-built opener used for every call, shared with
+                       every Client derived from this one. Built once
+                       from handlers and trust_env when not given.
+        :type opener: urllib.OpenerDirector
+        :param handlers: Extra urllib handlers. Handlers for http/https
+                         replace the pooled defaults, so their
+                         connections aren't kept alive: pass ssl_context
+                         rather than an HTTPSHandler to keep them pooled.
+        :type handlers: list of urllib.BaseHandler
+        :param trust_env: Pick up proxies from the environment. Set to
+                          False to skip proxy discovery altogether.
+        :type trust_env: boolean
+        :param ssl_context: SSL context of the pooled https connections
+                            (e.g. with a custom CA bundle or client
+                            certificate). SSL contexts can't be
+                            pickled, and neither can this Client then.
+        :type ssl_context: ssl.SSLContext
+        :param codec: JSON codec for request and response bodies: the name
+                      of an installed codec ('orjson', 'ujson', 'json'), a
+                      JSONCodec instance, or None for the fastest installed
+        :type codec: string or JSONCodec
+        :param retry: Retry policy of failed calls: None to never retry,
+                      the maximum number of attempts, or a Retry
+        :type retry: integer or Retry
+        :param rate_limiter: Pacing of the calls: a RateLimiter, or a
+                             dictionary of RateLimiters by URL path prefix
+                             (e.g. {'/mail': limiter}), shared with every
+                             Client derived from this one
+        :type rate_limiter: RateLimiter or dictionary
+        :param cache: Where GET responses are cached (e.g. a MemoryCache),
+                      shared with every Client derived from this one.
+                      None to disable caching.
+        :type cache: CacheBackend
+        :param single_flight: Let identical GET calls made at the same
+                              time (same URL and headers) share one
+                              upstream call and its Response: True, or a
+                              SingleFlight shared by several clients
+        :type single_flight: boolean or SingleFlight
+        :param decompress: Ask for compressed responses (Accept-Encoding)
+                           and decode them, streaming responses included
+        :type decompress: boolean
+        :param compress_requests: Content-Encoding of request bodies
+                                  ('gzip', or 'zstd' if zstandard is
+                                  installed). None to send them as is.
+        :type compress_requests: string
+        :param compress_min_size: Size in bytes from which request bodies
+                                  are compressed
+        :type compress_min_size: integer
+        :param transport: Sends the requests, shared with every Client
+                          derived from this one. Defaults to a
+                          UrllibTransport over the opener.
+        :type transport: Transport
+        :param hooks: Callbacks run around every call (before_request,
+                      after_response, on_error, on_retry), shared with
+                      every Client derived from this one: Hooks, or a
+                      dictionary of callables by event name
+        :type hooks: Hooks or dictionary
+        :param raise_errors: Raise error statuses (>= 400) as HTTPError.
+                             When False they are returned as a Response
+                             (read in full, even with stream=True), see
+                             Response.raise_for_status. Retries apply
+                             either way.
+        :type raise_errors: boolean
         """
-        self.host = host
-        self.request_headers = request_headers or {}
-        self._version = version
+        if compress_requests is not None and \
+                compress_requests not in request_encodings:
+            raise ValueError('Request encoding {!r} is not available'.format(
+                compress_requests))
+        # Nothing is built from the settings yet, so they are stored
+        # directly rather than through __setattr__
+        state = self.__dict__
+        # Children memoized by __getattr__, keyed by url segment
+        state['_children'] = {}
+        # Set on memoized children: (parent's _children, segment)
+        state['_memoized_in'] = None
+        state['_url_prefix'] = state['_base_headers'] = None
+        state['host'] = host
+        state['_request_headers'] = _read_only_headers(request_headers or {})
+        state['_version'] = version
         # _url_path keeps track of the dynamically built url
-        self._url_path = url_path or []
+        state['_url_path'] = url_path or []
         # APPEND SLASH set
-        self.append_slash = append_slash
-        self.timeout = timeout
+        state['append_slash'] = append_slash
+        state['timeout'] = timeout
+        state['connection_pool'] = connection_pool or ConnectionPool()
+        # Kept so that an unpickled client rebuilds the same opener
+        state['_opener_settings'] = None if opener else (
+            list(handlers or []), trust_env, ssl_context)
+        state['opener'] = opener or self._build_opener(
+            handlers, trust_env, ssl_context)
+        state['codec'] = get_codec(codec)
+        state['retry'] = get_retry(retry)
+        state['rate_limiter'] = get_rate_limiter(rate_limiter)
+        state['cache'] = cache
+        state['single_flight'] = get_single_flight(single_flight)
+        state['decompress'] = decompress
+        state['compress_requests'] = compress_requests
+        state['compress_min_size'] = compress_min_size
+        state['transport'] = transport or self._default_transport()
+        state['hooks'] = get_hooks(hooks)
+        state['raise_errors'] = raise_errors
+
+    def _build_opener(self, handlers=None, trust_env=True, ssl_context=None):
+        """Build the opener shared by this Client and its descendants.
+
+        :param handlers: Extra urllib handlers
+        :type handlers: list of urllib.BaseHandler
+        :param trust_env: Pick up proxies from the environment
+        :type trust_env: boolean
+        :param ssl_context: SSL context of the pooled https connections
+        :type ssl_context: ssl.SSLContext
+        :return: urllib.OpenerDirector
+        """
+        handlers = list(handlers or [])
+        if not any(isinstance(h, urllib.HTTPSHandler) for h in handlers):
+            handlers.append(
+                PooledHTTPSHandler(self.connection_pool, context=ssl_context))
+        if not any(isinstance(h, urllib.HTTPHandler) for h in handlers):
+            handlers.append(PooledHTTPHandler(self.connection_pool))
+        if not any(isinstance(h, urllib.HTTPErrorProcessor)
+                   for h in handlers):
+            handlers.append(_HTTPErrorProcessor())
+        if not trust_env and \
+                not any(isinstance(h, urllib.ProxyHandler) for h in handlers):
+            # An empty ProxyHandler stops build_opener from scanning
+            # the environment and keeps proxy_bypass off the hot path
+            handlers.append(urllib.ProxyHandler({}))
+        return urllib.build_opener(*handlers)
+
+    def _default_transport(self):
+        """
+        :return: the Transport used when none is given
+        """
+        return UrllibTransport(self.opener)
 
     def _build_versioned_url(self, url):
         """Subclass this function for your own needs.
@@ -107,77 +548,521 @@ class Client(object):
         """
         return '{}/v{}{}'.format(self.host, str(self._version), url)
 
-    def _build_url(self, query_params):
-        """Build the final URL to be passed to urllib
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._settings:
+            if name == 'opener':
+                # The new opener wasn't built from the constructor settings
+                object.__setattr__(self, '_opener_settings', None)
+            self._settings_changed()
+
+    def _settings_changed(self):
+        """Drop what was built from the previous settings: the cached URL
+           prefix and base headers, and the memoized children"""
+        state = self.__dict__
+        state['_url_prefix'] = state['_base_headers'] = None
+        if state.get('_children'):
+            state['_children'] = {}
+        memoized_in = state.get('_memoized_in')
+        if memoized_in is not None:
+            # Don't hand out this client from the parent's cache any more,
+            # nor let the parent's settings be changed through it
+            children, name = memoized_in
+            if children.get(name) is self:
+                del children[name]
+            state['_memoized_in'] = None
+
+    @property
+    def request_headers(self):
+        """Headers sent with every call, as a read-only mapping shared with
+           the clients derived from this one. Assign a new dictionary (or
+           use _update_headers) to change them.
+        """
+        return self._request_headers
+
+    @request_headers.setter
+    def request_headers(self, request_headers):
+        self._request_headers = _read_only_headers(request_headers)
+
+    def _get_base_headers(self):
+        """Normalized request_headers, built on first use
+
+        :return: read-only mapping
+        """
+        base = self._base_headers
+        if base is None:
+            headers = _normalize_headers(self.request_headers)
+            if self.decompress and self._accept_encoding:
+                headers.setdefault('Accept-encoding', self._accept_encoding)
+            base = self._base_headers = _frozen(headers)
+        return base
+
+    def _build_url_prefix(self):
+        """Build the URL without its query string
 
-        :param query_params: A dictionary of all the query parameters
-        :type query_params: dictionary
         :return: string
         """
         url = ''
-        count = 0
-        while count < len(self._url_path):
-            url += '/{}'.format(self._url_path[count])
-            count += 1
+        if self._url_path:
+            url = '/' + '/'.join(map(str, self._url_path))
 
         # add slash
         if self.append_slash:
             url += '/'
 
+        if self._version:
+            return self._build_versioned_url(url)
+        return '{}{}'.format(self.host, url)
+
+    def _build_url(self, query_params):
+        """Build the final URL to be passed to urllib
+
+        :param query_params: A dictionary of all the query parameters
+        :type query_params: dictionary
+        :return: string
+        """
+        url = self._url_prefix
+        if url is None:
+            url = self._url_prefix = self._build_url_prefix()
+
         if query_params:
             url_values = urlencode(sorted(query_params.items()), True)
             url = '{}?{}'.format(url, url_values)
-
-        if self._version:
-            url = self._build_versioned_url(url)
-        else:
-            url = '{}{}'.format(self.host, url)
         return url
 
     def _update_headers(self, request_headers):
-        """Update the headers for the request
+        """Update the headers for the request. Clients sharing the
+           previous headers keep them.
 
         :param request_headers: headers to set for the API call
         :type request_headers: dictionary
         :return: dictionary
         """
-        self.request_headers.update(request_headers)
+        headers = dict(self.request_headers)
+        headers.update(request_headers)
+        self.request_headers = _frozen(headers)
 
     def _build_client(self, name=None):
-        """Make a new Client object
+        """Make a new Client object, of the same class, from a copy of
+           this client's state: the settings are already resolved and
+           the URL prefix and base headers already built, so __init__
+           isn't run again.
 
         :param name: Name of the url segment
         :type name: string
         :return: A Client object
         """
-        url_path = self._url_path + [name] if name else self._url_path
-        return Client(host=self.host,
-                      version=self._version,
-                      request_headers=self.request_headers,
-                      url_path=url_path,
-                      append_slash=self.append_slash,
-                      timeout=self.timeout)
+        cls = type(self)
+        client = object.__new__(cls)
+        state = self.__dict__.copy()
+        if state['_base_headers'] is None:
+            # Built once on this client for all of its children
+            state['_base_headers'] = self._get_base_headers()
+        state['_children'] = {}
+        state['_memoized_in'] = None
+        if name:
+            state['_url_path'] = self._url_path + [name]
+            # Unless a subclass builds URLs its own way, the child's prefix
+            # is the parent's followed by the segment
+            if cls._build_url_prefix is Client._build_url_prefix and \
+                    cls._build_versioned_url is Client._build_versioned_url:
+                prefix = self._url_prefix
+                if prefix is None:
+                    prefix = self._url_prefix = self._build_url_prefix()
+                if self.append_slash:
+                    prefix = prefix[:-1] + '/' + str(name) + '/'
+                else:
+                    prefix = prefix + '/' + str(name)
+                state['_url_prefix'] = prefix
+            else:
+                state['_url_prefix'] = None
+        object.__setattr__(client, '__dict__', state)
+        return client
 
-    def _make_request(self, request, timeout=None):
+    def _make_request(self, request, timeout=None, stream=False):
         """Make the API call and return the response. This is separated into
            it's own function, so we can mock it easily for testing.
 
-        :param opener:
-        :type opener:
         :param request: url payload to request
         :type request: urllib.Request object
         :param timeout: timeout value or None
         :type timeout: float
-        :return: urllib response
+        :param stream: Leave the body on the connection until it is read
+        :type stream: boolean
+        :return: Response or StreamingResponse object
+        """
+        if self.hooks:
+            return self._make_traced_request(request, timeout, stream)
+        return self._open(request, timeout, stream)
+
+    def _make_traced_request(self, request, timeout, stream):
+        """_make_request running the hooks and timing the call
+
+        :return: Response or StreamingResponse object
+        """
+        hooks = self.hooks
+        timings = request.timings = Timings()
+        hooks.fire('before_request', request, timings)
+        length = body_length(request.data)
+        if length is None:
+            request.data = counted(iter_chunks(request.data), timings)
+        else:
+            timings.bytes_sent = length
+        # The time spent in the hooks isn't part of the call
+        timings.start = _monotonic()
+        previous = set_current_timings(timings)
+        try:
+            response = self._open(request, timeout, stream, timings)
+        except Exception as err:
+            hooks.fire('on_error', request, err, timings)
+            raise
+        finally:
+            set_current_timings(previous)
+        response._timings = timings
+        hooks.fire('after_response', request, response, timings)
+        return response
+
+    def _open(self, request, timeout, stream, timings=None):
+        """Send the request through the transport and wrap its response
+
+        :param timings: Timings of the attempt to fill in, or None
+        :type timings: Timings
+        :return: Response or StreamingResponse object
         """
-        opener = urllib.build_opener()
         timeout = timeout or self.timeout
         try:
-            return Response(opener.open(request, timeout=timeout))
+            response = self.transport.open(request, timeout=timeout)
         except HTTPError as err:
-            exc = handle_error(err)
-            exc.__cause__ = None
-            raise exc
+            # Custom transports and openers may raise error statuses
+            # whatever request.raise_errors
+            if self.raise_errors:
+                exc = self._http_error(err, timings)
+                exc.__cause__ = None
+                raise exc
+            response = err
+        if stream and not self.raise_errors and response.getcode() >= 400:
+            # Read like any other response, in full
+            stream = False
+        if timings is not None:
+            if timings.first_byte is None:
+                timings.first_byte = _monotonic()
+            response = CountingReader(response, timings)
+        if self.decompress:
+            decoder = get_decoder(content_encoding(response.info()))
+            if decoder is not None:
+                response = DecodingReader(response, decoder)
+        if stream:
+            return StreamingResponse(response, codec=self.codec)
+        return Response(response, codec=self.codec)
+
+    def _http_error(self, err, timings=None):
+        """
+        :param err: Error status raised by the transport
+        :type err: urllib.error.HTTPError
+        :param timings: Timings of the attempt to fill in, or None
+        :type timings: Timings
+        :return: HTTPError of the class of the status code
+        """
+        body = err.read()
+        if timings is not None:
+            if timings.first_byte is None:
+                timings.first_byte = _monotonic()
+            timings.body_end = _monotonic()
+            timings.bytes_received = len(body or b'')
+        if self.decompress:
+            body = decode_body(body, content_encoding(err.hdrs))
+        return error_from_response(
+            err.code, err.reason, err.hdrs, body, codec=self.codec)
+
+    def _send(self,
+              method,
+              request_body=None,
+              query_params=None,
+              request_headers=None,
+              timeout=None,
+              stream=False):
+        """Make the API call. Backs the verb methods of __getattr__ and
+           Endpoint, see http_request for the parameters.
+
+        :param method: HTTP verb, upper case
+        :type method: string
+        :return: Response object
+        """
+        # The base mapping is shared by every call, each request gets
+        # its own copy for per-call headers
+        headers = self._get_base_headers().copy()
+        if request_headers:
+            headers.update(_normalize_headers(request_headers))
+
+        if request_body is None:
+            data = None
+        else:
+            if is_raw_body(request_body):
+                # Sent as is: bytes-like objects without a copy, files
+                # and iterators streamed
+                data = request_body
+                if isinstance(data, EncodedBody):
+                    headers['Content-type'] = data.content_type
+                elif isinstance(data, BINARY_TYPES):
+                    # Most likely JSON encoded by the caller
+                    headers.setdefault('Content-type', 'application/json')
+                else:
+                    headers.setdefault(
+                        'Content-type', 'application/octet-stream')
+                if not isinstance(data, BINARY_TYPES) and \
+                        'Content-length' not in headers and \
+                        'Transfer-encoding' not in headers:
+                    # Streams of a known size go out without chunked
+                    # encoding, files straight from the kernel when
+                    # possible
+                    length = body_length(data)
+                    if length is not None:
+                        headers['Content-length'] = str(length)
+            else:
+                # Don't serialize to a JSON formatted str
+                # if we don't have a JSON Content-Type
+                content_type = headers.get('Content-type')
+                if content_type is not None and \
+                        content_type != 'application/json':
+                    data = request_body.encode('utf-8')
+                else:
+                    headers['Content-type'] = 'application/json'
+                    data = self.codec.dumps(request_body)
+            # Streamed bodies are sent uncompressed
+            if self.compress_requests is not None and \
+                    isinstance(data, BINARY_TYPES) and \
+                    len(data) >= self.compress_min_size and \
+                    'Content-encoding' not in headers:
+                data = compress_body(data, self.compress_requests)
+                headers['Content-encoding'] = self.compress_requests
+
+        request = _Request(
+            self._build_url(query_params),
+            data,
+            headers,
+            method,
+        )
+        if not self.raise_errors:
+            request.raise_errors = False
+
+        if method == 'GET' and data is None and not stream:
+            if self.single_flight is not None:
+                return self._make_coalesced_request(request, timeout)
+            if self.cache is not None:
+                return self._make_cached_request(request, timeout)
+        if self.retry is not None or self.rate_limiter is not None:
+            return self._make_managed_request(request, timeout, stream)
+        if stream:
+            return self._make_request(request, timeout=timeout, stream=True)
+        return self._make_request(request, timeout=timeout)
+
+    def _make_managed_request(self, request, timeout, stream):
+        """Make the API call paced by the rate limiter, sending it again
+           while self.retry allows
+
+        :param request: url payload to request
+        :type request: urllib.Request object
+        :param timeout: timeout value or None
+        :type timeout: float
+        :param stream: Leave the body on the connection until it is read
+        :type stream: boolean
+        :return: Response or StreamingResponse object
+        """
+        limiter = select_limiter(self.rate_limiter, self._url_path)
+        started = _monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self._make_request(
+                    request, timeout=timeout, stream=stream)
+            except Exception as err:
+                if limiter is not None:
+                    limiter.update(getattr(err, 'headers', None))
+                delay = self._retry_delay(request, attempt, err, started)
+                if delay is None:
+                    raise
+                failure = err
+            else:
+                if limiter is not None:
+                    limiter.update(response.headers)
+                if self.raise_errors or response.status_code < 400:
+                    return response
+                # Error status of a client that doesn't raise
+                delay = self._retry_delay(
+                    request, attempt, response, started)
+                if delay is None:
+                    return response
+                failure = response
+            if self.hooks:
+                self.hooks.fire('on_retry', request, failure, attempt, delay,
+                                request.timings)
+            time.sleep(delay)
+
+    def _retry_delay(self, request, attempt, failure, started):
+        """
+        :param failure: Exception raised by the attempt, or its error
+                        Response
+        :param started: When the first attempt started, from _monotonic
+        :type started: float
+        :return: float, seconds to wait before sending the call again, or
+                 None to give up
+        """
+        # Files and iterators have been consumed by the attempt
+        if self.retry is None or not is_replayable(request.data):
+            return None
+        return self.retry.get_delay(
+            request.get_method(), attempt, failure, _monotonic() - started)
+
+    @staticmethod
+    def _coalescing_key(request):
+        return request.get_full_url(), tuple(sorted(request.headers.items()))
+
+    def _make_coalesced_request(self, request, timeout):
+        """Make a GET call, or wait for the identical one in flight
+
+        :param request: url payload to request
+        :type request: urllib.Request object
+        :param timeout: timeout value or None
+        :type timeout: float
+        :return: Response object, shared by the coalesced callers
+        """
+        if self.cache is not None:
+            function = partial(self._make_cached_request, request, timeout)
+        else:
+            function = partial(
+                self._make_managed_request, request, timeout, False)
+        return self.single_flight.do(self._coalescing_key(request), function)
+
+    def _make_cached_request(self, request, timeout):
+        """Answer a GET from the cache while the cached response is fresh,
+           revalidate it with the server once it is stale.
+
+        :param request: url payload to request
+        :type request: urllib.Request object
+        :param timeout: timeout value or None
+        :type timeout: float
+        :return: Response object
+        """
+        url = request.get_full_url()
+        entry = self.cache.lookup('GET', url, request.headers)
+        if entry is not None:
+            if entry.is_fresh():
+                return Response(entry, codec=self.codec)
+            request.headers.update(entry.validators())
+        try:
+            response = self._make_managed_request(request, timeout, False)
+        except Exception as err:
+            # urllib raises 304 Not Modified like an error
+            if entry is None or getattr(err, 'status_code', None) != 304:
+                raise
+            response = err
+        if entry is not None and response.status_code == 304:
+            entry = self.cache.refresh(
+                'GET', url, request.headers, entry, response.headers)
+            return Response(entry, codec=self.codec)
+        self.cache.store('GET', url, request.headers, response.status_code,
+                         response.body, response.headers)
+        return response
+
+    def endpoint(self, path):
+        """Bind the API calls of a fixed path once, for hot loops that
+           would otherwise go through __getattr__ on every call.
+           (e.g. client.endpoint('/mail/send').post(request_body=data))
+
+        :param path: URL path below this client, segments separated by /
+        :type path: string
+        :return: Endpoint object
+        """
+        return Endpoint(self._descend(path))
+
+    def map(self, requests, max_workers=10, ordered=True):
+        """Send many API calls from a pool of threads sharing this client's
+           connection pool.
+
+        Each request is a tuple of (method, target) or
+        (method, target, kwargs): the HTTP verb, a URL path below this
+        client (e.g. '/mail/send') or a Client, and the keyword arguments
+        of the verb method (request_body, query_params, ...). requests may
+        be a lazy iterable, it is only consumed as fast as the calls go
+        out.
+
+        :param requests: the API calls to make
+        :type requests: iterable of tuples
+        :param max_workers: Number of threads making calls
+        :type max_workers: integer
+        :param ordered: Yield results in the order of requests. If False,
+                        yield (index, result) pairs as calls complete.
+        :type ordered: boolean
+        :return: generator of Response objects, or of the exception raised
+                 by the call
+        """
+        from concurrent.futures import (
+            FIRST_COMPLETED, ThreadPoolExecutor, wait)
+
+        # Requests submitted ahead of the results consumed
+        window = max_workers * 2
+        clients = {}
+        pending = collections.deque() if ordered else set()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for index, request in enumerate(requests):
+                call = self._resolve_call(request, clients)
+                if ordered:
+                    pending.append(executor.submit(_call, *call))
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                    continue
+                pending.add(executor.submit(_indexed_call, index, *call))
+                if len(pending) >= window:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                if ordered:
+                    yield pending.popleft().result()
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _resolve_call(self, request, clients):
+        """Split a batch request into the arguments of _send
+
+        :param request: (method, target) or (method, target, kwargs)
+        :type request: tuple
+        :param clients: Clients already resolved, by path
+        :type clients: dictionary
+        :return: tuple of (Client, method, kwargs)
+        """
+        method, target = request[0], request[1]
+        kwargs = request[2] if len(request) > 2 else {}
+        if not isinstance(target, Client):
+            client = clients.get(target)
+            if client is None:
+                client = clients[target] = self._descend(target)
+            target = client
+        return target, method.upper(), kwargs
+
+    def _descend(self, path):
+        """Build the Client of a URL path below this one
+
+        :param path: URL path, segments separated by /
+        :type path: string
+        :return: Client object
+        """
+        client = self
+        for segment in path.split('/'):
+            if segment:
+                client = client._(segment)
+        return client
 
     def _(self, name):
         """Add variable values to the url.
@@ -220,13 +1105,17 @@ class Client(object):
                     query_params=None,
                     request_headers=None,
                     timeout=None,
+                    stream=False,
                     **_):
                 """Make the API call
                 :param timeout: HTTP request timeout. Will be propagated to
                     urllib client
                 :type timeout: float
+                :param stream: Return a StreamingResponse that reads the
+                    body on demand instead of buffering it
+                :type stream: boolean
                 :param request_headers: HTTP headers. Will be merged into
-                    current client object state
+                    the client's headers for this call only
                 :type request_headers: dict
                 :param query_params: HTTP query parameters
                 :type query_params: dict
@@ -235,38 +1124,50 @@ class Client(object):
                 :param kwargs:
                 :return: Response object
                 """
-                if request_headers:
-                    self._update_headers(request_headers)
-
-                if request_body is None:
-                    data = None
-                else:
-                    # Don't serialize to a JSON formatted str
-                    # if we don't have a JSON Content-Type
-                    if 'Content-Type' in self.request_headers and \
-                            self.request_headers['Content-Type'] != \
-                            'application/json':
-                        data = request_body.encode('utf-8')
-                    else:
-                        self.request_headers.setdefault(
-                            'Content-Type', 'application/json')
-                        data = json.dumps(request_body).encode('utf-8')
-
-                request = urllib.Request(
-                    self._build_url(query_params),
-                    headers=self.request_headers,
-                    data=data,
-                )
-                request.get_method = lambda: method
-
-                return self._make_request(request, timeout=timeout)
+                return self._send(method, request_body, query_params,
+                                  request_headers, timeout, stream)
             return http_request
         else:
-            # Add a segment to the URL
-            return self._(name)
+            # Add a segment to the URL, reusing the child built for
+            # the same segment before
+            try:
+                return self._children[name]
+            except KeyError:
+                pass
+            child = self._(name)
+            if len(self._children) < self.max_memoized_children:
+                self._children[name] = child
+                child._memoized_in = (self._children, name)
+            return child
 
     def __getstate__(self):
-        return self.__dict__
+        state = self.__dict__.copy()
+        settings = self._opener_settings
+        if settings is not None:
+            # Openers may hold closures, the unpickled client builds the
+            # same one again from its settings. An opener given by the
+            # caller is pickled as is, or pickling fails.
+            if settings[2] is not None:
+                raise TypeError(
+                    "Can't pickle a Client with an ssl_context: SSL "
+                    "contexts can't be pickled")
+            state['opener'] = None
+        if isinstance(self.transport, UrllibTransport) and \
+                self.transport.opener is self.opener:
+            state['transport'] = None
+        # Caches are rebuilt on demand
+        state['_children'] = {}
+        state['_memoized_in'] = None
+        state['_base_headers'] = None
+        # Read-only mappings can't be pickled
+        state['_request_headers'] = dict(self._request_headers)
+        return state
 
     def __setstate__(self, state):
+        state['_request_headers'] = _frozen(state['_request_headers'])
         self.__dict__ = state
+        if self.opener is None:
+            # Not through __setattr__, which forgets the opener settings
+            state['opener'] = self._build_opener(*self._opener_settings)
+        if self.transport is None:
+            self.transport = self._default_transport()
@@ -0,0 +1,243 @@
+"""Content-Encoding of request and response bodies"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodings the Client can decode, in order of preference
+decodable_encodings = ['gzip', 'deflate']
+if brotli is not None:
+    decodable_encodings.append('br')
+if zstandard is not None:
+    decodable_encodings.append('zstd')
+
+ACCEPT_ENCODING = ', '.join(decodable_encodings)
+
+# Encodings the Client can compress request bodies with
+request_encodings = ['gzip']
+if zstandard is not None:
+    request_encodings.append('zstd')
+
+
+class _ZlibDecoder(object):
+
+    def __init__(self, wbits):
+        self._decoder = zlib.decompressobj(wbits)
+
+    def decompress(self, data):
+        return self._decoder.decompress(data)
+
+    def flush(self):
+        return self._decoder.flush()
+
+
+class _DeflateDecoder(_ZlibDecoder):
+    """'deflate' is meant to be zlib wrapped, but some servers send raw
+       deflate data"""
+
+    def __init__(self):
+        _ZlibDecoder.__init__(self, zlib.MAX_WBITS)
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._decoder.decompress(data)
+        self._first = False
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+
+class _BrotliDecoder(object):
+
+    def __init__(self):
+        self._decoder = brotli.Decompressor()
+
+    def decompress(self, data):
+        process = getattr(self._decoder, 'process', None)
+        if process is None:
+            return self._decoder.decompress(data)
+        return process(data)
+
+    def flush(self):
+        return b''
+
+
+class _ZstdDecoder(object):
+
+    def __init__(self):
+        self._decoder = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self._decoder.decompress(data)
+
+    def flush(self):
+        return b''
+
+
+class _ChainDecoder(object):
+    """Undoes several encodings, applied in the order listed"""
+
+    def __init__(self, decoders):
+        # The last encoding applied is undone first
+        self._decoders = decoders[::-1]
+
+    def decompress(self, data):
+        for decoder in self._decoders:
+            data = decoder.decompress(data)
+        return data
+
+    def flush(self):
+        data = b''
+        for decoder in self._decoders:
+            data = decoder.decompress(data) + decoder.flush()
+        return data
+
+
+_decoders = {
+    'gzip': lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+    'x-gzip': lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+    'deflate': _DeflateDecoder,
+}
+if brotli is not None:
+    _decoders['br'] = _BrotliDecoder
+if zstandard is not None:
+    _decoders['zstd'] = _ZstdDecoder
+
+
+def get_decoder(content_encoding):
+    """Build an incremental decoder for a Content-Encoding header value
+
+    :param content_encoding: Content-Encoding header value, or None
+    :type content_encoding: string
+    :return: object with decompress(data) and flush() methods, or None if
+             the body isn't encoded or the encoding is unknown
+    """
+    if not content_encoding:
+        return None
+    encodings = [encoding.strip().lower()
+                 for encoding in content_encoding.split(',')]
+    encodings = [encoding for encoding in encodings
+                 if encoding and encoding != 'identity']
+    if not encodings or \
+            not all(encoding in _decoders for encoding in encodings):
+        return None
+    decoders = [_decoders[encoding]() for encoding in encodings]
+    if len(decoders) == 1:
+        return decoders[0]
+    return _ChainDecoder(decoders)
+
+
+def content_encoding(headers):
+    """
+    :param headers: Response headers
+    :return: string, the Content-Encoding header value, or None
+    """
+    try:
+        return headers.get('Content-Encoding')
+    except AttributeError:
+        return None
+
+
+def decode_body(body, content_encoding):
+    """
+    :param body: Body as received
+    :type body: bytes
+    :param content_encoding: Content-Encoding header value, or None
+    :type content_encoding: string
+    :return: bytes, the decoded body
+    """
+    decoder = get_decoder(content_encoding)
+    if decoder is None or not body:
+        return body
+    return decoder.decompress(body) + decoder.flush()
+
+
+def compress_body(data, encoding, level=None):
+    """Encode a request body
+
+    :param data: Request body
+    :type data: bytes
+    :param encoding: 'gzip' or 'zstd'
+    :type encoding: string
+    :param level: Compression level, None for the library default
+    :type level: integer
+    :return: bytes
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(
+            6 if level is None else level, zlib.DEFLATED,
+            16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires zstandard')
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compress(data)
+    raise ValueError(
+        'Unsupported request encoding {!r}'.format(encoding))
+
+
+class DecodingReader(object):
+    """Wraps a urllib response, decoding its body as it is read. Anything
+       else is looked up on the wrapped response."""
+
+    def __init__(self, response, decoder):
+        """
+        :param response: The return value from a open call
+                         on a urllib.build_opener()
+        :type response:  urllib response object
+        :param decoder: Decoder from get_decoder
+        """
+        self._response = response
+        self._decoder = decoder
+        # Decoded bytes not read yet
+        self._pending = bytearray()
+        self._eof = False
+
+    def read(self, amt=None):
+        """
+        :param amt: Number of decoded bytes to read at most, None for all
+        :type amt: integer
+        :return: bytes, empty once the body has been read
+        """
+        pending = self._pending
+        if amt is None:
+            data = bytes(pending) + self._decode(self._response.read())
+            pending.clear()
+            return data + self._finish()
+        while len(pending) < amt and not self._eof:
+            chunk = self._response.read(amt)
+            if chunk:
+                pending += self._decode(chunk)
+            else:
+                pending += self._finish()
+        data = bytes(pending[:amt])
+        # Deleting from the front moves the start of the bytearray instead
+        # of copying the rest, so a small read costs its own size only
+        del pending[:amt]
+        return data
+
+    def _decode(self, chunk):
+        return self._decoder.decompress(chunk) if chunk else b''
+
+    def _finish(self):
+        if self._eof:
+            return b''
+        self._eof = True
+        return self._decoder.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
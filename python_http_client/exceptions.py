@@ -1,21 +1,54 @@
-import json
+from .jsoncodec import default_codec
 
 
 class HTTPError(Exception):
     """ Base of all other errors"""
 
-    def __init__(self, error):
-        self.status_code = error.code
-        self.reason = error.reason
-        self.body = error.read()
-        self.headers = error.hdrs
+    # JSON codec decoding the body in to_dict
+    codec = default_codec
+
+    def __init__(self, status_code, reason=None, headers=None, body=None,
+                 codec=None):
+        """
+        :param status_code: Status code of the response, or the
+                            urllib.error.HTTPError raised for it
+        :type status_code: integer
+        :param reason: Reason phrase of the response
+        :type reason: string
+        :param headers: Headers of the response
+        :param body: Body of the response
+        :type body: bytes
+        :param codec: JSON codec decoding the body in to_dict
+        :type codec: JSONCodec
+        """
+        if hasattr(status_code, 'read'):
+            error = status_code
+            status_code, reason, headers, body = \
+                error.code, error.reason, error.hdrs, error.read()
+        # Pickled and unpickled with these arguments
+        super(HTTPError, self).__init__(status_code, reason, headers, body)
+        self.status_code = status_code
+        self.reason = reason
+        self.body = body
+        self.headers = headers
+        if codec is not None:
+            self.codec = codec
+
+    def __str__(self):
+        return 'HTTP Error {}: {}'.format(self.status_code, self.reason)
 
     @property
     def to_dict(self):
         """
-        :return: dict of response error from the API
+        :return: dict of response error from the API, decoded on first
+                 access
         """
-        return json.loads(self.body.decode('utf-8'))
+        try:
+            return self._dict
+        except AttributeError:
+            pass
+        self._dict = self.codec.loads(self.body)
+        return self._dict
 
 
 class BadRequestsError(HTTPError):
@@ -77,9 +110,31 @@ err_dict = {
 }
 
 
-def handle_error(error):
+def handle_error(error, codec=None):
+    """
+    :param error: Error raised by urllib for the response
+    :type error: urllib.error.HTTPError
+    :param codec: JSON codec decoding the body in to_dict
+    :return: HTTPError, of the class of the status code
+    """
     try:
-        exc = err_dict[error.code](error)
+        exc = err_dict[error.code](error, codec=codec)
     except KeyError:
-        return HTTPError(error)
+        return HTTPError(error, codec=codec)
     return exc
+
+
+def error_from_response(status_code, reason, headers, body, codec=None):
+    """
+    :param status_code: Status code of the response
+    :type status_code: integer
+    :param reason: Reason phrase of the response
+    :type reason: string
+    :param headers: Headers of the response
+    :param body: Body of the response
+    :type body: bytes
+    :param codec: JSON codec decoding the body in to_dict
+    :return: HTTPError, of the class of the status code
+    """
+    return err_dict.get(status_code, HTTPError)(
+        status_code, reason, headers, body, codec=codec)
@@ -0,0 +1,271 @@
+"""Event hooks of the API calls and the timings of their phases"""
+import socket
+import threading
+from functools import partial
+
+import http.client as httplib
+
+from .retry import _monotonic
+
+EVENTS = ('before_request', 'after_response', 'on_error', 'on_retry')
+
+
+class Timings(object):
+    """Monotonic timestamps (time.monotonic) of the phases of one attempt
+       at an API call, and the bytes it moved.
+
+    Phases the transport doesn't report (e.g. DNS on a kept-alive
+    connection) stay None. For a streamed response, body_end and
+    bytes_received are filled in as the body is read, and decode_start and
+    decode_end once to_dict is first read.
+    """
+
+    __slots__ = ('start', 'dns_start', 'dns_end', 'connect_start',
+                 'connect_end', 'tls_start', 'tls_end', 'request_sent',
+                 'first_byte', 'body_end', 'decode_start', 'decode_end',
+                 'bytes_sent', 'bytes_received')
+
+    def __init__(self):
+        self.start = _monotonic()
+        self.dns_start = self.dns_end = None
+        self.connect_start = self.connect_end = None
+        self.tls_start = self.tls_end = None
+        self.request_sent = self.first_byte = self.body_end = None
+        self.decode_start = self.decode_end = None
+        # Sizes of the request body and of the response body as read
+        # from the transport, before decompression by the Client
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @staticmethod
+    def _duration(start, end):
+        if start is None or end is None:
+            return None
+        return end - start
+
+    @property
+    def dns(self):
+        """
+        :return: seconds spent resolving the host name, or None
+        """
+        return self._duration(self.dns_start, self.dns_end)
+
+    @property
+    def connect(self):
+        """
+        :return: seconds spent opening the connection, or None
+        """
+        return self._duration(self.connect_start, self.connect_end)
+
+    @property
+    def tls(self):
+        """
+        :return: seconds spent in the TLS handshake, or None
+        """
+        return self._duration(self.tls_start, self.tls_end)
+
+    @property
+    def ttfb(self):
+        """
+        :return: seconds from the start of the call to the response
+                 headers (time to first byte), or None
+        """
+        return self._duration(self.start, self.first_byte)
+
+    @property
+    def body(self):
+        """
+        :return: seconds spent reading the response body, or None
+        """
+        return self._duration(self.first_byte, self.body_end)
+
+    @property
+    def decode(self):
+        """
+        :return: seconds spent decoding the JSON body, or None
+        """
+        return self._duration(self.decode_start, self.decode_end)
+
+    @property
+    def total(self):
+        """
+        :return: seconds from the start of the call to the end of the
+                 body, or None
+        """
+        return self._duration(self.start, self.body_end)
+
+    def __repr__(self):
+        return '<Timings ttfb={} total={} sent={} received={}>'.format(
+            self.ttfb, self.total, self.bytes_sent, self.bytes_received)
+
+
+class Hooks(object):
+    """Callbacks run around the API calls of a Client, shared with every
+       Client derived from it.
+
+    - before_request(request, timings): the request is about to be sent,
+      its headers may still be changed
+    - after_response(request, response, timings)
+    - on_error(request, error, timings): the call raised error
+    - on_retry(request, error, attempt, delay, timings): attempt failed
+      with error and is sent again in delay seconds
+
+    timings is the Timings of the attempt. Exceptions raised by a hook
+    propagate to the caller. Calls are only timed while at least one hook
+    is registered.
+    """
+
+    def __init__(self, **hooks):
+        """
+        :param hooks: Callable or list of callables by event name
+                      (e.g. after_response=log_response)
+        """
+        self._hooks = dict((event, []) for event in EVENTS)
+        # Number of registered hooks, read on every call
+        self._count = 0
+        for event, callbacks in hooks.items():
+            if callable(callbacks):
+                callbacks = [callbacks]
+            for callback in callbacks:
+                self.register(event, callback)
+
+    def register(self, event, hook=None):
+        """Run hook on event. Without hook, returns a decorator.
+
+        :param event: 'before_request', 'after_response', 'on_error' or
+                      'on_retry'
+        :type event: string
+        :param hook: The callable to run
+        :return: hook
+        """
+        if event not in self._hooks:
+            raise ValueError('Unknown event {!r}'.format(event))
+        if hook is None:
+            return partial(self.register, event)
+        self._hooks[event].append(hook)
+        self._count += 1
+        return hook
+
+    def unregister(self, event, hook):
+        """Stop running hook on event"""
+        self._hooks[event].remove(hook)
+        self._count -= 1
+
+    def __bool__(self):
+        """
+        :return: boolean, True if any hook is registered
+        """
+        return self._count > 0
+
+    def fire(self, event, *args):
+        """Run the hooks of event with args"""
+        for hook in self._hooks[event]:
+            hook(*args)
+
+
+def get_hooks(hooks=None):
+    """Resolve the hooks setting of a Client
+
+    :param hooks: Hooks to share, or a dictionary of callables (or lists
+                  of callables) by event name; None for no hooks
+    :type hooks: Hooks or dictionary
+    :return: Hooks or None
+    """
+    if hooks is None or isinstance(hooks, Hooks):
+        return hooks
+    return Hooks(**hooks)
+
+
+# Timings of the attempt the current thread is making, read by the
+# connections of the pool
+_current = threading.local()
+
+
+def current_timings():
+    """
+    :return: Timings of the attempt in progress in this thread, or None
+    """
+    return getattr(_current, 'timings', None)
+
+
+def set_current_timings(timings):
+    """
+    :param timings: Timings of the attempt starting in this thread, or
+                    None once it is over
+    :return: the Timings it replaces
+    """
+    previous = getattr(_current, 'timings', None)
+    _current.timings = timings
+    return previous
+
+
+def _create_connection(timings, address,
+                       timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                       source_address=None):
+    """socket.create_connection recording the DNS and connect phases"""
+    host, port = address
+    timings.dns_start = _monotonic()
+    infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    timings.dns_end = timings.connect_start = _monotonic()
+    error = None
+    for family, socktype, proto, _, sockaddr in infos:
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            timings.connect_end = _monotonic()
+            return sock
+        except socket.error as err:
+            error = err
+            if sock is not None:
+                sock.close()
+    raise error or socket.error('getaddrinfo returned an empty list')
+
+
+def traced_connect(conn, timings):
+    """Open conn, recording the DNS, connect and TLS phases in timings
+
+    :param conn: A new, unconnected connection
+    :type conn: http.client.HTTPConnection
+    :param timings: Timings of the attempt opening it
+    :type timings: Timings
+    """
+    create_connection = conn._create_connection
+    conn._create_connection = partial(_create_connection, timings)
+    try:
+        conn.connect()
+    finally:
+        conn._create_connection = create_connection
+    if isinstance(conn, httplib.HTTPSConnection):
+        timings.tls_start = timings.connect_end
+        timings.tls_end = _monotonic()
+
+
+class CountingReader(object):
+    """Wraps a urllib response, counting the bytes read from it in
+       timings. Anything else is looked up on the wrapped response."""
+
+    def __init__(self, response, timings):
+        """
+        :param response: urllib-like response
+        :param timings: Timings of the attempt
+        :type timings: Timings
+        """
+        self._response = response
+        self._timings = timings
+
+    def read(self, amt=None):
+        data = self._response.read() if amt is None else \
+            self._response.read(amt)
+        timings = self._timings
+        timings.bytes_received += len(data)
+        if amt is None or not data:
+            timings.body_end = _monotonic()
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
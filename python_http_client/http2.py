@@ -0,0 +1,461 @@
+"""HTTP/2 transport for AsyncClient, built on the h2 library"""
+import asyncio
+import collections
+import ssl
+from http.client import responses
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+import h2.config
+import h2.connection
+import h2.errors
+import h2.events
+import h2.exceptions
+import h2.settings
+from multidict import CIMultiDict, CIMultiDictProxy
+
+from .async_transport import AsyncTransport, aiter_chunks
+from .body import BINARY_TYPES, body_length
+
+# Connection-specific headers, which HTTP/2 forbids, and Content-Length,
+# computed from the body
+_DROPPED_HEADERS = frozenset([
+    'connection', 'content-length', 'host', 'keep-alive',
+    'proxy-connection', 'transfer-encoding', 'upgrade',
+])
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Bytes a stream may receive before its body is read (and before the
+# server has to wait); the connection may receive 16 times as much
+_STREAM_WINDOW = 1024 * 1024
+_CONNECTION_WINDOW = 16 * _STREAM_WINDOW
+
+
+def _decode_header(value):
+    return value.decode('utf-8', 'surrogateescape')
+
+
+class HTTP2StreamReader:
+    """Body of an HTTP/2 response, filled as DATA frames arrive.
+
+    Flow control credit is given back to the server as the body is read,
+    so a slow reader slows the server down instead of buffering the body.
+    """
+
+    def __init__(self, connection, stream_id):
+        self._connection = connection
+        self._stream_id = stream_id
+        # (data, flow controlled length) not read yet
+        self._chunks = collections.deque()
+        self._eof = False
+        self._error = None
+        self._waiter = asyncio.Event()
+
+    def at_eof(self):
+        return self._eof and not self._chunks
+
+    def feed_data(self, data, flow_controlled_length):
+        self._chunks.append((data, flow_controlled_length))
+        self._waiter.set()
+
+    def feed_eof(self):
+        self._eof = True
+        self._waiter.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._waiter.set()
+
+    async def readany(self):
+        """
+        :return: bytes received so far, empty at the end of the body
+        """
+        while not self._chunks:
+            if self._error is not None:
+                raise self._error
+            if self._eof:
+                return b''
+            self._waiter.clear()
+            await self._waiter.wait()
+        data, flow_controlled_length = self._chunks.popleft()
+        self._connection.acknowledge(self._stream_id, flow_controlled_length)
+        return data
+
+    async def read(self, n=-1):
+        """
+        :param int n: Number of bytes to read at most, -1 for all
+        :return: bytes, empty at the end of the body
+        """
+        if n < 0:
+            chunks = []
+            chunk = await self.readany()
+            while chunk:
+                chunks.append(chunk)
+                chunk = await self.readany()
+            return b''.join(chunks)
+        data = await self.readany()
+        if len(data) > n:
+            # Keep the rest, its credit has been given back already
+            self._chunks.appendleft((data[n:], 0))
+            data = data[:n]
+        return data
+
+    async def iter_chunked(self, n):
+        """Iterate over the body in chunks of at most n bytes"""
+        chunk = await self.read(n)
+        while chunk:
+            yield chunk
+            chunk = await self.read(n)
+
+
+class HTTP2Response:
+    """Response of an HTTP2Transport, read like an aiohttp.ClientResponse"""
+
+    def __init__(self, stream, status, headers):
+        self._stream = stream
+        self.status = status
+        # HTTP/2 has no reason phrase, this is the standard one
+        self.reason = responses.get(status, '')
+        self.headers = headers
+        self.content = stream.reader
+        self._body = None
+
+    async def read(self):
+        """
+        :return: bytes, the whole body
+        """
+        if self._body is None:
+            self._body = await self.content.read()
+        return self._body
+
+    async def text(self, encoding=None):
+        """
+        :param str encoding: Defaults to the charset of the Content-Type,
+                             or utf-8
+        :return: str, the whole body
+        """
+        body = await self.read()
+        if encoding is None:
+            content_type = self.headers.get('Content-Type', '')
+            _, _, charset = content_type.partition('charset=')
+            encoding = charset.split(';')[0].strip('" ') or 'utf-8'
+        return body.decode(encoding)
+
+    def release(self):
+        """Stop receiving the body, if it wasn't read to the end"""
+        if not self.content.at_eof():
+            self._stream.cancel()
+
+
+class _Stream:
+
+    def __init__(self, connection, stream_id):
+        self.connection = connection
+        self.stream_id = stream_id
+        self.headers = asyncio.get_running_loop().create_future()
+        self.reader = HTTP2StreamReader(connection, stream_id)
+
+    def fail(self, error):
+        if not self.headers.done():
+            self.headers.set_exception(error)
+        self.reader.set_exception(error)
+
+    def cancel(self):
+        self.connection.reset(self.stream_id)
+
+
+class _Connection:
+    """An HTTP/2 connection and the streams multiplexed over it"""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._h2 = h2.connection.H2Connection(h2.config.H2Configuration(
+            client_side=True, header_encoding=None))
+        self._h2.local_settings = h2.settings.Settings(
+            client=True, initial_values={
+                h2.settings.SettingCodes.ENABLE_PUSH: 0,
+                h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: _STREAM_WINDOW,
+            })
+        self._h2.initiate_connection()
+        self._h2.increment_flow_control_window(
+            _CONNECTION_WINDOW - self._h2.inbound_flow_control_window)
+        self._streams = {}
+        # Set whenever the server may accept more data or more streams
+        self._progress = asyncio.Event()
+        self.closed = False
+        self._flush()
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    def _flush(self):
+        data = self._h2.data_to_send()
+        if data:
+            self._writer.write(data)
+
+    async def _wait_for_progress(self):
+        self._progress.clear()
+        await self._progress.wait()
+        if self.closed:
+            raise URLError('HTTP/2 connection closed')
+
+    async def send_request(self, headers, data):
+        """
+        :param list headers: Request headers, pseudo-headers first
+        :param data: Request body: bytes-like, a file object, an iterator
+                     or async iterable of bytes, or None
+        :return: _Stream
+        """
+        while self._h2.open_outbound_streams >= \
+                self._h2.remote_settings.max_concurrent_streams:
+            await self._wait_for_progress()
+        if self.closed:
+            raise URLError('HTTP/2 connection closed')
+        stream_id = self._h2.get_next_available_stream_id()
+        stream = self._streams[stream_id] = _Stream(self, stream_id)
+        try:
+            self._h2.send_headers(stream_id, headers, end_stream=not data)
+            self._flush()
+            if data:
+                await self._send_body(stream_id, data)
+            await self._writer.drain()
+        except (h2.exceptions.H2Error, OSError) as e:
+            self._streams.pop(stream_id, None)
+            raise URLError(str(e))
+        return stream
+
+    async def _send_body(self, stream_id, data):
+        if isinstance(data, BINARY_TYPES):
+            await self._send_data(stream_id, data)
+        else:
+            async for chunk in aiter_chunks(data):
+                await self._send_data(stream_id, chunk)
+        self._h2.end_stream(stream_id)
+        self._flush()
+
+    async def _send_data(self, stream_id, data):
+        """Send data in DATA frames as the flow control windows allow"""
+        view = memoryview(data).cast('B')
+        while view:
+            window = min(self._h2.local_flow_control_window(stream_id),
+                         self._h2.max_outbound_frame_size)
+            if window <= 0:
+                await self._wait_for_progress()
+                continue
+            self._h2.send_data(stream_id, view[:window].tobytes())
+            view = view[window:]
+            self._flush()
+            await self._writer.drain()
+
+    def acknowledge(self, stream_id, flow_controlled_length):
+        if not flow_controlled_length or self.closed:
+            return
+        try:
+            self._h2.acknowledge_received_data(
+                flow_controlled_length, stream_id)
+        except h2.exceptions.StreamClosedError:
+            # Only the connection window is credited then
+            return
+        self._flush()
+
+    def reset(self, stream_id):
+        self._streams.pop(stream_id, None)
+        if self.closed:
+            return
+        try:
+            self._h2.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+        except h2.exceptions.StreamClosedError:
+            return
+        self._flush()
+
+    async def _read_loop(self):
+        error = URLError('HTTP/2 connection closed')
+        try:
+            while True:
+                data = await self._reader.read(65536)
+                if not data:
+                    break
+                for event in self._h2.receive_data(data):
+                    self._handle(event)
+                self._flush()
+        except (h2.exceptions.H2Error, OSError) as e:
+            error = URLError(str(e))
+        finally:
+            self._terminate(error)
+
+    def _handle(self, event):
+        stream = self._streams.get(getattr(event, 'stream_id', None))
+        if isinstance(event, h2.events.ResponseReceived):
+            if stream is not None and not stream.headers.done():
+                stream.headers.set_result(event.headers)
+        elif isinstance(event, h2.events.DataReceived):
+            if stream is not None:
+                stream.reader.feed_data(
+                    event.data, event.flow_controlled_length)
+            else:
+                # Body of a cancelled stream: give the credit back
+                self._h2.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            if stream is not None:
+                stream.reader.feed_eof()
+                del self._streams[event.stream_id]
+            self._progress.set()
+        elif isinstance(event, h2.events.StreamReset):
+            if stream is not None:
+                stream.fail(URLError('HTTP/2 stream reset by the server '
+                                     '(error {})'.format(event.error_code)))
+                del self._streams[event.stream_id]
+            self._progress.set()
+        elif isinstance(event, (h2.events.WindowUpdated,
+                                h2.events.RemoteSettingsChanged)):
+            self._progress.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            # Streams the server didn't process can be sent again
+            # on a new connection
+            self.closed = True
+            error = URLError('HTTP/2 connection closed by the server '
+                             '(error {})'.format(event.error_code))
+            for stream_id in list(self._streams):
+                if event.last_stream_id is None or \
+                        stream_id > event.last_stream_id:
+                    self._streams.pop(stream_id).fail(error)
+            self._progress.set()
+
+    def _terminate(self, error):
+        self.closed = True
+        streams, self._streams = self._streams, {}
+        for stream in streams.values():
+            stream.fail(error)
+        self._progress.set()
+        self._writer.close()
+
+    async def close(self):
+        if not self.closed:
+            self._h2.close_connection()
+            self._flush()
+        self._read_task.cancel()
+        self._terminate(URLError('HTTP/2 connection closed'))
+
+
+class _HTTP2Request:
+
+    def __init__(self, transport, method, url, headers, data, timeout):
+        self._call = transport._send(method, url, headers, data)
+        self._timeout = timeout
+        self._response = None
+
+    async def __aenter__(self):
+        if isinstance(self._timeout, (int, float)):
+            self._response = await asyncio.wait_for(self._call, self._timeout)
+        else:
+            self._response = await self._call
+        return self._response
+
+    async def __aexit__(self, *exc_info):
+        self._response.release()
+
+
+class HTTP2Transport(AsyncTransport):
+    """Multiplexes every call to a host over a single HTTP/2 connection.
+
+    https URLs negotiate HTTP/2 with ALPN; http URLs speak HTTP/2 right
+    away (prior knowledge, h2c). The number of calls in flight per
+    connection follows the server's SETTINGS_MAX_CONCURRENT_STREAMS,
+    further calls wait for a stream to finish. Requires the h2 package.
+    """
+
+    def __init__(self, ssl_context=None):
+        """
+        :param ssl.SSLContext ssl_context: TLS settings of https
+                                           connections, optional. Its
+                                           ALPN protocols are set to h2.
+        """
+        self.ssl_context = ssl_context
+        # (scheme, host, port) -> _Connection
+        self._connections = {}
+        # (scheme, host, port) -> Task opening the connection
+        self._connecting = {}
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        return _HTTP2Request(self, method, url, headers, data, timeout)
+
+    async def _send(self, method, url, headers, data):
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or _DEFAULT_PORTS[scheme]
+        path = parts.path or '/'
+        if parts.query:
+            path = '{}?{}'.format(path, parts.query)
+        request_headers = [
+            (':method', method),
+            (':scheme', scheme),
+            (':authority', parts.netloc),
+            (':path', path),
+        ]
+        request_headers.extend(
+            (name.lower(), str(value))
+            for name, value in (headers or {}).items()
+            if name.lower() not in _DROPPED_HEADERS)
+        if data is not None:
+            # Left out when unknown, the end of the stream ends the body
+            length = body_length(data)
+            if length is not None:
+                request_headers.append(('content-length', str(length)))
+
+        connection = await self._get_connection(
+            scheme, parts.hostname, port)
+        stream = await connection.send_request(request_headers, data)
+        try:
+            raw_headers = await stream.headers
+        except asyncio.CancelledError:
+            stream.cancel()
+            raise
+        headers = CIMultiDict()
+        status = None
+        for name, value in raw_headers:
+            if name == b':status':
+                status = int(value)
+            elif not name.startswith(b':'):
+                headers.add(_decode_header(name), _decode_header(value))
+        return HTTP2Response(stream, status, CIMultiDictProxy(headers))
+
+    async def _get_connection(self, scheme, host, port):
+        key = (scheme, host, port)
+        connection = self._connections.get(key)
+        if connection is not None and not connection.closed:
+            return connection
+        # Calls arriving while the connection is opened share it
+        task = self._connecting.get(key)
+        if task is None:
+            task = self._connecting[key] = asyncio.ensure_future(
+                self._connect(scheme, host, port))
+            task.add_done_callback(
+                lambda _: self._connecting.pop(key, None))
+        connection = await asyncio.shield(task)
+        self._connections[key] = connection
+        return connection
+
+    async def _connect(self, scheme, host, port):
+        context = None
+        if scheme == 'https':
+            context = self.ssl_context or ssl.create_default_context()
+            context.set_alpn_protocols(['h2'])
+        try:
+            reader, writer = await asyncio.open_connection(
+                host, port, ssl=context)
+        except OSError as e:
+            raise URLError(e.strerror or str(e))
+        if context is not None:
+            protocol = writer.get_extra_info(
+                'ssl_object').selected_alpn_protocol()
+            if protocol != 'h2':
+                writer.close()
+                raise URLError('{}:{} does not support HTTP/2'.format(
+                    host, port))
+        return _Connection(reader, writer)
+
+    async def close(self):
+        connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            await connection.close()
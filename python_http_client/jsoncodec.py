@@ -0,0 +1,109 @@
+"""JSON codecs used to encode request bodies and decode response bodies"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    """Standard library codec. Subclass it to plug in another library:
+       dumps must return bytes and loads must accept bytes."""
+
+    name = 'json'
+
+    def dumps(self, obj):
+        """
+        :param obj: JSON-serializable object
+        :return: bytes
+        """
+        return json.dumps(obj).encode('utf-8')
+
+    def loads(self, data):
+        """
+        :param data: JSON document
+        :type data: bytes or string
+        :return: decoded object
+        """
+        return json.loads(data)
+
+    # Codecs hold no state, any two of the same kind are interchangeable
+    def __eq__(self, other):
+        return type(self) is type(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(type(self))
+
+
+class OrjsonCodec(JSONCodec):
+    """Codec backed by orjson"""
+
+    name = 'orjson'
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Accepted by json but not by orjson (e.g. integers beyond
+            # 64 bits)
+            return JSONCodec.dumps(self, obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    """Codec backed by ujson"""
+
+    name = 'ujson'
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj).encode('utf-8')
+        except (OverflowError, TypeError):
+            # Accepted by json but not by ujson (e.g. integers beyond
+            # 64 bits)
+            return JSONCodec.dumps(self, obj)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+available_codecs = {'json': JSONCodec}
+if ujson is not None:
+    available_codecs['ujson'] = UjsonCodec
+if orjson is not None:
+    available_codecs['orjson'] = OrjsonCodec
+
+# The fastest codec installed
+default_codec = (OrjsonCodec if orjson is not None else
+                 UjsonCodec if ujson is not None else
+                 JSONCodec)()
+
+
+def get_codec(codec=None):
+    """Resolve the codec setting of a Client
+
+    :param codec: None for the fastest installed codec, the name of a
+                  codec ('orjson', 'ujson' or 'json') or a JSONCodec
+    :type codec: string or JSONCodec
+    :return: JSONCodec
+    """
+    if codec is None:
+        return default_codec
+    if isinstance(codec, str):
+        try:
+            return available_codecs[codec]()
+        except KeyError:
+            raise ValueError(
+                'JSON codec {!r} is not installed'.format(codec))
+    return codec
@@ -0,0 +1,164 @@
+"""Incremental decoding of the items of a JSON array"""
+import codecs
+import json
+import re
+
+# Rest of a string literal, up to and including the closing quote
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_SCALAR = re.compile(r'[^ \t\n\r,:\[\]{}"]*')
+
+
+class ArrayItemParser(object):
+    """Decode the items of a JSON array one at a time from a byte stream.
+
+    Only the text of the item currently being read is kept in memory, so
+    the memory peak is bounded by the largest item rather than by the size
+    of the document.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: Dotted keys leading to the array
+                     (e.g. 'result.items'), or None if the document itself
+                     is the array
+        :type path: string or list of strings
+        """
+        if path is None:
+            path = []
+        elif not isinstance(path, (list, tuple)):
+            path = path.split('.')
+        self._target = list(path)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._decode = json.JSONDecoder().raw_decode
+        self._buf = u''
+        # Containers around the current position while looking for the
+        # array: [key of the current value, expecting a key]
+        self._stack = []
+        self._in_array = False
+        self._expect_comma = False
+        self._done = False
+
+    def feed(self, chunk):
+        """Consume the next chunk of the document
+
+        :param chunk: The next bytes of the document
+        :type chunk: bytes
+        :return: list of the items completed by this chunk
+        """
+        if self._done:
+            return []
+        self._buf += self._text.decode(chunk)
+        return self._parse(final=False)
+
+    def close(self):
+        """Signal the end of the document
+
+        :return: list of the items completed by the end of the document
+        :raises ValueError: the document ended before the array did
+        """
+        items = [] if self._done else self._parse(final=True)
+        if not self._done:
+            raise ValueError(
+                'JSON document ended before the end of the array at '
+                '{!r}'.format('.'.join(self._target)))
+        return items
+
+    def _parse(self, final):
+        items = []
+        pos = 0
+        if not self._in_array:
+            pos = self._find_array(pos, final)
+        if self._in_array:
+            pos = self._read_items(pos, final, items)
+        self._buf = self._buf[pos:]
+        return items
+
+    def _at_target(self):
+        if len(self._stack) != len(self._target):
+            return False
+        return all(frame[0] == key
+                   for frame, key in zip(self._stack, self._target))
+
+    def _not_an_array(self):
+        return ValueError('Value at {!r} is not an array'.format(
+            '.'.join(self._target)))
+
+    def _find_array(self, pos, final):
+        buf = self._buf
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                return pos
+            char = buf[pos]
+            frame = self._stack[-1] if self._stack else None
+            if char == '"':
+                match = _STRING_END.match(buf, pos + 1)
+                if match is None:
+                    return pos
+                if frame is not None and frame[1]:
+                    frame[0] = json.loads(buf[pos:match.end()])
+                    frame[1] = False
+                elif self._at_target():
+                    raise self._not_an_array()
+                pos = match.end()
+            elif char == ',':
+                if frame is not None and frame[1] is False:
+                    frame[1] = True
+                pos += 1
+            elif char == ':':
+                pos += 1
+            elif char in '}]':
+                self._stack.pop()
+                pos += 1
+            elif char == '[' and self._at_target():
+                self._in_array = True
+                return pos + 1
+            elif char == '[':
+                # Arrays off the path can't lead to the target
+                self._stack.append([None, None])
+                pos += 1
+            elif self._at_target():
+                raise self._not_an_array()
+            elif char == '{':
+                self._stack.append([None, True])
+                pos += 1
+            else:
+                end = _SCALAR.match(buf, pos).end()
+                if end >= len(buf) and not final:
+                    return pos
+                pos = end
+
+    def _read_items(self, pos, final, items):
+        buf = self._buf
+        decode = self._decode
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                return pos
+            char = buf[pos]
+            if char == ']':
+                self._done = True
+                return len(buf)
+            if self._expect_comma:
+                if char != ',':
+                    raise ValueError(
+                        'Expecting \',\' delimiter at {!r}'.format(
+                            buf[pos:pos + 20]))
+                self._expect_comma = False
+                pos += 1
+                continue
+            if char not in '{["' and not final and \
+                    _SCALAR.match(buf, pos).end() >= len(buf):
+                # A number might continue in the next chunk
+                return pos
+            try:
+                item, end = decode(buf, pos)
+            except ValueError:
+                # Most likely the item continues in the next chunk
+                if final:
+                    raise
+                return pos
+            items.append(item)
+            self._expect_comma = True
+            pos = end
@@ -0,0 +1,119 @@
+"""Streaming multipart/form-data request bodies"""
+import mimetypes
+import os
+import uuid
+
+from .body import BINARY_TYPES, EncodedBody
+
+
+def _quote(value):
+    """Escape a name or filename of Content-Disposition like browsers do"""
+    return value.replace('"', '%22').replace('\r', '%0D').replace(
+        '\n', '%0A')
+
+
+class MultipartEncoder(EncodedBody):
+    """multipart/form-data body sent part by part, without building it in
+       memory. Files are read as they are sent and the Content-Length is
+       known up front when the size of every part is (bytes, seekable
+       files), so that no chunked encoding is needed.
+
+    Pass it as the request_body of Client or AsyncClient, which sets the
+    Content-Type and its boundary:
+
+        encoder = MultipartEncoder({'list_id': '42'})
+        encoder.add_file('file', open('contacts.csv', 'rb'))
+        client.contactdb.recipients.post(request_body=encoder)
+    """
+
+    def __init__(self, fields=None, files=None, boundary=None):
+        """
+        :param fields: Text fields: a dictionary or a list of
+                       (name, value) pairs, see add_field
+        :param files: File fields: a dictionary or a list of
+                      (name, file) pairs, file being the body of add_file
+                      or a tuple of its (body, filename, content_type)
+        :param boundary: Delimiter of the parts, random by default
+        :type boundary: string
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        # (headers, body) of every part
+        self._parts = []
+        self._segments = None
+        for name, value in _items(fields):
+            self.add_field(name, value)
+        for name, value in _items(files):
+            if isinstance(value, tuple):
+                self.add_file(name, *value)
+            else:
+                self.add_file(name, value)
+
+    def add_field(self, name, value):
+        """Add a text field
+
+        :param name: Name of the field
+        :type name: string
+        :param value: Value, str encoded as UTF-8, or bytes
+        :type value: string or bytes
+        """
+        if not isinstance(value, BINARY_TYPES):
+            value = u'{}'.format(value).encode('utf-8')
+        self._add(u'form-data; name="{}"'.format(_quote(name)), None, value)
+
+    def add_file(self, name, body, filename=None, content_type=None):
+        """Add a file field
+
+        :param name: Name of the field
+        :type name: string
+        :param body: Content: bytes-like, a file object read from its
+                     current position, an iterator of bytes, or an async
+                     iterable of bytes for AsyncClient
+        :param filename: Name of the file, by default the base name of
+                         body.name
+        :type filename: string
+        :param content_type: By default guessed from filename, else
+                             application/octet-stream
+        :type content_type: string
+        """
+        if filename is None:
+            path = getattr(body, 'name', None)
+            filename = os.path.basename(path) if \
+                isinstance(path, str) else name
+        if content_type is None:
+            content_type = mimetypes.guess_type(filename)[0] or \
+                'application/octet-stream'
+        self._add(u'form-data; name="{}"; filename="{}"'.format(
+            _quote(name), _quote(filename)), content_type, body)
+
+    def _add(self, disposition, content_type, body):
+        headers = u'Content-Disposition: {}\r\n'.format(disposition)
+        if content_type is not None:
+            headers += u'Content-Type: {}\r\n'.format(content_type)
+        self._parts.append((headers.encode('utf-8'), body))
+        self._segments = None
+
+    def segments(self):
+        segments = self._segments
+        if segments is None:
+            delimiter = u'--{}'.format(self.boundary).encode('ascii')
+            segments = []
+            # The CRLF ending a part goes out with the next delimiter
+            separator = b''
+            for headers, body in self._parts:
+                segments.append(
+                    separator + delimiter + b'\r\n' + headers + b'\r\n')
+                segments.append(body)
+                separator = b'\r\n'
+            segments.append(separator + delimiter + b'--\r\n')
+            self._segments = segments
+        return segments
+
+
+def _items(fields):
+    if fields is None:
+        return []
+    if hasattr(fields, 'items'):
+        return list(fields.items())
+    return fields
@@ -0,0 +1,384 @@
+"""Keep-alive connection pooling for the synchronous Client"""
+import os
+import select
+import socket
+import stat
+import threading
+import time
+from functools import partial
+
+from .body import EncodedBody, is_replayable, iter_chunks
+from .hooks import current_timings, traced_connect
+from .retry import Retry
+
+import http.client as httplib
+import urllib.request as urllib
+from urllib.error import URLError
+
+_monotonic = time.monotonic
+
+# A reused socket the server has already dropped fails with one of these
+_STALE_ERRORS = (ConnectionError, httplib.BadStatusLine)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of persistent HTTP/1.1 connections, keyed per host.
+
+    Connections are checked out for the duration of a single request and
+    handed back once the response body has been read (or the response
+    closed). A Client shares one pool with every Client derived from it.
+    """
+
+    def __init__(self,
+                 max_connections_per_host=10,
+                 idle_timeout=60,
+                 max_lifetime=None,
+                 pool_timeout=30):
+        """
+        :param max_connections_per_host: Upper bound of open connections
+                                         to a single host; callers block
+                                         until one is free. None for no
+                                         limit.
+        :type max_connections_per_host: integer
+        :param idle_timeout: Seconds an unused connection is kept open.
+                             None to keep it until the server drops it.
+        :type idle_timeout: float
+        :param max_lifetime: Seconds after which a connection is retired,
+                             whether idle or not. None for no limit.
+        :type max_lifetime: float
+        :param pool_timeout: Seconds a call waits for a free connection
+                             once the limit is reached (the call's timeout
+                             if shorter), e.g. while unclosed streamed
+                             responses hold them. None to wait as long as
+                             it takes.
+        :type pool_timeout: float
+        """
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.pool_timeout = pool_timeout
+        self._reset()
+
+    def _reset(self):
+        self._cond = threading.Condition(threading.Lock())
+        # key -> list of idle connections, most recently used last
+        self._idle = {}
+        # key -> number of open connections, idle or checked out
+        self._open = {}
+
+    def _expired(self, conn, now):
+        if conn.sock is None or _dropped(conn.sock):
+            return True
+        if self.idle_timeout is not None and \
+                now - conn._pool_last_used > self.idle_timeout:
+            return True
+        if self.max_lifetime is not None and \
+                now - conn._pool_created > self.max_lifetime:
+            return True
+        return False
+
+    def acquire(self, key, factory, timeout=None):
+        """Check out a connection for key, creating one with factory()
+           if no idle connection is available.
+
+        :param key: Hashable identifying the origin (scheme, host, ...)
+        :param factory: Callable returning a new, unconnected connection
+        :param timeout: Seconds to wait at most for a free connection, if
+                        shorter than pool_timeout
+        :type timeout: float
+        :return: tuple of (connection, reused)
+        :raises URLError: no connection was freed in time
+        """
+        wait = self.pool_timeout
+        if timeout is not None and (wait is None or timeout < wait):
+            wait = timeout
+        deadline = None if wait is None else _monotonic() + wait
+        with self._cond:
+            while True:
+                now = _monotonic()
+                idle = self._idle.get(key)
+                while idle:
+                    conn = idle.pop()
+                    if not self._expired(conn, now):
+                        return conn, True
+                    conn.close()
+                    self._open[key] -= 1
+                limit = self.max_connections_per_host
+                if limit is None or self._open.get(key, 0) < limit:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    raise URLError(socket.timeout(
+                        'No pooled connection freed within {} seconds'
+                        .format(wait)))
+                self._cond.wait(remaining)
+        try:
+            conn = factory()
+        except Exception:
+            self._forget(key)
+            raise
+        conn._pool_created = conn._pool_last_used = _monotonic()
+        return conn, False
+
+    def release(self, key, conn, reusable=True):
+        """Return a checked out connection to the pool.
+
+        :param key: The key the connection was acquired with
+        :param conn: The connection
+        :param reusable: False if the connection is in an unknown state
+                         (e.g. the response body was not fully read)
+        :type reusable: boolean
+        """
+        now = _monotonic()
+        conn._pool_last_used = now
+        if not reusable or self._expired(conn, now):
+            conn.close()
+            self._forget(key)
+            return
+        with self._cond:
+            self._idle.setdefault(key, []).append(conn)
+            self._cond.notify()
+
+    def _forget(self, key):
+        with self._cond:
+            self._open[key] -= 1
+            self._cond.notify()
+
+    def clear(self):
+        """Close every idle connection. Checked out connections are closed
+           when they are released."""
+        with self._cond:
+            idle, self._idle = self._idle, {}
+            for key, conns in idle.items():
+                self._open[key] -= len(conns)
+                for conn in conns:
+                    conn.close()
+            self._cond.notify_all()
+
+    def __getstate__(self):
+        # Live sockets can't be pickled, only the configuration travels
+        return {
+            'max_connections_per_host': self.max_connections_per_host,
+            'idle_timeout': self.idle_timeout,
+            'max_lifetime': self.max_lifetime,
+            'pool_timeout': self.pool_timeout,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+class _PooledHTTPResponse(httplib.HTTPResponse):
+    """HTTPResponse that hands its connection back to the pool once the
+       body has been consumed."""
+
+    _pool_release = None
+    _reusable = True
+
+    def _close_conn(self):
+        httplib.HTTPResponse._close_conn(self)
+        self._release()
+
+    def close(self):
+        if self.fp is not None and self.length != 0:
+            # Unread body bytes are still on the socket
+            self._reusable = False
+        httplib.HTTPResponse.close(self)
+        self._release()
+
+    def _release(self):
+        release, self._pool_release = self._pool_release, None
+        if release is not None:
+            release(reusable=self._reusable and not self.will_close)
+
+
+def _dropped(sock):
+    """
+    :return: True if the server closed the idle socket sock (or sent
+             something unasked): it is readable while no request is pending
+    """
+    if not isinstance(sock, socket.socket):
+        return False
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return bool(poller.poll(0))
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def _set_timeout(conn, timeout):
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+
+def _is_regular_file(data):
+    """
+    :return: True if data is a regular file opened in binary mode, which
+             socket.sendfile can send
+    """
+    if not hasattr(data, 'fileno') or 'b' not in getattr(data, 'mode', ''):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(data.fileno()).st_mode)
+    except (OSError, ValueError):
+        return False
+
+
+def _can_sendfile(data, headers):
+    """
+    :return: True if data, or a segment of it, is a regular file, and the
+             size of data is given in headers
+    """
+    if isinstance(data, EncodedBody):
+        if not any(_is_regular_file(s) for s in data.segments()):
+            return False
+    elif not _is_regular_file(data):
+        return False
+    return any(name.lower() == 'content-length' for name in headers)
+
+
+def _sendfile(sock, data):
+    """Send data with socket.sendfile, the segments of an EncodedBody that
+       aren't files with sendall"""
+    segments = data.segments() if isinstance(data, EncodedBody) else [data]
+    for segment in segments:
+        if _is_regular_file(segment):
+            sock.sendfile(segment, segment.tell())
+            continue
+        for chunk in iter_chunks(segment):
+            sock.sendall(chunk)
+
+
+def send_pooled(pool, key, factory, method, selector, data, headers,
+                timeout, encode_chunked=False):
+    """Send a request over a connection checked out of pool. A reused
+       connection the server has dropped is replaced and the request sent
+       again, when its body can be sent twice and the server can't have
+       processed it already: it failed while being sent, or its verb is
+       idempotent.
+
+    :param pool: Pool the connection is checked out of
+    :type pool: ConnectionPool
+    :param key: Hashable identifying the origin
+    :param factory: Callable returning a new, unconnected connection
+                    whose response_class is _PooledHTTPResponse
+    :param method: HTTP verb
+    :type method: string
+    :param selector: Path and query of the URL
+    :type selector: string
+    :param data: Request body: bytes-like, a file object, an iterable of
+                 bytes, or None
+    :param headers: Request headers
+    :type headers: dictionary
+    :param timeout: Socket timeout
+    :type timeout: float
+    :param encode_chunked: Send the body with chunked transfer encoding
+    :type encode_chunked: boolean
+    :return: _PooledHTTPResponse, handing the connection back to the pool
+             once its body has been read or it is closed
+    """
+    # Only bodies we can send twice may be replayed on a new socket
+    replayable = is_replayable(data)
+    sendfile = not encode_chunked and _can_sendfile(data, headers)
+    timings = current_timings()
+    idempotent = method in Retry.idempotent_methods
+    wait = timeout
+    if wait is socket._GLOBAL_DEFAULT_TIMEOUT:
+        wait = socket.getdefaulttimeout()
+    while True:
+        conn, reused = pool.acquire(key, factory, wait)
+        sent = False
+        try:
+            _set_timeout(conn, timeout)
+            try:
+                if timings is not None and not reused:
+                    traced_connect(conn, timings)
+                if sendfile:
+                    # The headers, then the file straight from the kernel
+                    conn.request(method, selector, None, headers)
+                    _sendfile(conn.sock, data)
+                else:
+                    conn.request(method, selector, data, headers,
+                                 encode_chunked=encode_chunked)
+            except OSError as err:
+                raise URLError(err)
+            sent = True
+            if timings is not None:
+                timings.request_sent = _monotonic()
+            response = conn.getresponse()
+            if timings is not None:
+                timings.first_byte = _monotonic()
+        except Exception as err:
+            pool.release(key, conn, reusable=False)
+            reason = getattr(err, 'reason', err)
+            # Once sent, the request may have been processed before the
+            # server dropped the connection: only send it twice if that's
+            # harmless
+            if reused and replayable and (idempotent or not sent) and \
+                    isinstance(reason, _STALE_ERRORS):
+                continue
+            raise
+        break
+    response._pool_release = partial(pool.release, key, conn)
+    return response
+
+
+class _PooledHandlerMixin(object):
+    """Replaces AbstractHTTPHandler.do_open, which closes the connection
+       after every request, with one that keeps it alive in the pool."""
+
+    def __init__(self, pool, *args, **kwargs):
+        self.pool = pool
+        super(_PooledHandlerMixin, self).__init__(*args, **kwargs)
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.host
+        if not host:
+            raise URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(
+            (k, v) for k, v in req.headers.items() if k not in headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = \
+                headers.pop('Proxy-Authorization')
+
+        def factory():
+            conn = http_class(host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(self._debuglevel)
+            conn.response_class = _PooledHTTPResponse
+            if req._tunnel_host:
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            return conn
+
+        key = (req.type, host, req._tunnel_host,
+               tuple(sorted(http_conn_args.items())))
+        response = send_pooled(
+            self.pool, key, factory, req.get_method(), req.selector,
+            req.data, headers, req.timeout,
+            encode_chunked=req.has_header('Transfer-encoding'))
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class PooledHTTPHandler(_PooledHandlerMixin, urllib.HTTPHandler):
+    """urllib HTTP handler backed by a ConnectionPool"""
+
+
+class PooledHTTPSHandler(_PooledHandlerMixin, urllib.HTTPSHandler):
+    """urllib HTTPS handler backed by a ConnectionPool"""
@@ -0,0 +1,158 @@
+"""Client side pacing of API calls"""
+import threading
+import time
+
+_monotonic = time.monotonic
+
+# X-RateLimit-Reset values above this are a Unix time, below it a number
+# of seconds
+_EPOCH_THRESHOLD = 1e9
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket pacing calls to rate requests per second,
+       with bursts of up to burst calls.
+
+    The bucket follows the quota reported by the API: once a response
+    carries X-RateLimit-Remaining and X-RateLimit-Reset, the calls left
+    are spread evenly until the reset, so that the quota isn't exceeded
+    even when other processes use it too. One limiter can be shared by
+    any number of clients, threads and coroutines.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Calls per second
+        :type rate: float
+        :param burst: Calls allowed back to back after a quiet period,
+                      defaults to max(1, rate)
+        :type burst: integer
+        """
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = _monotonic()
+        # Pace reported by the API, in force until _quota_until
+        self._quota_rate = None
+        self._quota_until = None
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self._quota_until is not None:
+            quota_elapsed = min(elapsed, self._quota_until - (now - elapsed))
+            self._tokens += max(0.0, quota_elapsed) * self._quota_rate
+            elapsed -= max(0.0, quota_elapsed)
+            if now >= self._quota_until:
+                # The API has restored the quota
+                self._quota_rate = self._quota_until = None
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def _wait_time(self, deficit, now):
+        """Seconds until deficit more tokens have been added"""
+        wait = 0.0
+        if self._quota_until is not None:
+            window = self._quota_until - now
+            if self._quota_rate * window >= deficit:
+                return deficit / self._quota_rate
+            deficit -= self._quota_rate * window
+            wait = window
+        return wait + deficit / self.rate
+
+    def reserve(self):
+        """Take a token, going into debt if none is left
+
+        :return: float, seconds to wait before making the call
+        """
+        with self._lock:
+            now = _monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return self._wait_time(-self._tokens, now)
+
+    def acquire(self):
+        """Block until a call may be made"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, headers):
+        """Follow the quota reported in the headers of a response
+
+        :param headers: Response headers, or None
+        """
+        try:
+            remaining = headers.get('X-RateLimit-Remaining')
+            reset = headers.get('X-RateLimit-Reset')
+        except AttributeError:
+            return
+        if remaining is None:
+            return
+        try:
+            remaining = float(remaining)
+            reset = float(reset) if reset is not None else None
+        except ValueError:
+            return
+        if reset is not None and reset > _EPOCH_THRESHOLD:
+            reset -= time.time()
+        with self._lock:
+            now = _monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, remaining)
+            if reset is not None and reset > 0:
+                self._quota_rate = min(self.rate, remaining / reset)
+                self._quota_until = now + reset
+
+    def __getstate__(self):
+        # Locks can't be pickled, only the configuration travels
+        return {'rate': self.rate, 'burst': self.burst}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+def _normalize_prefix(prefix):
+    return '/' + prefix.strip('/')
+
+
+def get_rate_limiter(rate_limiter=None):
+    """Resolve the rate_limiter setting of a Client
+
+    :param rate_limiter: None, a RateLimiter, or a dictionary of
+                         RateLimiters by path prefix
+    :type rate_limiter: RateLimiter or dictionary
+    :return: RateLimiter, dictionary with normalized prefixes, or None
+    """
+    if isinstance(rate_limiter, dict):
+        return dict((_normalize_prefix(prefix), limiter)
+                    for prefix, limiter in rate_limiter.items())
+    return rate_limiter
+
+
+def select_limiter(rate_limiter, url_path):
+    """Pick the limiter pacing calls to a URL path
+
+    :param rate_limiter: A RateLimiter for every path, or a dictionary of
+                         RateLimiters by path prefix (e.g. '/mail'), as
+                         returned by get_rate_limiter. The longest
+                         matching prefix wins.
+    :type rate_limiter: RateLimiter or dictionary
+    :param url_path: The url path segments of the call
+    :type url_path: list of strings
+    :return: RateLimiter or None
+    """
+    if not isinstance(rate_limiter, dict):
+        return rate_limiter
+    segments = [str(segment).strip('/') for segment in url_path]
+    for end in range(len(segments), -1, -1):
+        limiter = rate_limiter.get('/' + '/'.join(segments[:end]))
+        if limiter is not None:
+            return limiter
+    return None
@@ -0,0 +1,153 @@
+"""Retry policy for failed API calls"""
+import random
+import socket
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+# Raised by AsyncClient when the timeout expires
+from asyncio import TimeoutError as _AsyncTimeoutError
+from urllib.error import URLError
+
+from .exceptions import HTTPError
+
+_monotonic = time.monotonic
+
+
+class Retry(object):
+    """When and how long to wait before sending a failed API call again.
+
+    Delays grow exponentially with full jitter: before retry n the client
+    waits a random time between 0 and
+    min(backoff_max, backoff_factor * 2 ** (n - 1)) seconds, unless the
+    server asked for a longer one with Retry-After.
+    """
+
+    # Verbs that can be sent twice without changing the outcome
+    idempotent_methods = frozenset(
+        ['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE'])
+
+    def __init__(self,
+                 max_attempts=3,
+                 statuses=(429, 503, 504),
+                 exceptions=(URLError, socket.timeout, _AsyncTimeoutError),
+                 backoff_factor=0.5,
+                 backoff_max=30,
+                 respect_retry_after=True,
+                 retry_non_idempotent=False,
+                 total_timeout=None):
+        """
+        :param max_attempts: Number of times a call is sent at most,
+                             the first attempt included
+        :type max_attempts: integer
+        :param statuses: Response status codes worth another attempt
+        :type statuses: collection of integers
+        :param exceptions: Exception classes worth another attempt
+                           (connection errors and timeouts by default)
+        :type exceptions: tuple of exception classes
+        :param backoff_factor: Upper bound in seconds of the first delay
+        :type backoff_factor: float
+        :param backoff_max: Upper bound in seconds of any computed delay
+        :type backoff_max: float
+        :param respect_retry_after: Wait as long as the Retry-After header
+                                    of the response asks
+        :type respect_retry_after: boolean
+        :param retry_non_idempotent: Also retry POST and PATCH, which may
+                                     have had an effect on the server
+        :type retry_non_idempotent: boolean
+        :param total_timeout: Seconds after the first attempt beyond which
+                              no retry starts. None for no limit.
+        :type total_timeout: float
+        """
+        self.max_attempts = max_attempts
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.respect_retry_after = respect_retry_after
+        self.retry_non_idempotent = retry_non_idempotent
+        self.total_timeout = total_timeout
+
+    def is_retryable(self, method, error):
+        """
+        :param method: HTTP verb of the call, upper case
+        :type method: string
+        :param error: Exception raised by the call, or the error Response
+                      of a client that doesn't raise them
+        :return: boolean
+        """
+        if method not in self.idempotent_methods and \
+                not self.retry_non_idempotent:
+            return False
+        if isinstance(error, HTTPError) or \
+                not isinstance(error, Exception):
+            return error.status_code in self.statuses
+        return isinstance(error, self.exceptions)
+
+    def backoff(self, attempt):
+        """
+        :param attempt: Number of attempts made so far
+        :type attempt: integer
+        :return: float, seconds to wait before the next attempt
+        """
+        ceiling = self.backoff_factor * 2 ** (attempt - 1)
+        return random.uniform(0, min(self.backoff_max, ceiling))
+
+    def retry_after(self, error):
+        """
+        :param error: Exception raised by the call, or error Response
+        :return: float, seconds the server asked to wait, or None
+        """
+        headers = getattr(error, 'headers', None)
+        try:
+            value = headers.get('Retry-After')
+        except AttributeError:
+            return None
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+    def get_delay(self, method, attempt, error, elapsed):
+        """Decide whether a failed call is sent again
+
+        :param method: HTTP verb of the call, upper case
+        :type method: string
+        :param attempt: Number of attempts made so far
+        :type attempt: integer
+        :param error: Exception raised by the last attempt, or its error
+                      Response
+        :param elapsed: Seconds since the first attempt started
+        :type elapsed: float
+        :return: float, seconds to wait before the next attempt, or None
+                 to give up
+        """
+        if attempt >= self.max_attempts or \
+                not self.is_retryable(method, error):
+            return None
+        delay = self.backoff(attempt)
+        if self.respect_retry_after:
+            retry_after = self.retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        if self.total_timeout is not None and \
+                elapsed + delay > self.total_timeout:
+            return None
+        return delay
+
+
+def get_retry(retry=None):
+    """Resolve the retry setting of a Client
+
+    :param retry: None to never retry, the maximum number of attempts,
+                  or a Retry
+    :type retry: integer or Retry
+    :return: Retry or None
+    """
+    if retry is None or isinstance(retry, Retry):
+        return retry
+    return Retry(max_attempts=retry)
@@ -0,0 +1,81 @@
+"""Coalescing of identical concurrent API calls"""
+import threading
+
+
+class _Call(object):
+    """A call in flight and its outcome, once known"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Lets identical calls made at the same time share one upstream call.
+
+    The first caller for a key makes the call; callers arriving before it
+    completes wait for it and get the same result, or the same exception.
+    Threads go through do(); AsyncClient keeps the tasks of coroutines in
+    tasks.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # key -> _Call in flight
+        self._calls = {}
+        # (event loop, key) -> asyncio.Task in flight, for AsyncClient
+        self.tasks = {}
+
+    def do(self, key, function):
+        """Call function, unless a call for key is already in flight
+
+        :param key: Hashable identifying the call
+        :param function: Callable making the call
+        :return: the return value of function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def __getstate__(self):
+        # Calls in flight belong to this process
+        return {}
+
+    def __setstate__(self, state):
+        self._reset()
+
+
+def get_single_flight(single_flight=None):
+    """Resolve the single_flight setting of a Client
+
+    :param single_flight: True for a new SingleFlight, or a SingleFlight
+                          to share; None or False to disable coalescing
+    :type single_flight: boolean or SingleFlight
+    :return: SingleFlight or None
+    """
+    if single_flight is True:
+        return SingleFlight()
+    return single_flight or None
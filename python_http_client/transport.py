@@ -0,0 +1,215 @@
+"""Transports sending the requests built by Client"""
+import json
+from io import BytesIO
+
+import http.client as httplib
+from http.client import HTTPMessage
+from urllib.error import HTTPError, URLError
+
+from .pool import ConnectionPool, _PooledHTTPResponse, send_pooled
+
+
+class Transport(object):
+    """Sends a request and returns its response, for Client._make_request.
+
+    Responses read like urllib responses: getcode(), info() returning the
+    headers, read([amt]) and close(). Error statuses (>= 400) are raised
+    as urllib.error.HTTPError and connection failures as
+    urllib.error.URLError, as urllib does. When the request's raise_errors
+    is False (a Client with raise_errors=False), error statuses may be
+    returned like any other response instead, which saves building the
+    HTTPError.
+    """
+
+    def open(self, request, timeout=None):
+        """
+        :param request: The request to send
+        :type request: urllib.Request object
+        :param timeout: Seconds to wait for the server, or None
+        :type timeout: float
+        :return: urllib-like response
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources (e.g. connections) held by the transport"""
+
+
+class UrllibTransport(Transport):
+    """Sends requests through a urllib opener, the default of Client"""
+
+    def __init__(self, opener):
+        """
+        :param opener: Opener sending the requests
+        :type opener: urllib.OpenerDirector
+        """
+        self.opener = opener
+
+    def open(self, request, timeout=None):
+        return self.opener.open(request, timeout=timeout)
+
+    def close(self):
+        self.opener.close()
+
+
+class PooledSocketTransport(Transport):
+    """Sends requests over the keep-alive sockets of a ConnectionPool,
+       without going through the handler chain of a urllib opener.
+
+    Proxies and redirects are not handled: each call is one request to the
+    host of the URL.
+    """
+
+    def __init__(self, connection_pool=None, ssl_context=None):
+        """
+        :param connection_pool: Pool the sockets are checked out of
+        :type connection_pool: ConnectionPool
+        :param ssl_context: SSL context of https connections, None for the
+                            default one
+        :type ssl_context: ssl.SSLContext
+        """
+        self.connection_pool = connection_pool or ConnectionPool()
+        self.ssl_context = ssl_context
+
+    def _factory(self, scheme, host, timeout):
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(
+                host, timeout=timeout, context=self.ssl_context)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=timeout)
+        conn.response_class = _PooledHTTPResponse
+        return conn
+
+    def open(self, request, timeout=None):
+        scheme = request.type
+        if scheme not in ('http', 'https'):
+            raise URLError('unknown url type: {}'.format(scheme))
+        host = request.host
+        if not host:
+            raise URLError('no host given')
+        response = send_pooled(
+            self.connection_pool, (scheme, host),
+            lambda: self._factory(scheme, host, timeout),
+            request.get_method(), request.selector, request.data,
+            request.headers, timeout)
+        url = request.get_full_url()
+        response.url = url
+        if response.status >= 400 and getattr(request, 'raise_errors', True):
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, response)
+        return response
+
+    def close(self):
+        self.connection_pool.clear()
+
+
+class LoopbackResponse(BytesIO):
+    """urllib-like response served from memory by LoopbackTransport"""
+
+    def __init__(self, url, status, reason, headers, body):
+        BytesIO.__init__(self, body)
+        self.url = url
+        self.status = self.code = status
+        self.reason = self.msg = reason
+        self.headers = headers
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+
+def _canned(status, body, headers):
+    """Prepare a canned response once, so that serving it costs little
+
+    :return: tuple of (status, reason, headers, body)
+    """
+    headers = dict(headers or {})
+    if body is None:
+        body = b''
+    elif not isinstance(body, bytes):
+        if not hasattr(body, 'encode'):
+            body = json.dumps(body)
+            headers.setdefault('Content-Type', 'application/json')
+        body = body.encode('utf-8')
+    message = HTTPMessage()
+    for name, value in headers.items():
+        message[name] = str(value)
+    if 'Content-Length' not in message:
+        message['Content-Length'] = str(len(body))
+    reason = httplib.responses.get(status, '')
+    return status, reason, message, body
+
+
+class _Routes(object):
+    """Canned responses by method and URL path, for the loopback
+       transports"""
+
+    def __init__(self, status=200, body=None, headers=None):
+        """
+        :param status: Status code of the default response
+        :type status: integer
+        :param body: Body of the default response: bytes, a str encoded
+                     as UTF-8 or an object encoded as JSON
+        :param headers: Headers of the default response
+        :type headers: dictionary
+        """
+        self._default = self._prepare(_canned(status, body, headers))
+        self._routes = {}
+        # The last request served, for inspection
+        self.last_request = None
+
+    def route(self, method, path, status=200, body=None, headers=None):
+        """Serve a canned response to the requests of method to path
+
+        :param method: HTTP verb
+        :type method: string
+        :param path: URL path, without query (e.g. '/v3/mail/send')
+        :type path: string
+        :param status: Status code
+        :type status: integer
+        :param body: Body: bytes, a str encoded as UTF-8 or an object
+                     encoded as JSON
+        :param headers: Response headers
+        :type headers: dictionary
+        """
+        self._routes[(method.upper(), path)] = self._prepare(
+            _canned(status, body, headers))
+
+    def _prepare(self, canned):
+        """
+        :param canned: Canned response from _canned
+        :return: the canned response as served by the transport
+        """
+        return canned
+
+    def _lookup(self, method, url):
+        if not self._routes:
+            return self._default
+        path = url.split('?', 1)[0]
+        start = path.find('/', path.find('//') + 2)
+        path = path[start:] if start >= 0 else '/'
+        return self._routes.get((method, path), self._default)
+
+
+class LoopbackTransport(_Routes, Transport):
+    """Serves canned responses from memory, without any network I/O.
+
+    Measures the overhead of the Client itself (URL building, headers,
+    serialization, response handling) and stands in for a server in
+    tests. Error statuses raise like they would over the network.
+    """
+
+    def open(self, request, timeout=None):
+        self.last_request = request
+        url = request.get_full_url()
+        status, reason, headers, body = self._lookup(
+            request.get_method(), url)
+        response = LoopbackResponse(url, status, reason, headers, body)
+        if status >= 400 and getattr(request, 'raise_errors', True):
+            raise HTTPError(url, status, reason, headers, response)
+        return response
@@ -33,18 +33,21 @@ setup(
     long_description_content_type='text/x-rst',
     long_description=readme,
     extras_require={
-        "async": ['aiohttp'],
+        "async": ['aiohttp; python_version >= "3.7"'],
+        "brotli": ['brotli'],
+        "http2": ['h2; python_version >= "3.7"'],
+        "orjson": ['orjson'],
+        "ujson": ['ujson'],
+        "zstd": ['zstandard'],
     },
     keywords=[
         'REST',
         'HTTP',
         'API'],
-    python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*',
+    python_requires='>=3.6',
     classifiers=[
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ]
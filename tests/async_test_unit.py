@@ -1,22 +1,44 @@
+import asyncio
 import asynctest
-import sys
+import json
 import pickle
+import sys
+import tempfile
 import unittest
 from collections import namedtuple
 
 from aiohttp import ClientSession, web
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
-from python_http_client.exceptions import BadRequestsError
+from urllib.error import URLError
 
+from python_http_client.exceptions import (
+    BadRequestsError, NotFoundError, ServiceUnavailableError)
 
-if sys.version_info < (3, 5):
-    raise unittest.SkipTest()
 
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest()
 from python_http_client import (
     AiohttpClientSessionError,
     AsyncClient,
+    AsyncLoopbackTransport,
     Client,
+    MemoryCache,
+    MultipartEncoder,
+    RateLimiter,
+    Retry,
 )
+from python_http_client.async_client import AsyncStreamingResponse
+from python_http_client.async_transport import trace_config
+from python_http_client.hooks import Hooks
+from python_http_client.compression import compress_body
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    from python_http_client.http2 import HTTP2Transport
+except ImportError:
+    h2 = None
 
 
 class TestAsyncClientExceptionHandling(AioHTTPTestCase):
@@ -42,11 +64,835 @@ class TestAsyncClientExceptionHandling(AioHTTPTestCase):
             with self.assertRaises(BadRequestsError) as context:
                 await client.get()
             exception = context.exception
-            self.assertEqual('400: error_reason', exception.body)
+            self.assertEqual(b'400: error_reason', exception.body)
+            self.assertEqual('error_reason', exception.reason)
+            self.assertEqual(400, exception.status_code)
             self.assertIn('header', exception.headers)
             self.assertEqual('value', exception.headers['header'])
 
 
+class TestAsyncClientSession(AioHTTPTestCase):
+    async def get_application(self):
+        async def handler(request):
+            return web.json_response({'path': request.path})
+
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', handler)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_opens_and_closes_session(self):
+        client = AsyncClient(self.get_url())
+        users = client.users
+        async with client:
+            session = client.client_session
+            self.assertIsInstance(session, ClientSession)
+            # Children built before and after entering share the session
+            self.assertIs(session, users.client_session)
+            self.assertIs(session, client.users._('1').client_session)
+            response = await users._('1').get()
+            self.assertEqual({'path': '/users/1'}, response.to_dict)
+            self.assertEqual(
+                {'path': '/items'}, (await client.items.get()).to_dict)
+        self.assertTrue(session.closed)
+        self.assertIsNone(users.client_session)
+        with self.assertRaises(AiohttpClientSessionError):
+            await users.get()
+
+    @unittest_run_loop
+    async def test_connector_options(self):
+        client = AsyncClient(self.get_url(),
+                             connector_options={'limit_per_host': 2})
+        async with client:
+            connector = client.client_session.connector
+            self.assertEqual(100, connector.limit)
+            self.assertEqual(2, connector.limit_per_host)
+            self.assertEqual(2, client.users.connector_options[
+                'limit_per_host'])
+            await client.users.get()
+        self.assertTrue(connector.closed)
+
+    @unittest_run_loop
+    async def test_external_session_left_open(self):
+        async with ClientSession() as session:
+            async with AsyncClient(self.get_url(),
+                                   client_session=session) as client:
+                await client.users.get()
+            self.assertFalse(session.closed)
+            self.assertIs(session, client.client_session)
+
+    @unittest_run_loop
+    async def test_no_session_with_transport(self):
+        transport = AsyncLoopbackTransport(body={})
+        async with AsyncClient(self.get_url(), transport=transport) as client:
+            self.assertIsNone(client.client_session)
+            await client.users.get()
+
+
+class TestAsyncStreamingResponse(AioHTTPTestCase):
+    async def get_application(self):
+        async def handler(_):
+            return web.Response(body=b'first\nsecond\r\n\nlast')
+
+        async def items(_):
+            return web.json_response(
+                {'result': [{'id': i} for i in range(100)]})
+
+        app = web.Application()
+        app.router.add_get('/lines', handler)
+        app.router.add_get('/items', items)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_iter_bytes(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            response = await client.lines.get(stream=True)
+            self.assertIsInstance(response, AsyncStreamingResponse)
+            self.assertEqual(200, response.status_code)
+            chunks = [chunk async for chunk in response.iter_bytes(4)]
+            self.assertEqual(b'firs', chunks[0])
+            self.assertEqual(b'first\nsecond\r\n\nlast', b''.join(chunks))
+
+    @unittest_run_loop
+    async def test_iter_lines(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            async with await client.lines.get(stream=True) as response:
+                lines = [line async for line in response.iter_lines(3)]
+            self.assertEqual([b'first', b'second', b'', b'last'], lines)
+
+    @unittest_run_loop
+    async def test_read(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            response = await client.lines.get(stream=True)
+            self.assertEqual(b'first\n', await response.raw.read(6))
+            await response.read()
+            self.assertEqual(b'second\r\n\nlast', response.body)
+
+    @unittest_run_loop
+    async def test_unread_body(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            async with await client.items.get(stream=True) as response:
+                with self.assertRaisesRegex(RuntimeError, 'await'):
+                    response.body
+                with self.assertRaisesRegex(RuntimeError, 'await'):
+                    response.to_dict
+                await response.read()
+                self.assertEqual(100, len(response.to_dict['result']))
+
+    @unittest_run_loop
+    async def test_endpoint(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            response = await client.endpoint('/items').get()
+            self.assertEqual({'result': [{'id': i} for i in range(100)]},
+                             response.to_dict)
+
+    @unittest_run_loop
+    async def test_iter_json_items(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            response = await client.items.get(stream=True)
+            items = [
+                item async for item in response.iter_json_items(
+                    'result', chunk_size=16)
+            ]
+            self.assertEqual([{'id': i} for i in range(100)], items)
+            # Read responses have the same async API
+            response = await client.items.get()
+            items = [
+                item async for item in response.iter_json_items(
+                    'result', chunk_size=16)
+            ]
+            self.assertEqual([{'id': i} for i in range(100)], items)
+
+
+class TestAsyncClientBatch(AioHTTPTestCase):
+    async def get_application(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        async def handler(request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            item = int(request.match_info['item'])
+            if item % 5 == 4:
+                raise web.HTTPBadRequest()
+            return web.json_response({'item': item})
+
+        app = web.Application()
+        app.router.add_get('/items/{item}', handler)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_batch(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            requests = (('get', '/items/{}'.format(i)) for i in range(20))
+            results = await client.batch(requests, concurrency=3)
+        self.assertEqual(20, len(results))
+        for item, result in enumerate(results):
+            if item % 5 == 4:
+                self.assertIsInstance(result, BadRequestsError)
+            else:
+                self.assertEqual({'item': item}, result.to_dict)
+        self.assertEqual(3, self.max_in_flight)
+
+    @unittest_run_loop
+    async def test_batch_per_host(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            requests = [
+                ('get', client.items._(i), {'query_params': {'a': 1}})
+                for i in range(10)
+            ]
+            results = await client.batch(
+                requests, concurrency=5, per_host=2)
+        self.assertEqual(10, len(results))
+        self.assertEqual(2, self.max_in_flight)
+
+    @unittest_run_loop
+    async def test_iter_batch(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            requests = [('get', '/items/{}'.format(i)) for i in range(12)]
+            results = {}
+            async for index, result in client.iter_batch(
+                    requests, concurrency=4):
+                results[index] = result
+        self.assertEqual(set(range(12)), set(results))
+        self.assertEqual({'item': 7}, results[7].to_dict)
+
+
+class TestAsyncClientRetry(AioHTTPTestCase):
+    async def get_application(self):
+        self.calls = 0
+
+        async def flaky(_):
+            self.calls += 1
+            if self.calls < 3:
+                raise web.HTTPServiceUnavailable(
+                    headers={'Retry-After': '0'})
+            return web.json_response({'calls': self.calls})
+
+        async def down(_):
+            self.calls += 1
+            raise web.HTTPServiceUnavailable()
+
+        app = web.Application()
+        app.router.add_get('/flaky', flaky)
+        app.router.add_post('/down', down)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_retry(self):
+        async with ClientSession() as session:
+            client = AsyncClient(
+                self.get_url(), client_session=session,
+                retry=Retry(max_attempts=3, backoff_factor=0))
+            response = await client.flaky.get()
+        self.assertEqual({'calls': 3}, response.to_dict)
+
+    @unittest_run_loop
+    async def test_retry_gives_up(self):
+        async with ClientSession() as session:
+            client = AsyncClient(
+                self.get_url(), client_session=session,
+                retry=Retry(max_attempts=2, backoff_factor=0))
+            with self.assertRaises(ServiceUnavailableError):
+                await client.flaky.get()
+            self.assertEqual(2, self.calls)
+            with self.assertRaises(ServiceUnavailableError):
+                await client.down.post(request_body={})
+            self.assertEqual(3, self.calls)
+
+
+class TestAsyncClientRateLimit(AioHTTPTestCase):
+    async def get_application(self):
+        async def handler(_):
+            return web.json_response({}, headers={
+                'X-RateLimit-Remaining': '1',
+                'X-RateLimit-Reset': '60',
+            })
+
+        app = web.Application()
+        app.router.add_get('/limited', handler)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_rate_limiter(self):
+        limiter = RateLimiter(100, burst=5)
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 rate_limiter=limiter)
+            self.assertIs(client.limited.rate_limiter, limiter)
+            await client.limited.get()
+        # One call left for the next minute
+        self.assertEqual(0, limiter.reserve())
+        self.assertGreater(limiter.reserve(), 50)
+
+
+class TestAsyncClientCache(AioHTTPTestCase):
+    async def get_application(self):
+        self.calls = []
+
+        async def etag(request):
+            self.calls.append(request.headers.get('If-None-Match'))
+            headers = {'ETag': '"v1"', 'Cache-Control': 'no-cache'}
+            if request.headers.get('If-None-Match') == '"v1"':
+                return web.Response(status=304, headers=headers)
+            return web.json_response({'version': 1}, headers=headers)
+
+        async def fresh(_):
+            self.calls.append(None)
+            return web.json_response(
+                {}, headers={'Cache-Control': 'max-age=60'})
+
+        app = web.Application()
+        app.router.add_get('/etag', etag)
+        app.router.add_get('/fresh', fresh)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_fresh(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 cache=MemoryCache())
+            await client.fresh.get()
+            response = await client.fresh.get()
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual({}, response.to_dict)
+        self.assertEqual('max-age=60', response.headers['cache-control'])
+
+    @unittest_run_loop
+    async def test_revalidation(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 cache=MemoryCache())
+            await client.etag.get()
+            response = await client.etag.get()
+        self.assertEqual([None, '"v1"'], self.calls)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'version': 1}, response.to_dict)
+
+
+class TestAsyncClientSingleFlight(AioHTTPTestCase):
+    async def get_application(self):
+        self.calls = 0
+
+        async def slow(_):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return web.json_response({'calls': self.calls})
+
+        app = web.Application()
+        app.router.add_get('/slow', slow)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_coalesce(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 single_flight=True)
+            results = await asyncio.gather(
+                *(client.slow.get() for _ in range(10)))
+            self.assertEqual(1, self.calls)
+            self.assertTrue(all(r is results[0] for r in results))
+            self.assertEqual({}, client.single_flight.tasks)
+            await client.slow.get()
+        self.assertEqual(2, self.calls)
+
+
+class TestAsyncClientCompression(AioHTTPTestCase):
+    async def get_application(self):
+        self.received = []
+
+        async def items(request):
+            body = json.dumps(
+                {'result': [{'id': i} for i in range(100)]}).encode('utf-8')
+            return web.Response(
+                body=compress_body(body, 'gzip'),
+                headers={'Content-Encoding': 'gzip'})
+
+        async def upload(request):
+            # aiohttp decodes the body, the length is the one sent
+            self.received.append(
+                (request.headers.get('Content-Encoding'),
+                 request.content_length,
+                 await request.read()))
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_get('/items', items)
+        app.router.add_post('/upload', upload)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_stream_decoded(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session)
+            response = await client.items.get(stream=True)
+            items = [item async for item in
+                     response.iter_json_items('result', 64)]
+        self.assertEqual([{'id': i} for i in range(100)], items)
+
+    @unittest_run_loop
+    async def test_request_compressed(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 compress_requests='gzip',
+                                 compress_min_size=10)
+            await client.upload.post(request_body=list(range(100)))
+        encoding, length, body = self.received[0]
+        self.assertEqual('gzip', encoding)
+        self.assertLess(length, len(body))
+        self.assertEqual(list(range(100)), json.loads(body))
+
+
+class TestAsyncRequestBody(AioHTTPTestCase):
+    async def get_application(self):
+        async def upload(request):
+            return web.json_response({
+                'body': (await request.read()).decode('latin-1'),
+                'length': request.content_length,
+                'chunked': request.headers.get('Transfer-Encoding'),
+            })
+
+        async def form(request):
+            fields = await request.post()
+            return web.json_response({
+                'list_id': fields['list_id'],
+                'file': fields['file'].file.read().decode('utf-8'),
+                'filename': fields['file'].filename,
+                'length': request.content_length,
+            })
+
+        app = web.Application()
+        app.router.add_post('/upload', upload)
+        app.router.add_post('/form', form)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    @unittest_run_loop
+    async def test_multipart(self):
+        async def lines():
+            yield b'email\n'
+            yield b'a@example.com\n'
+
+        contacts = tempfile.TemporaryFile()
+        contacts.write(b'email\na@example.com\n')
+        contacts.seek(0)
+        async with AsyncClient(self.get_url()) as client:
+            for body, length in ((contacts, True), (lines(), False)):
+                encoder = MultipartEncoder({'list_id': '42'})
+                encoder.add_file('file', body, filename='contacts.csv')
+                expected = encoder.length
+                echo = (await client.form.post(
+                    request_body=encoder)).to_dict
+                self.assertEqual({
+                    'list_id': '42',
+                    'file': 'email\na@example.com\n',
+                    'filename': 'contacts.csv',
+                    'length': expected,
+                }, echo)
+                self.assertEqual(length, expected is not None)
+        contacts.close()
+
+    @unittest_run_loop
+    async def test_bodies(self):
+        async def chunks():
+            yield b'ab'
+            yield b'c'
+
+        body = tempfile.TemporaryFile()
+        body.write(b'skip,abc')
+        body.seek(5)
+        sent = []
+        hooks = {'after_response': lambda request, response, timings:
+                 sent.append(timings.bytes_sent)}
+        async with AsyncClient(self.get_url(), hooks=hooks) as client:
+            for request_body in (memoryview(b'abc'), body,
+                                 iter([b'a', b'bc']), chunks()):
+                echo = (await client.upload.post(
+                    request_body=request_body)).to_dict
+                self.assertEqual('abc', echo['body'])
+        body.close()
+        self.assertEqual([3, 3, 3, 3], sent)
+
+
+class TestAsyncClientHooks(AioHTTPTestCase):
+    async def get_application(self):
+        async def items(request):
+            return web.json_response(
+                {'result': [{'id': i} for i in range(100)]})
+
+        async def down(request):
+            return web.json_response({'error': 'down'}, status=503)
+
+        app = web.Application()
+        app.router.add_get('/items', items)
+        app.router.add_get('/down', down)
+        return app
+
+    def get_url(self):
+        server = self.server
+        return '{}://{}:{}'.format(server.scheme, server.host, server.port)
+
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        self.hooks = Hooks()
+        for event in ('before_request', 'after_response', 'on_error',
+                      'on_retry'):
+            self.hooks.register(event, self._recorder(event))
+
+    def _recorder(self, event):
+        def record(request, *args):
+            self.events.append((event, request.get_full_url()) + args)
+        return record
+
+    @unittest_run_loop
+    async def test_call_timed(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 hooks=self.hooks)
+            response = await client.items.get()
+            self.assertIn(trace_config, session.trace_configs)
+        timings = response.timings
+        self.assertEqual(
+            ['before_request', 'after_response'],
+            [event[0] for event in self.events])
+        self.assertIs(timings, self.events[1][3])
+        self.assertEqual(100, len(response.to_dict['result']))
+        self.assertEqual(len(response.body), timings.bytes_received)
+        # A new connection, to an IP address: no DNS
+        self.assertIsNone(timings.dns)
+        phases = [timings.start, timings.connect_start, timings.connect_end,
+                  timings.request_sent, timings.first_byte, timings.body_end,
+                  timings.decode_start, timings.decode_end]
+        self.assertNotIn(None, phases)
+        self.assertEqual(sorted(phases), phases)
+
+    @unittest_run_loop
+    async def test_stream_timed(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 hooks=self.hooks)
+            async with await client.items.get(stream=True) as response:
+                self.assertIsNone(response.timings.body_end)
+                body = b''.join([chunk async for chunk in
+                                 response.iter_bytes(100)])
+        self.assertEqual(len(body), response.timings.bytes_received)
+        self.assertIsNotNone(response.timings.body_end)
+
+    @unittest_run_loop
+    async def test_error_and_retry(self):
+        async with ClientSession() as session:
+            client = AsyncClient(self.get_url(), client_session=session,
+                                 hooks=self.hooks,
+                                 retry=Retry(max_attempts=2,
+                                             backoff_factor=0))
+            with self.assertRaises(ServiceUnavailableError) as context:
+                await client.down.get()
+        self.assertEqual(
+            ['before_request', 'on_error', 'on_retry', 'before_request',
+             'on_error'],
+            [event[0] for event in self.events])
+        self.assertEqual((1, 0), self.events[2][3:5])
+        self.assertIs(context.exception, self.events[4][2])
+        self.assertIsNotNone(self.events[4][3].first_byte)
+
+
+class TestAsyncLoopbackTransport(AioHTTPTestCase):
+    async def get_application(self):
+        # Nothing goes over the network
+        return web.Application()
+
+    @unittest_run_loop
+    async def test_canned_responses(self):
+        transport = AsyncLoopbackTransport(body={'ok': True})
+        transport.route('get', '/v3/missing', status=404,
+                        body={'errors': ['not found']})
+        client = AsyncClient('http://api.test.com', version=3,
+                             transport=transport)
+        response = await client.users.get(query_params={'limit': 1})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'{"ok": true}', response.body)
+        self.assertEqual({'ok': True}, response.to_dict)
+        self.assertEqual('application/json',
+                         response.headers['content-type'])
+        self.assertEqual(
+            ('GET', 'http://api.test.com/v3/users?limit=1'),
+            transport.last_request[:2])
+        await client.users.post(request_body={'name': 'a'})
+        self.assertEqual({'name': 'a'},
+                         json.loads(transport.last_request[3]))
+        with self.assertRaises(NotFoundError) as context:
+            await client.missing.get()
+        self.assertEqual({'errors': ['not found']},
+                         context.exception.to_dict)
+        client = AsyncClient('http://api.test.com', version=3,
+                             transport=transport, raise_errors=False)
+        response = await client.missing.get()
+        self.assertEqual(404, response.status_code)
+        with self.assertRaises(NotFoundError):
+            response.raise_for_status()
+        async with await client.users.get(stream=True) as response:
+            chunks = [chunk async for chunk in response.iter_bytes(2)]
+        self.assertEqual(b'{"ok": true}', b''.join(chunks))
+        self.assertEqual(2, len(chunks[0]))
+
+
+class H2Server:
+    """Local cleartext HTTP/2 server (prior knowledge) answering every
+    request with a JSON description of it. /slow answers after a short
+    delay, /large with a 200000 bytes body sent a frame at a time and
+    /status/NNN with that status."""
+
+    def __init__(self):
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.reset_streams = []
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(
+            self._serve, '127.0.0.1', 0)
+        self.url = 'http://127.0.0.1:{}'.format(
+            self._server.sockets[0].getsockname()[1])
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(
+            client_side=False, header_encoding='utf-8'))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        requests = {}
+        window_open = asyncio.Event()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), [])
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1].append(event.data)
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    asyncio.ensure_future(self._respond(
+                        conn, writer, window_open, event.stream_id,
+                        headers, b''.join(body)))
+                elif isinstance(event, h2.events.StreamReset):
+                    self.reset_streams.append(event.stream_id)
+                elif isinstance(event, h2.events.WindowUpdated):
+                    window_open.set()
+            writer.write(conn.data_to_send())
+        writer.close()
+
+    async def _respond(self, conn, writer, window_open, stream_id,
+                       headers, body):
+        path = headers[':path']
+        status = 200
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if path.startswith('/slow'):
+            await asyncio.sleep(0.05)
+        self.in_flight -= 1
+        if path.startswith('/status/'):
+            status = int(path.split('/')[2])
+        if path.startswith('/large'):
+            response = b'x' * 200000
+        else:
+            response = json.dumps({
+                'method': headers[':method'],
+                'path': path,
+                'stream_id': stream_id,
+                'length': len(body),
+                'x-test': headers.get('x-test'),
+            }).encode('utf-8')
+        conn.send_headers(stream_id, [
+            (':status', str(status)),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(response))),
+        ])
+        view = memoryview(response)
+        while view:
+            if stream_id in self.reset_streams:
+                return
+            window = min(conn.local_flow_control_window(stream_id),
+                         conn.max_outbound_frame_size)
+            if window <= 0:
+                window_open.clear()
+                writer.write(conn.data_to_send())
+                await window_open.wait()
+                continue
+            conn.send_data(stream_id, view[:window].tobytes())
+            view = view[window:]
+            if path.startswith('/large'):
+                # Leave the client time to cancel the stream
+                writer.write(conn.data_to_send())
+                await asyncio.sleep(0.005)
+        conn.end_stream(stream_id)
+        writer.write(conn.data_to_send())
+
+
+@unittest.skipIf(h2 is None, 'h2 is not installed')
+class TestHTTP2Transport(AioHTTPTestCase):
+    async def get_application(self):
+        # The calls go to the H2Server of each test
+        return web.Application()
+
+    @unittest_run_loop
+    async def test_multiplexing(self):
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            self.assertIs(client.slow.transport, transport)
+            responses = await asyncio.gather(*(
+                client.slow._(str(i)).get(request_headers={'X-Test': i})
+                for i in range(20)))
+            await transport.close()
+        self.assertEqual(1, server.connections)
+        self.assertGreater(server.max_in_flight, 1)
+        for i, response in enumerate(responses):
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('/slow/{}'.format(i), response.to_dict['path'])
+            self.assertEqual(str(i), response.to_dict['x-test'])
+
+    @unittest_run_loop
+    async def test_request_body_flow_control(self):
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            body = ['x' * 100] * 2000
+            response = await client.upload.post(
+                request_body=body, query_params={'a': 1})
+            await transport.close()
+        self.assertEqual('POST', response.to_dict['method'])
+        self.assertEqual('/upload?a=1', response.to_dict['path'])
+        self.assertEqual(len(client.codec.dumps(body)),
+                         response.to_dict['length'])
+
+    @unittest_run_loop
+    async def test_streamed_request_body(self):
+        async def chunks():
+            for _ in range(100):
+                yield b'x' * 1000
+
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            response = await client.upload.post(request_body=chunks())
+            self.assertEqual(100000, response.to_dict['length'])
+            response = await client.upload.post(
+                request_body=iter([b'ab', b'c']))
+            self.assertEqual(3, response.to_dict['length'])
+            encoder = MultipartEncoder({'a': 'b'}, files={'f': chunks()})
+            response = await client.upload.post(request_body=encoder)
+            self.assertLess(100000, response.to_dict['length'])
+            await transport.close()
+
+    @unittest_run_loop
+    async def test_streaming(self):
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            response = await client.large.get(stream=True)
+            size = 0
+            async for chunk in response.iter_bytes(16384):
+                self.assertLessEqual(len(chunk), 16384)
+                size += len(chunk)
+            response.close()
+            self.assertEqual(200000, size)
+
+            # Closing early cancels the stream, the connection stays
+            response = await client.large.get(stream=True)
+            await response.raw.read(10)
+            response.close()
+            self.assertEqual(200, (await client.small.get()).status_code)
+            await transport.close()
+        self.assertEqual(1, server.connections)
+        self.assertEqual(1, len(server.reset_streams))
+
+    @unittest_run_loop
+    async def test_error_status(self):
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            with self.assertRaises(BadRequestsError) as context:
+                await client.status._(400).get()
+            await transport.close()
+        self.assertEqual('/status/400', context.exception.to_dict['path'])
+
+    @unittest_run_loop
+    async def test_connection_refused(self):
+        async with H2Server() as server:
+            url = server.url
+        client = AsyncClient(url, transport=HTTP2Transport())
+        with self.assertRaises(URLError):
+            await client.get()
+
+    @unittest_run_loop
+    async def test_reconnects(self):
+        async with H2Server() as server:
+            transport = HTTP2Transport()
+            client = AsyncClient(server.url, transport=transport)
+            await client.get()
+            for connection in transport._connections.values():
+                await connection.close()
+            self.assertEqual(200, (await client.get()).status_code)
+            await transport.close()
+        self.assertEqual(2, server.connections)
+
+
 class TestAsyncClient(asynctest.TestCase):
     def setUp(self):
         self.host = 'http://api.test.com'
@@ -92,30 +938,31 @@ class TestAsyncClient(asynctest.TestCase):
         produced_client = original_client.path
         self.assertEqual(produced_client.host, self.host)
         self.assertEqual(produced_client.client_session, 'AIOHTTP_SESSION')
-        self.assertDictEqual(produced_client.request_headers, {})
+        self.assertEqual(produced_client.request_headers, {})
         self.assertEqual(produced_client._version, 1)
         self.assertListEqual(produced_client._url_path, ['path'])
         self.assertEqual(produced_client.append_slash, True)
 
     def test_client_pickle_unpickle(self):
-        client = AsyncClient(self.host, 'AIOHTTP_SESSION')
+        client = AsyncClient(self.host, client_session='AIOHTTP_SESSION')
         pickled_client = pickle.dumps(client)
         unpickled_client = pickle.loads(pickled_client)
         self.assertDictEqual(
-            client.__dict__,
-            unpickled_client.__dict__,
+            dict(client.__dict__, connection_pool=None, opener=None),
+            dict(unpickled_client.__dict__, connection_pool=None,
+                 opener=None),
             "original client and unpickled client must have the same state")
 
     async def test__make_request(self):
-        async def response_text():
-            return 'response-text'
+        async def response_body():
+            return b'response-body'
 
         server_response = asynctest.Mock()
         server_response.status = 200
         server_response.headers = {
             'Response-Header': 'response-header-content'
         }
-        server_response.text.return_value = response_text()
+        server_response.read.return_value = response_body()
 
         request_context_manager = asynctest.MagicMock()
         request_context_manager.__aenter__.return_value = server_response
@@ -146,6 +993,6 @@ class TestAsyncClient(asynctest.TestCase):
             headers={'Header': 'header-content'},
             timeout=None)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.body, 'response-text')
+        self.assertEqual(response.body, b'response-body')
         self.assertDictEqual(
             response.headers, {'Response-Header': 'response-header-content'})
@@ -1,28 +1,48 @@
+import io
+import json
+import os
 import pickle
+import shutil
+import ssl
+import tempfile
+import threading
+import time
 import unittest
+import zlib
+from functools import partial
 
-from python_http_client.client import Client, Response
+from python_http_client.body import body_length
+from python_http_client.cache import CacheEntry, FileCache, MemoryCache
+from python_http_client.hooks import Hooks, Timings, get_hooks
+from python_http_client.compression import (
+    ACCEPT_ENCODING, DecodingReader, compress_body, decode_body, get_decoder)
+from python_http_client.client import (
+    Client, Endpoint, Response, StreamingResponse)
+from python_http_client.multipart import MultipartEncoder
+from python_http_client.jsoncodec import (
+    JSONCodec, available_codecs, default_codec, get_codec)
+from python_http_client.pool import (
+    ConnectionPool, PooledHTTPHandler, PooledHTTPSHandler)
+from python_http_client.ratelimit import (
+    RateLimiter, get_rate_limiter, select_limiter)
+from python_http_client.retry import Retry, get_retry
+from python_http_client.singleflight import SingleFlight, get_single_flight
+from python_http_client.transport import (
+    LoopbackTransport, PooledSocketTransport, UrllibTransport)
 from python_http_client.exceptions import (
     BadRequestsError, HTTPError,
     NotFoundError,
     ServiceUnavailableError,
     UnsupportedMediaTypeError,
+    error_from_response,
     handle_error
 )
 
-try:
-    # Python 3
-    import urllib.request as urllib
-    from unittest import mock
-except ImportError:
-    # Python 2
-    import urllib2 as urllib
-    import mock
-
-try:
-    basestring
-except NameError:
-    basestring = str
+import urllib.request as urllib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.error import URLError
 
 
 class MockException(HTTPError):
@@ -64,6 +84,1376 @@ class MockClient(Client):
             raise handle_error(MockException(self.response_code))
 
 
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Echoes the client's source port so tests can tell sockets apart"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path.startswith('/etag'):
+            # Always revalidated, unchanged since the first call
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                return
+            body = b'{"version": 1}'
+            self.send_response(200)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.startswith('/gzip'):
+            # Items, compressed if the client accepts it
+            body = json.dumps(
+                {'result': [{'id': i} for i in range(100)]}).encode('utf-8')
+            encoded = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if encoded:
+                body = compress_body(body, 'gzip')
+            self.send_response(400 if 'error' in self.path else 200)
+            if encoded:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.startswith('/status/'):
+            self.send_response(int(self.path.split('/')[2]))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/slow'):
+            time.sleep(0.3)
+        if self.path.startswith('/lines'):
+            body = b'first\nsecond\r\n\nlast'
+        elif self.path.startswith('/items'):
+            body = json.dumps(
+                {'result': [{'id': i} for i in range(100)]}).encode('utf-8')
+        else:
+            body = json.dumps(
+                {'port': self.client_address[1]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if self.path.startswith('/fresh'):
+            self.send_header('Cache-Control', 'max-age=60')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the socket without announcing it, like an idle server would
+        if self.path.startswith('/drop'):
+            self.close_connection = True
+
+    def do_POST(self):
+        """Echoes the request body and how it was framed"""
+        self.server.paths.append(self.path)
+        chunked = self.headers.get('Transfer-Encoding') == 'chunked'
+        if chunked:
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                # The chunk and its CRLF, or the end of the trailers
+                body += self.rfile.read(size + 2)[:size]
+                if not size:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/vanish'):
+            # Processed, but the connection drops before the response
+            self.close_connection = True
+            return
+        body = json.dumps({
+            'body': body.decode('latin-1'),
+            'chunked': chunked,
+            'content_type': self.headers.get('Content-Type'),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        # Paths requested so far
+        self.paths = []
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_connection_reused(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            first = client.first.get().to_dict['port']
+            second = client.second.get().to_dict['port']
+        self.assertEqual(first, second)
+
+    def test_pool_shared_with_derived_clients(self):
+        client = Client(host='http://api.test.com')
+        self.assertIs(client.a._('b').connection_pool,
+                      client.connection_pool)
+
+    def test_max_lifetime(self):
+        pool = ConnectionPool(max_lifetime=0)
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, connection_pool=pool)
+            first = client.get().to_dict['port']
+            second = client.get().to_dict['port']
+        self.assertNotEqual(first, second)
+
+    def test_stale_connection_retried(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            first = client.drop.get().to_dict['port']
+            second = client.get().to_dict['port']
+        self.assertNotEqual(first, second)
+
+    def test_processed_post_not_replayed(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            client.get()
+            with self.assertRaises(ConnectionError):
+                client.vanish.post(request_body={'to': 'a@example.com'})
+        self.assertEqual(server.paths.count('/vanish'), 1)
+
+    def test_max_connections_per_host(self):
+        pool = ConnectionPool(max_connections_per_host=1)
+        factory = mock.Mock
+        conn, reused = pool.acquire('host', factory)
+        self.assertFalse(reused)
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(pool.acquire('host', factory)))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual(acquired, [])
+        pool.release('host', conn)
+        waiter.join(1)
+        self.assertEqual(acquired, [(conn, True)])
+
+    def test_pool_timeout(self):
+        pool = ConnectionPool(max_connections_per_host=1, pool_timeout=0.1)
+        pool.acquire('host', mock.Mock)
+        started = time.time()
+        with self.assertRaises(URLError):
+            pool.acquire('host', mock.Mock)
+        with self.assertRaises(URLError):
+            pool.acquire('host', mock.Mock, timeout=0.01)
+        self.assertLess(time.time() - started, 1)
+
+    def test_unclosed_streams_time_out(self):
+        for pool, timeout in ((ConnectionPool(max_connections_per_host=1,
+                                              pool_timeout=0.1), None),
+                              (ConnectionPool(max_connections_per_host=1),
+                               0.1)):
+            with LocalServer(KeepAliveHandler) as server:
+                client = Client(host=server.url, connection_pool=pool,
+                                timeout=timeout)
+                stream = client.a.get(stream=True)
+                with self.assertRaises(URLError):
+                    client.b.get()
+                stream.close()
+                self.assertIn('port', client.b.get().to_dict)
+
+    def test_pickle_keeps_configuration(self):
+        pool = ConnectionPool(max_connections_per_host=3, idle_timeout=5,
+                              pool_timeout=2)
+        unpickled = pickle.loads(pickle.dumps(pool))
+        self.assertEqual(unpickled.max_connections_per_host, 3)
+        self.assertEqual(unpickled.idle_timeout, 5)
+        self.assertEqual(unpickled.pool_timeout, 2)
+
+
+class TestStreamingResponse(unittest.TestCase):
+
+    def test_iter_bytes(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            response = client.lines.get(stream=True)
+            self.assertIsInstance(response, StreamingResponse)
+            self.assertEqual(response.status_code, 200)
+            chunks = list(response.iter_bytes(4))
+        self.assertEqual(chunks[0], b'firs')
+        self.assertEqual(b''.join(chunks), b'first\nsecond\r\n\nlast')
+
+    def test_iter_lines(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            with client.lines.get(stream=True) as response:
+                lines = list(response.iter_lines(chunk_size=3))
+        self.assertEqual(lines, [b'first', b'second', b'', b'last'])
+
+    def test_body_and_raw(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            response = client.lines.get(stream=True)
+            self.assertEqual(response.raw.read(6), b'first\n')
+            self.assertEqual(response.body, b'second\r\n\nlast')
+
+    def test_connection_released_when_consumed(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            response = client.lines.get(stream=True)
+            self.assertEqual(client.connection_pool._idle, {})
+            list(response.iter_bytes())
+            idle, = client.connection_pool._idle.values()
+            self.assertEqual(len(idle), 1)
+
+    def test_connection_discarded_when_closed_early(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            response = client.lines.get(stream=True)
+            response.raw.read(1)
+            response.close()
+            self.assertFalse(any(client.connection_pool._idle.values()))
+            self.assertEqual(sum(client.connection_pool._open.values()), 0)
+
+
+class TestResponse(unittest.TestCase):
+
+    def _response(self, body):
+        response = mock.Mock()
+        response.getcode.return_value = 200
+        response.read.return_value = body
+        return Response(response)
+
+    def test_to_dict_decoded_once(self):
+        codec = mock.Mock()
+        codec.loads.return_value = {'id': 1}
+        response = mock.Mock()
+        response.read.return_value = b'{"id": 1}'
+        response = Response(response, codec=codec)
+        codec.loads.assert_not_called()
+        self.assertEqual(response.to_dict, {'id': 1})
+        self.assertIs(response.to_dict, response.to_dict)
+        codec.loads.assert_called_once_with(b'{"id": 1}')
+
+    def test_to_dict_empty_body(self):
+        self.assertIsNone(self._response(b'').to_dict)
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self._response(b''), '__dict__'))
+
+    def test_error_to_dict_decoded_once(self):
+        codec = mock.Mock()
+        codec.loads.return_value = {'errors': []}
+        error = handle_error(MockException(400), codec=codec)
+        self.assertIs(error.to_dict, error.to_dict)
+        codec.loads.assert_called_once_with('BODY')
+
+    def test_error_from_response(self):
+        error = error_from_response(
+            404, 'Not Found', {'X-Id': '1'}, b'{"errors": []}')
+        self.assertIsInstance(error, NotFoundError)
+        self.assertEqual(404, error.status_code)
+        self.assertEqual('Not Found', error.reason)
+        self.assertEqual({'X-Id': '1'}, error.headers)
+        self.assertEqual({'errors': []}, error.to_dict)
+        self.assertEqual('HTTP Error 404: Not Found', str(error))
+        error = error_from_response(418, "I'm a teapot", {}, b'')
+        self.assertIs(HTTPError, type(error))
+
+    def test_error_constructed_directly(self):
+        error = ServiceUnavailableError(
+            503, 'Service Unavailable', {'Retry-After': '1'}, b'{}')
+        self.assertEqual(503, error.status_code)
+        self.assertEqual({}, error.to_dict)
+        unpickled = pickle.loads(pickle.dumps(error))
+        self.assertIsInstance(unpickled, ServiceUnavailableError)
+        self.assertEqual('HTTP Error 503: Service Unavailable',
+                         str(unpickled))
+        self.assertEqual({'Retry-After': '1'}, unpickled.headers)
+        self.assertEqual(b'{}', unpickled.body)
+
+    def test_raise_errors_off(self):
+        transport = LoopbackTransport(body={'ok': True})
+        transport.route('GET', '/missing', status=404,
+                        body={'errors': ['not found']})
+        client = Client(host='http://api.test.com', transport=transport,
+                        raise_errors=False)
+        self.assertIsNone(client.users.get().raise_for_status())
+        response = client.missing.get(stream=True)
+        # Error responses are read in full
+        self.assertIs(Response, type(response))
+        self.assertEqual(404, response.status_code)
+        self.assertEqual({'errors': ['not found']}, response.to_dict)
+        with self.assertRaises(NotFoundError) as context:
+            response.raise_for_status()
+        self.assertEqual('Not Found', context.exception.reason)
+        self.assertEqual(response.body, context.exception.body)
+        self.assertRaises(NotFoundError, Client(
+            host='http://api.test.com', transport=transport).missing.get)
+
+    def test_raise_errors_off_skips_urllib_errors(self):
+        transport = LoopbackTransport(status=404)
+        with LocalServer(KeepAliveHandler) as server:
+            clients = [
+                Client(host='http://api.test.com', transport=transport,
+                       raise_errors=False),
+                Client(host=server.url, raise_errors=False),
+                Client(host=server.url, transport=PooledSocketTransport(),
+                       raise_errors=False),
+            ]
+            for client in clients:
+                with mock.patch('python_http_client.transport.HTTPError',
+                                side_effect=AssertionError), \
+                        mock.patch('urllib.request.HTTPError',
+                                   side_effect=AssertionError):
+                    response = client.status._(404).get(stream=True)
+                self.assertEqual(404, response.status_code)
+                self.assertIs(Response, type(response))
+
+
+class TestJSONCodec(unittest.TestCase):
+
+    def test_stdlib_codec(self):
+        codec = get_codec('json')
+        self.assertIsInstance(codec, JSONCodec)
+        data = codec.dumps({'name': u'\u00e9'})
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(codec.loads(data), {'name': u'\u00e9'})
+
+    def test_default_codec(self):
+        self.assertIs(get_codec(), default_codec)
+        self.assertIn(default_codec.name, available_codecs)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_codec('simplejson2')
+
+    def test_codecs_accept_what_json_accepts(self):
+        obj = {1: 'int key', 'big': 2 ** 70, 'nested': {2.5: [True]}}
+        expected = json.loads(json.dumps(obj))
+        for name in available_codecs:
+            codec = get_codec(name)
+            self.assertEqual(json.loads(codec.dumps(obj).decode('utf-8')),
+                             expected, name)
+            with self.assertRaises(TypeError):
+                codec.dumps({'amount': object()})
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_request_body_encoded_with_codec(self, maker):
+        codec = mock.Mock()
+        codec.dumps.return_value = b'{}'
+        client = Client(host='http://api.test.com', codec=codec)
+        client.a.post(request_body={'sample': 'data'})
+        codec.dumps.assert_called_once_with({'sample': 'data'})
+        self.assertEqual(maker.call_args[0][0].data, b'{}')
+        self.assertIs(client.a.codec, codec)
+
+
+class TestIterJSONItems(unittest.TestCase):
+
+    def _response(self, body):
+        response = mock.Mock()
+        response.getcode.return_value = 200
+        response.read.return_value = body
+        return Response(response)
+
+    def test_top_level_array(self):
+        body = b'[1, "a,]b", {"x": [1, {"y": "}"}]}, null, []]'
+        response = self._response(body)
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(
+                list(response.iter_json_items(chunk_size=chunk_size)),
+                json.loads(body.decode('utf-8')))
+
+    def test_nested_path(self):
+        body = (b'{"meta": {"items": [0], "note": "\\"items\\""},'
+                b' "data": {"items": [{"id": 1}, {"id": "\\u00e9"}]}}')
+        response = self._response(body)
+        for chunk_size in (1, 5, 1024):
+            self.assertEqual(
+                list(response.iter_json_items('data.items', chunk_size)),
+                [{'id': 1}, {'id': u'\u00e9'}])
+
+    def test_not_an_array(self):
+        response = self._response(b'{"items": {"id": 1}}')
+        with self.assertRaises(ValueError):
+            list(response.iter_json_items('items'))
+
+    def test_truncated(self):
+        response = self._response(b'{"items": [1, 2')
+        items = response.iter_json_items('items', chunk_size=1)
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ValueError):
+            list(items)
+
+    def test_streaming(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            response = client.items.get(stream=True)
+            items = list(response.iter_json_items('result', chunk_size=16))
+        self.assertEqual(items, [{'id': i} for i in range(100)])
+
+
+class TestClientMap(unittest.TestCase):
+
+    def test_map_ordered(self):
+        requests = [('get', '/status/{}'.format(code))
+                    for code in (200, 404, 201, 503, 204) * 4]
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            results = list(client.map(requests, max_workers=3))
+        self.assertEqual(len(results), 20)
+        for result in results[::5]:
+            self.assertEqual(result.status_code, 200)
+        for result in results[1::5]:
+            self.assertIsInstance(result, NotFoundError)
+        for result in results[3::5]:
+            self.assertIsInstance(result, ServiceUnavailableError)
+
+    def test_map_unordered(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            requests = [('get', client.status._(200 + i)) for i in range(8)]
+            results = dict(client.map(requests, max_workers=4,
+                                      ordered=False))
+        self.assertEqual(sorted(results), list(range(8)))
+        for index, result in results.items():
+            self.assertEqual(result.status_code, 200 + index)
+
+    def test_map_consumes_requests_lazily(self):
+        pulled = []
+
+        def requests():
+            for i in range(100):
+                pulled.append(i)
+                yield ('get', '/status/200', {'timeout': 5})
+
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            results = client.map(requests(), max_workers=2)
+            next(results)
+            self.assertLessEqual(len(pulled), 4)
+            results.close()
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_request_headers_not_shared(self, maker):
+        client = Client(host='http://api.test.com',
+                        request_headers={'Authorization': 'Bearer KEY'})
+        client.a.get(request_headers={'X-Mock': 200})
+        request = maker.call_args[0][0]
+        self.assertEqual(request.headers['X-mock'], '200')
+        self.assertEqual(request.headers['Authorization'], 'Bearer KEY')
+        self.assertEqual(client.request_headers,
+                         {'Authorization': 'Bearer KEY'})
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.host = 'http://api.test.com'
+
+    def _error(self, code, headers=None):
+        error = handle_error(MockException(code))
+        if headers is not None:
+            error.headers = headers
+        return error
+
+    def test_client_retries_error_responses(self):
+        transport = LoopbackTransport(status=503)
+        failures = []
+        client = Client(
+            host=self.host, transport=transport, raise_errors=False,
+            retry=Retry(max_attempts=3, backoff_factor=0),
+            hooks={'on_retry': lambda request, failure, *args:
+                   failures.append(failure)})
+        response = client.get()
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(2, len(failures))
+        self.assertEqual([503, 503], [f.status_code for f in failures])
+
+    def test_get_retry(self):
+        self.assertIsNone(get_retry(None))
+        self.assertEqual(get_retry(5).max_attempts, 5)
+        retry = Retry()
+        self.assertIs(get_retry(retry), retry)
+
+    def test_retryable_errors(self):
+        retry = Retry()
+        self.assertTrue(retry.is_retryable('GET', self._error(503)))
+        self.assertTrue(retry.is_retryable('PUT', self._error(429)))
+        self.assertFalse(retry.is_retryable('GET', self._error(400)))
+        self.assertFalse(retry.is_retryable('GET', ValueError()))
+        self.assertTrue(
+            retry.is_retryable('GET', urllib.URLError('refused')))
+
+    def test_non_idempotent_opt_in(self):
+        error = self._error(503)
+        self.assertFalse(Retry().is_retryable('POST', error))
+        self.assertTrue(
+            Retry(retry_non_idempotent=True).is_retryable('POST', error))
+
+    @mock.patch('python_http_client.retry.random.uniform')
+    def test_backoff_full_jitter(self, uniform):
+        uniform.side_effect = lambda low, high: high
+        retry = Retry(backoff_factor=1, backoff_max=5)
+        self.assertEqual([retry.backoff(n) for n in range(1, 5)],
+                         [1, 2, 4, 5])
+        self.assertEqual(uniform.call_args[0][0], 0)
+
+    @mock.patch('python_http_client.retry.random.uniform',
+                return_value=0.1)
+    def test_get_delay(self, _):
+        retry = Retry(max_attempts=3)
+        error = self._error(503)
+        self.assertEqual(retry.get_delay('GET', 1, error, 0), 0.1)
+        self.assertIsNone(retry.get_delay('GET', 3, error, 0))
+        self.assertIsNone(retry.get_delay('POST', 1, error, 0))
+
+    @mock.patch('python_http_client.retry.random.uniform',
+                return_value=0.1)
+    def test_retry_after(self, _):
+        retry = Retry()
+        error = self._error(429, headers={'Retry-After': '7'})
+        self.assertEqual(retry.get_delay('GET', 1, error, 0), 7)
+        error.headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        self.assertEqual(retry.get_delay('GET', 1, error, 0), 0.1)
+        error.headers = {'Retry-After': 'soon'}
+        self.assertEqual(retry.get_delay('GET', 1, error, 0), 0.1)
+        retry.respect_retry_after = False
+        error.headers = {'Retry-After': '7'}
+        self.assertEqual(retry.get_delay('GET', 1, error, 0), 0.1)
+
+    @mock.patch('python_http_client.retry.random.uniform',
+                return_value=0.1)
+    def test_total_timeout(self, _):
+        retry = Retry(max_attempts=10, total_timeout=5)
+        error = self._error(503)
+        self.assertEqual(retry.get_delay('GET', 1, error, 4), 0.1)
+        self.assertIsNone(retry.get_delay('GET', 1, error, 4.95))
+        error.headers = {'Retry-After': '10'}
+        self.assertIsNone(retry.get_delay('GET', 1, error, 0))
+
+    @mock.patch('python_http_client.client.time.sleep')
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_client_retries(self, maker, sleep):
+        response = MockResponse(200)
+        maker.side_effect = [self._error(503), self._error(504), response]
+        client = Client(host=self.host, retry=Retry(max_attempts=3))
+        self.assertIs(client.a.b.get(), response)
+        self.assertEqual(maker.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertIs(client.a.b.retry, client.retry)
+
+    @mock.patch('python_http_client.client.time.sleep')
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_client_gives_up(self, maker, sleep):
+        maker.side_effect = [self._error(503)] * 3
+        client = Client(host=self.host, retry=2)
+        self.assertRaises(ServiceUnavailableError, client.get)
+        self.assertEqual(maker.call_count, 2)
+        maker.reset_mock()
+        maker.side_effect = [self._error(503)]
+        self.assertRaises(ServiceUnavailableError,
+                          client.post, request_body={})
+        self.assertEqual(maker.call_count, 1)
+
+    def test_client_retries_status(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url,
+                            retry=Retry(max_attempts=2, backoff_factor=0))
+            with mock.patch.object(client.connection_pool, 'acquire',
+                                   wraps=client.connection_pool.acquire) \
+                    as acquire:
+                self.assertRaises(ServiceUnavailableError,
+                                  client.status._(503).get)
+            self.assertEqual(acquire.call_count, 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('python_http_client.ratelimit._monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(2, burst=2)
+        self.assertEqual([limiter.reserve() for _ in range(4)],
+                         [0, 0, 0.5, 1.0])
+        self.now += 1.5
+        # The debt of the last two calls is paid off first
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0.5)
+
+    def test_burst_capped(self):
+        limiter = RateLimiter(10)
+        self.assertEqual(limiter.burst, 10)
+        self.now += 60
+        waits = [limiter.reserve() for _ in range(11)]
+        self.assertEqual(waits[:10], [0] * 10)
+        self.assertAlmostEqual(waits[10], 0.1)
+
+    def test_update_exhausted_quota(self):
+        limiter = RateLimiter(10)
+        limiter.update({'X-RateLimit-Remaining': '0',
+                        'X-RateLimit-Reset': '30'})
+        self.assertAlmostEqual(limiter.reserve(), 30.1)
+        self.now += 31
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_update_spreads_quota(self):
+        limiter = RateLimiter(10, burst=1)
+        limiter.update({'X-RateLimit-Remaining': '5',
+                        'X-RateLimit-Reset': '10'})
+        self.assertEqual(limiter.reserve(), 0)
+        # 5 calls left for 10 seconds
+        self.assertAlmostEqual(limiter.reserve(), 2)
+
+    @mock.patch('python_http_client.ratelimit.time.time',
+                return_value=1600000000)
+    def test_update_epoch_reset(self, _):
+        limiter = RateLimiter(10)
+        limiter.update({'X-RateLimit-Remaining': '0',
+                        'X-RateLimit-Reset': '1600000020'})
+        self.assertAlmostEqual(limiter.reserve(), 20.1)
+
+    def test_update_ignores_missing_headers(self):
+        limiter = RateLimiter(1)
+        for headers in (None, 'HEADERS', {},
+                        {'X-RateLimit-Remaining': 'many'}):
+            limiter.update(headers)
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_select_limiter(self):
+        default, mail = RateLimiter(1), RateLimiter(1)
+        limiters = get_rate_limiter({'/': default, 'mail/': mail})
+        self.assertIs(select_limiter(limiters, ['mail', 'send']), mail)
+        self.assertIs(select_limiter(limiters, ['mailbox']), default)
+        self.assertIs(select_limiter(limiters, []), default)
+        self.assertIsNone(select_limiter({'/mail': mail}, ['users']))
+        self.assertIs(select_limiter(mail, ['users']), mail)
+
+    def test_pickle(self):
+        limiter = pickle.loads(pickle.dumps(RateLimiter(5, burst=3)))
+        self.assertEqual((limiter.rate, limiter.burst), (5, 3))
+        self.assertEqual(limiter.reserve(), 0)
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_client(self, maker):
+        response = Response(MockResponse(200))
+        response._headers = {'X-RateLimit-Remaining': '0',
+                             'X-RateLimit-Reset': '5'}
+        maker.return_value = response
+        mail = RateLimiter(1)
+        client = Client(host='http://api.test.com',
+                        rate_limiter={'/mail': mail})
+        with mock.patch.object(mail, 'acquire') as acquire:
+            client.users.get()
+            self.assertEqual(acquire.call_count, 0)
+            client.mail.send.post(request_body={})
+            self.assertEqual(acquire.call_count, 1)
+        self.assertAlmostEqual(mail.reserve(), 6)
+
+
+class TestCache(unittest.TestCase):
+
+    def _entry(self, headers, body=b'body'):
+        return MemoryCache().store('GET', 'http://api.test.com/a', {},
+                                   200, body, headers)
+
+    def test_freshness(self):
+        now = time.time()
+        self.assertTrue(
+            self._entry({'Cache-Control': 'max-age=60'}).is_fresh())
+        self.assertFalse(self._entry(
+            {'Cache-Control': 'max-age=60', 'Age': '61',
+             'ETag': '"a"'}).is_fresh(now))
+        self.assertTrue(self._entry({
+            'Expires': 'Fri, 01 Jan 2100 00:00:00 GMT'}).is_fresh(now))
+        entry = self._entry({'Cache-Control': 'no-cache', 'ETag': '"a"'})
+        self.assertFalse(entry.is_fresh(now))
+        self.assertEqual(entry.validators(), {'If-none-match': '"a"'})
+
+    def test_not_stored(self):
+        self.assertIsNone(self._entry({'Cache-Control': 'no-store'}))
+        self.assertIsNone(self._entry({}))
+        self.assertIsNone(self._entry(
+            {'Cache-Control': 'max-age=60', 'Vary': '*'}))
+        self.assertIsNone(MemoryCache().store(
+            'GET', 'http://api.test.com/a', {}, 203, b'',
+            {'Cache-Control': 'max-age=60'}))
+
+    def test_vary(self):
+        cache = MemoryCache()
+        url = 'http://api.test.com/a'
+        headers = {'Cache-Control': 'max-age=60', 'Vary': 'Accept'}
+        cache.store('GET', url, {'Accept': 'a/json'}, 200, b'1', headers)
+        cache.store('GET', url, {'Accept': 'a/xml'}, 200, b'2', headers)
+        self.assertEqual(cache.lookup('GET', url, {'Accept': 'a/json'}).body,
+                         b'1')
+        self.assertEqual(cache.lookup('GET', url, {'Accept': 'a/xml'}).body,
+                         b'2')
+        self.assertIsNone(cache.lookup('GET', url, {}))
+        self.assertIsNone(cache.lookup('GET', url + '?b=1', {}))
+
+    def test_authorization_selects_variant(self):
+        cache = MemoryCache()
+        url = 'http://api.test.com/a'
+        headers = {'Cache-Control': 'max-age=60'}
+        cache.store('GET', url, {'Authorization': 'Bearer a'}, 200, b'a',
+                    headers)
+        self.assertEqual(
+            cache.lookup('GET', url, {'Authorization': 'Bearer a'}).body,
+            b'a')
+        self.assertIsNone(
+            cache.lookup('GET', url, {'Authorization': 'Bearer b'}))
+        self.assertIsNone(cache.lookup('GET', url, {}))
+        # The credentials themselves aren't kept in the keys
+        for key in cache._entries:
+            self.assertNotIn('Bearer', key)
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        cache = MemoryCache(max_size=30)
+        for key in 'abc':
+            cache.set(key, key, 10)
+        cache.get('a')
+        cache.set('d', 'd', 10)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['a', 'c', 'd'])
+        cache.set('big', 'big', 31)
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(len(cache), 3)
+
+    def test_file_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = FileCache(directory, max_size=1000)
+        entry = CacheEntry(200, b'x' * 300, [('ETag', '"a"')], 0)
+        cache.set('a', entry, entry.size)
+        self.assertEqual(cache.get('a').body, entry.body)
+        # Another process sharing the directory sees the entry
+        self.assertEqual(FileCache(directory).get('a').headers,
+                         [('ETag', '"a"')])
+        for key in 'bcd':
+            cache.set(key, entry, entry.size)
+        self.assertLessEqual(
+            sum(os.path.getsize(os.path.join(directory, name))
+                for name in os.listdir(directory)), 1000)
+        self.assertIsNotNone(cache.get('d'))
+        cache.delete('d')
+        self.assertIsNone(cache.get('d'))
+        cache.clear()
+        self.assertEqual(os.listdir(directory), [])
+        self.assertEqual(pickle.loads(pickle.dumps(cache)).max_size, 1000)
+
+    def test_client_fresh_response(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, cache=MemoryCache())
+            first = client.fresh.get()
+            second = client.fresh.get()
+            client.fresh.get(query_params={'page': 2})
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.headers['Cache-Control'], 'max-age=60')
+        self.assertEqual(server.paths, ['/fresh', '/fresh?page=2'])
+
+    def test_client_private_responses_not_shared(self):
+        cache = MemoryCache()
+        with LocalServer(KeepAliveHandler) as server:
+            alice = Client(host=server.url, cache=cache,
+                           request_headers={'Authorization': 'Bearer a'})
+            bob = Client(host=server.url, cache=cache,
+                         request_headers={'Authorization': 'Bearer b'})
+            alice.fresh.get()
+            bob.fresh.get()
+            alice.fresh.get()
+            bob.fresh.get()
+        self.assertEqual(server.paths, ['/fresh', '/fresh'])
+
+    def test_client_revalidation(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, cache=MemoryCache())
+            self.assertEqual(client.etag.get().to_dict, {'version': 1})
+            response = client.etag.get()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.to_dict, {'version': 1})
+        self.assertEqual(server.paths, ['/etag', '/etag'])
+
+    def test_client_stream_bypasses_cache(self):
+        cache = MemoryCache()
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, cache=cache)
+            client.fresh.get(stream=True).close()
+        self.assertEqual(len(cache), 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def _concurrently(self, function, count=5):
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = function()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_get_single_flight(self):
+        self.assertIsNone(get_single_flight(None))
+        self.assertIsNone(get_single_flight(False))
+        self.assertIsInstance(get_single_flight(True), SingleFlight)
+        group = SingleFlight()
+        self.assertIs(get_single_flight(group), group)
+
+    def test_do_shares_errors(self):
+        group = SingleFlight()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            time.sleep(0.2)
+            raise ValueError('boom')
+
+        results = self._concurrently(lambda: group.do('key', fail))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        # Nothing is kept once the call is over
+        self.assertEqual(group._calls, {})
+        self.assertEqual(group.do('key', lambda: 1), 1)
+
+    def test_client_coalesces_gets(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, single_flight=True)
+            self.assertIs(client.slow.single_flight, client.single_flight)
+            results = self._concurrently(client.slow.get)
+            # Different headers make a different call
+            client.slow.get(request_headers={'X-Other': 1})
+        self.assertEqual(server.paths, ['/slow', '/slow'])
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(results[0].status_code, 200)
+
+    def test_pickle(self):
+        group = pickle.loads(pickle.dumps(SingleFlight()))
+        self.assertEqual(group.do('key', lambda: 1), 1)
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.data = json.dumps(
+            [{'id': i} for i in range(1000)]).encode('utf-8')
+
+    def test_decoders(self):
+        gzipped = compress_body(self.data, 'gzip')
+        self.assertLess(len(gzipped), len(self.data))
+        self.assertEqual(decode_body(gzipped, 'gzip'), self.data)
+        self.assertEqual(decode_body(gzipped, 'x-gzip'), self.data)
+        self.assertEqual(decode_body(zlib.compress(self.data), 'deflate'),
+                         self.data)
+        raw = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = raw.compress(self.data) + raw.flush()
+        self.assertEqual(decode_body(raw, 'deflate'), self.data)
+        self.assertEqual(
+            decode_body(compress_body(zlib.compress(self.data), 'gzip'),
+                        'deflate, gzip'),
+            self.data)
+        for encoding in (None, '', 'identity', 'compress'):
+            self.assertIsNone(get_decoder(encoding))
+        self.assertEqual(decode_body(self.data, 'identity'), self.data)
+
+    def test_compress_body_unknown_encoding(self):
+        self.assertRaises(ValueError, compress_body, self.data, 'lzma')
+
+    def test_decoding_reader(self):
+        raw = io.BytesIO(compress_body(self.data, 'gzip'))
+        reader = DecodingReader(raw, get_decoder('gzip'))
+        chunks = list(iter(lambda: reader.read(1000), b''))
+        self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+        self.assertEqual(b''.join(chunks), self.data)
+        # Anything else comes from the wrapped response
+        self.assertEqual(reader.getvalue(), raw.getvalue())
+        reader = DecodingReader(io.BytesIO(compress_body(self.data, 'gzip')),
+                                get_decoder('gzip'))
+        self.assertEqual(reader.read(10) + reader.read(), self.data)
+
+    def test_client_decodes_responses(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url)
+            self.assertEqual(len(client.gzip.get().to_dict['result']), 100)
+            with client.gzip.get(stream=True) as response:
+                items = list(response.iter_json_items('result', 64))
+            self.assertEqual(items, [{'id': i} for i in range(100)])
+            with self.assertRaises(BadRequestsError) as context:
+                client.gzip.error.get()
+            self.assertEqual(len(context.exception.to_dict['result']), 100)
+            raw = Client(host=server.url, decompress=False).gzip.get()
+            self.assertNotIn('Content-Encoding', raw.headers)
+            self.assertEqual(len(raw.to_dict['result']), 100)
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_client_compresses_requests(self, maker):
+        client = Client(host='http://api.test.com',
+                        compress_requests='gzip', compress_min_size=100)
+        client.small.post(request_body={'a': 1})
+        request = maker.call_args[0][0]
+        self.assertNotIn('Content-encoding', request.headers)
+        client.large.post(request_body=[{'id': i} for i in range(100)])
+        request = maker.call_args[0][0]
+        self.assertEqual(request.headers['Content-encoding'], 'gzip')
+        self.assertEqual(json.loads(decode_body(request.data, 'gzip')),
+                         [{'id': i} for i in range(100)])
+        self.assertEqual(client.large.compress_requests, 'gzip')
+
+    def test_client_request_encoding_unavailable(self):
+        self.assertRaises(ValueError, Client, host='http://api.test.com',
+                          compress_requests='lzma')
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_default_transport(self):
+        client = Client(host='http://api.test.com')
+        self.assertIsInstance(client.transport, UrllibTransport)
+        self.assertIs(client.transport.opener, client.opener)
+        self.assertIs(client.a._('b').transport, client.transport)
+
+    def test_pooled_socket_transport(self):
+        transport = PooledSocketTransport()
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, transport=transport)
+            first = client.first.get().to_dict['port']
+            second = client.second.get(query_params={'a': 1})
+            self.assertEqual(first, second.to_dict['port'])
+            self.assertEqual(server.paths, ['/first', '/second?a=1'])
+            self.assertEqual(len(client.gzip.get().to_dict['result']), 100)
+            with client.lines.get(stream=True) as response:
+                self.assertEqual(list(response.iter_lines()),
+                                 [b'first', b'second', b'', b'last'])
+            self.assertRaises(NotFoundError, client.status._('404').get)
+            # Error bodies are read to the end, the socket stays open
+            self.assertEqual(client.get().to_dict['port'], first)
+        transport.close()
+        self.assertEqual(transport.connection_pool._open, {
+            ('http', server.url[len('http://'):]): 0})
+
+    def test_pooled_socket_transport_unknown_scheme(self):
+        client = Client(host='ftp://api.test.com',
+                        transport=PooledSocketTransport())
+        self.assertRaises(urllib.URLError, client.get)
+
+    def test_loopback_transport(self):
+        transport = LoopbackTransport(body={'ok': True})
+        transport.route('POST', '/v3/mail', status=202, body=b'',
+                        headers={'X-Message-Id': 'a1'})
+        transport.route('get', '/v3/missing', status=404,
+                        body={'errors': ['not found']})
+        client = Client(host='http://api.test.com', version=3,
+                        transport=transport)
+        response = client.users.get(query_params={'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.to_dict, {'ok': True})
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(transport.last_request.get_full_url(),
+                         'http://api.test.com/v3/users?limit=1')
+        response = client.mail.post(request_body={'to': 'a'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.headers['X-Message-Id'], 'a1')
+        self.assertEqual(json.loads(transport.last_request.data),
+                         {'to': 'a'})
+        with self.assertRaises(NotFoundError) as context:
+            client.missing.get()
+        self.assertEqual(context.exception.to_dict,
+                         {'errors': ['not found']})
+        with client.users.get(stream=True) as response:
+            self.assertEqual(b''.join(response.iter_bytes(2)),
+                             b'{"ok": true}')
+
+    def test_loopback_transport_decodes(self):
+        body = json.dumps([{'id': i} for i in range(100)]).encode('utf-8')
+        transport = LoopbackTransport(
+            body=compress_body(body, 'gzip'),
+            headers={'Content-Encoding': 'gzip'})
+        client = Client(host='http://api.test.com', transport=transport)
+        self.assertEqual(client.get().body, body)
+
+
+class TestRequestBody(unittest.TestCase):
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_binary_bodies_not_copied(self, maker):
+        client = Client(host='http://api.test.com')
+        for body in (b'{"a": 1}', bytearray(b'{"a": 1}'),
+                     memoryview(b'{"a": 1}')):
+            client.post(request_body=body)
+            request = maker.call_args[0][0]
+            self.assertIs(request.data, body)
+            self.assertEqual(request.headers['Content-type'],
+                             'application/json')
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_streamed_bodies_content_type(self, maker):
+        client = Client(host='http://api.test.com')
+        for body in (io.BytesIO(b'abc'), iter([b'abc'])):
+            client.post(request_body=body)
+            request = maker.call_args[0][0]
+            self.assertEqual(request.headers['Content-type'],
+                             'application/octet-stream')
+        client.post(request_body=io.BytesIO(b'a,b'),
+                    request_headers={'Content-Type': 'text/csv'})
+        request = maker.call_args[0][0]
+        self.assertEqual(request.headers['Content-type'], 'text/csv')
+
+    def _file(self, content):
+        body = tempfile.TemporaryFile()
+        body.write(content)
+        body.seek(0)
+        self.addCleanup(body.close)
+        return body
+
+    def test_streamed_bodies(self):
+        for transport in (None, PooledSocketTransport()):
+            with LocalServer(KeepAliveHandler) as server:
+                client = Client(host=server.url, transport=transport,
+                                request_headers={'Content-Type': 'text/csv'})
+                body = self._file(b'header\n' + b'a,b\n' * 50000)
+                body.readline()
+                echo = client.upload.post(request_body=body).to_dict
+                # From the current position, with a Content-Length
+                self.assertEqual(echo['body'], 'a,b\n' * 50000)
+                self.assertFalse(echo['chunked'])
+                self.assertEqual(echo['content_type'], 'text/csv')
+                echo = client.upload.post(
+                    request_body=(part for part in [b'a', b'', b'bc'])
+                ).to_dict
+                self.assertEqual(echo['body'], 'abc')
+                self.assertTrue(echo['chunked'])
+                # Still usable by the next call
+                self.assertIn('port', client.get().to_dict)
+
+    def test_streamed_body_bytes_sent(self):
+        timings = []
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, hooks={
+                'after_response': lambda request, response, t:
+                timings.append(t)})
+            client.post(request_body=iter([b'ab', b'cde']))
+            client.post(request_body=self._file(b'abcd'))
+        self.assertEqual([5, 4], [t.bytes_sent for t in timings])
+
+    def test_streamed_body_not_retried(self):
+        failures = []
+        client = Client(host='http://api.test.com',
+                        transport=LoopbackTransport(status=503),
+                        retry=Retry(max_attempts=3, backoff_factor=0),
+                        hooks={'on_retry': lambda *args: failures.append(1)})
+        self.assertRaises(ServiceUnavailableError, client.put,
+                          request_body=iter([b'a']))
+        self.assertEqual(failures, [])
+        self.assertRaises(ServiceUnavailableError, client.put,
+                          request_body=b'a')
+        self.assertEqual(failures, [1, 1])
+
+    def test_multipart(self):
+        for transport in (None, PooledSocketTransport()):
+            with LocalServer(KeepAliveHandler) as server:
+                client = Client(host=server.url, transport=transport,
+                                request_headers={
+                                    'Content-Type': 'application/json'})
+                contacts = self._file(b'email\na@example.com\n')
+                encoder = MultipartEncoder(
+                    {'list_id': 42}, boundary='BOUNDARY')
+                encoder.add_file('file', contacts, filename='contacts.csv')
+                length = encoder.length
+                echo = client.upload.post(request_body=encoder).to_dict
+                self.assertEqual(len(echo['body']), length)
+                self.assertEqual(echo['content_type'],
+                                 'multipart/form-data; boundary=BOUNDARY')
+                self.assertFalse(echo['chunked'])
+                self.assertEqual(echo['body'], (
+                    '--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="list_id"\r\n'
+                    '\r\n42\r\n'
+                    '--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="file"; '
+                    'filename="contacts.csv"\r\n'
+                    'Content-Type: text/csv\r\n'
+                    '\r\nemail\na@example.com\n\r\n'
+                    '--BOUNDARY--\r\n'))
+                encoder = MultipartEncoder(files={'file': iter([b'a'])})
+                self.assertIsNone(encoder.length)
+                echo = client.upload.post(request_body=encoder).to_dict
+                self.assertTrue(echo['chunked'])
+                self.assertIn('filename="file"\r\n'
+                              'Content-Type: application/octet-stream'
+                              '\r\n\r\na\r\n', echo['body'])
+
+    def test_multipart_retried_in_memory(self):
+        failures = []
+        client = Client(host='http://api.test.com',
+                        transport=LoopbackTransport(status=503),
+                        retry=Retry(max_attempts=2, backoff_factor=0),
+                        hooks={'on_retry': lambda *args: failures.append(1)})
+        encoder = MultipartEncoder({'a': 'b'}, files={'f': b'data'})
+        self.assertTrue(encoder.replayable)
+        self.assertRaises(ServiceUnavailableError, client.put,
+                          request_body=encoder)
+        self.assertEqual(failures, [1])
+        self.assertFalse(MultipartEncoder(
+            files={'f': self._file(b'data')}).replayable)
+
+    def test_body_length(self):
+        self.assertEqual(body_length(None), 0)
+        self.assertEqual(body_length(memoryview(b'abc')), 3)
+        body = io.BytesIO(b'abcdef')
+        body.read(2)
+        self.assertEqual(body_length(body), 4)
+        self.assertEqual(body.tell(), 2)
+        self.assertIsNone(body_length(iter([b'a'])))
+
+
+class TestHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.hooks = Hooks()
+        for event in ('before_request', 'after_response', 'on_error',
+                      'on_retry'):
+            self.hooks.register(event, partial(self._record, event))
+
+    def _record(self, event, request, *args):
+        self.events.append((event, request.get_full_url()) + args)
+
+    def test_get_hooks(self):
+        self.assertIsNone(get_hooks(None))
+        self.assertIs(get_hooks(self.hooks), self.hooks)
+        hook = mock.Mock()
+        hooks = get_hooks({'after_response': hook, 'on_error': [hook]})
+        hooks.fire('after_response', 1)
+        hooks.fire('on_error', 2)
+        self.assertEqual(hook.call_args_list, [mock.call(1), mock.call(2)])
+        hooks.unregister('on_error', hook)
+        hooks.fire('on_error', 3)
+        self.assertEqual(hook.call_count, 2)
+        self.assertRaises(ValueError, Hooks, on_request=hook)
+
+        @hooks.register('before_request')
+        def decorated(*args):
+            pass
+        self.assertEqual(hooks._hooks['before_request'], [decorated])
+
+    def test_timings(self):
+        timings = Timings()
+        self.assertIsNone(timings.dns)
+        self.assertIsNone(timings.total)
+        timings.start, timings.first_byte, timings.body_end = 1, 1.5, 3
+        self.assertEqual(timings.ttfb, 0.5)
+        self.assertEqual(timings.body, 1.5)
+        self.assertEqual(timings.total, 2)
+
+    def test_hooks_shared_with_derived_clients(self):
+        client = Client(host='http://api.test.com', hooks=self.hooks)
+        self.assertIs(client.a._('b').hooks, self.hooks)
+        self.assertIsNone(Client(host='http://api.test.com').a.hooks)
+
+    def test_empty_hooks_not_timed(self):
+        hooks = Hooks()
+        self.assertFalse(hooks)
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, hooks=hooks)
+            with mock.patch.object(client, '_make_traced_request') as traced:
+                self.assertIsNone(client.items.get().timings)
+            traced.assert_not_called()
+            hook = hooks.register('after_response', mock.Mock())
+            self.assertTrue(hooks)
+            self.assertIsNotNone(client.items.get().timings)
+            hooks.unregister('after_response', hook)
+            self.assertIsNone(client.items.get().timings)
+
+    def test_call_timed(self):
+        def add_header(request, timings):
+            request.headers['X-test'] = 'yes'
+        self.hooks.register('before_request', add_header)
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, hooks=self.hooks)
+            response = client.items.get()
+        timings = response.timings
+        self.assertEqual(self.events[0][:2],
+                         ('before_request', server.url + '/items'))
+        self.assertEqual(self.events[1],
+                         ('after_response', server.url + '/items',
+                          response, timings))
+        self.assertEqual(len(response.to_dict['result']), 100)
+        self.assertEqual(timings.bytes_sent, 0)
+        self.assertEqual(timings.bytes_received, len(response.body))
+        # A new connection: every phase is known and in order
+        phases = [timings.start, timings.dns_start, timings.dns_end,
+                  timings.connect_end, timings.request_sent,
+                  timings.first_byte, timings.body_end,
+                  timings.decode_start, timings.decode_end]
+        self.assertNotIn(None, phases)
+        self.assertEqual(phases, sorted(phases))
+        self.assertIsNone(timings.tls)
+
+    def test_bytes_sent(self):
+        client = Client(host='http://api.test.com', hooks=self.hooks,
+                        transport=LoopbackTransport(body=b'{}'))
+        timings = client.post(request_body={'a': 1}).timings
+        self.assertEqual(timings.bytes_sent, len(client.codec.dumps({'a': 1})))
+        self.assertEqual(timings.bytes_received, 2)
+        # Phases the transport doesn't report stay unset
+        self.assertIsNone(timings.connect)
+        self.assertIsNotNone(timings.ttfb)
+
+    def test_stream_timed(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, hooks=self.hooks)
+            client.get()
+            with client.gzip.get(stream=True) as response:
+                timings = response.timings
+                self.assertIsNone(timings.body_end)
+                body = b''.join(response.iter_bytes())
+        self.assertEqual(len(json.loads(body)['result']), 100)
+        # The connection was reused, and the body read compressed
+        self.assertIsNone(timings.dns)
+        self.assertIsNotNone(timings.body_end)
+        self.assertLess(timings.bytes_received, len(body))
+
+    def test_error_and_retry(self):
+        with LocalServer(KeepAliveHandler) as server:
+            client = Client(host=server.url, hooks=self.hooks,
+                            retry=Retry(max_attempts=2, backoff_factor=0))
+            with self.assertRaises(ServiceUnavailableError) as context:
+                client.status._('503').get()
+        url = server.url + '/status/503'
+        error = context.exception
+        self.assertEqual([event[:2] for event in self.events], [
+            ('before_request', url), ('on_error', url), ('on_retry', url),
+            ('before_request', url), ('on_error', url)])
+        self.assertIs(self.events[1][2], self.events[2][2])
+        self.assertEqual(self.events[2][3:5], (1, 0))
+        self.assertIs(self.events[4][2], error)
+        self.assertIsNotNone(self.events[4][3].first_byte)
+
+    @mock.patch('python_http_client.client.Client._open')
+    def test_no_hooks(self, opener):
+        client = Client(host='http://api.test.com')
+        client.get()
+        request = opener.call_args[0][0]
+        self.assertEqual(opener.call_args[0][1:], (None, False))
+        self.assertIsNone(request.timings)
+
+
+class TestOpener(unittest.TestCase):
+
+    def setUp(self):
+        self.host = 'http://api.test.com'
+
+    def _handler(self, opener, cls):
+        return [h for h in opener.handlers if isinstance(h, cls)]
+
+    def test_opener_shared_with_derived_clients(self):
+        client = Client(host=self.host)
+        self.assertIs(client.a._('b').version(3).opener, client.opener)
+
+    @mock.patch('python_http_client.client.urllib.build_opener')
+    def test_opener_built_once(self, build_opener):
+        client = Client(host=self.host)
+        client.a.b._('c')
+        self.assertEqual(build_opener.call_count, 1)
+
+    def test_pooled_handlers(self):
+        client = Client(host=self.host)
+        for cls in (PooledHTTPHandler, PooledHTTPSHandler):
+            handler, = self._handler(client.opener, cls)
+            self.assertIs(handler.pool, client.connection_pool)
+
+    def test_custom_handlers_replace_defaults(self):
+        https_handler = urllib.HTTPSHandler()
+        client = Client(host=self.host, handlers=[https_handler])
+        handlers = self._handler(client.opener, urllib.HTTPSHandler)
+        self.assertEqual(handlers, [https_handler])
+        self.assertTrue(self._handler(client.opener, PooledHTTPHandler))
+
+    def test_ssl_context_keeps_pooling(self):
+        context = ssl.create_default_context()
+        client = Client(host=self.host, ssl_context=context)
+        handler, = self._handler(client.opener, urllib.HTTPSHandler)
+        self.assertIsInstance(handler, PooledHTTPSHandler)
+        self.assertIs(handler.pool, client.connection_pool)
+        self.assertIs(handler._context, context)
+
+    def test_custom_opener(self):
+        opener = urllib.build_opener()
+        client = Client(host=self.host, opener=opener)
+        self.assertIs(client.a.opener, opener)
+
+    @mock.patch.dict('os.environ', {'http_proxy': 'http://proxy:3128'})
+    def test_trust_env(self):
+        client = Client(host=self.host)
+        proxy_handler, = self._handler(client.opener, urllib.ProxyHandler)
+        self.assertIn('http', proxy_handler.proxies)
+
+        client = Client(host=self.host, trust_env=False)
+        self.assertEqual(
+            self._handler(client.opener, urllib.ProxyHandler), [])
+
+    @mock.patch.dict('os.environ', {'http_proxy': 'http://proxy:3128'})
+    def test_pickle_keeps_opener_settings(self):
+        client = Client(host=self.host, trust_env=False,
+                        handlers=[urllib.HTTPBasicAuthHandler()])
+        unpickled_client = pickle.loads(pickle.dumps(client._('a')))
+        opener = unpickled_client.opener
+        self.assertEqual(self._handler(opener, urllib.ProxyHandler), [])
+        self.assertEqual(
+            len(self._handler(opener, urllib.HTTPBasicAuthHandler)), 1)
+        handler, = self._handler(opener, urllib.HTTPHandler)
+        self.assertIs(handler.pool, unpickled_client.connection_pool)
+
+    def test_pickle_ssl_context_raises(self):
+        client = Client(host=self.host,
+                        ssl_context=ssl.create_default_context())
+        self.assertRaises(TypeError, pickle.dumps, client)
+        self.assertRaises(TypeError, pickle.dumps, client.a)
+
+    def test_pickle_custom_opener(self):
+        client = Client(host=self.host, opener=urllib.build_opener(
+            urllib.ProxyHandler({'http': 'http://proxy:3128'})))
+        # Not swapped for a default opener behind the caller's back
+        self.assertRaises((AttributeError, pickle.PicklingError),
+                          pickle.dumps, client)
+
+        client = Client(host=self.host, trust_env=False)
+        client.opener = urllib.build_opener()
+        unpickled_client = pickle.loads(pickle.dumps(client))
+        self.assertEqual(
+            self._handler(unpickled_client.opener, PooledHTTPHandler), [])
+
+
 class TestClient(unittest.TestCase):
 
     def setUp(self):
@@ -121,6 +1511,106 @@ class TestClient(unittest.TestCase):
         built_url = self.client._build_url(query_params)
         self.assertEqual(built_url, url)
 
+    def test__build_url_prefix_cached(self):
+        client = self.client.here._(1)
+        # Inherited from the parent, built again below
+        client._url_prefix = None
+        with mock.patch.object(Client, '_build_versioned_url',
+                               autospec=True,
+                               side_effect=Client._build_versioned_url) \
+                as build:
+            client._build_url(None)
+            url = client._build_url({'hello': 0})
+            self.assertEqual(build.call_count, 1)
+        self.assertEqual(url, '{}/v3/here/1?hello=0'.format(self.host))
+
+        client._url_path = client._url_path + ['there']
+        self.assertEqual(client._build_url(None),
+                         '{}/v3/here/1/there'.format(self.host))
+        client._version = 4
+        self.assertEqual(client._build_url(None),
+                         '{}/v4/here/1/there'.format(self.host))
+
+    def test__build_client_url_prefix(self):
+        for host in (self.host, self.host + '/'):
+            for version in (None, 3):
+                for append_slash in (False, True):
+                    client = Client(host=host, version=version,
+                                    append_slash=append_slash)
+                    for child in (client.a, client.a._(1).b):
+                        self.assertEqual(child._url_prefix,
+                                         child._build_url_prefix())
+
+    def test__build_client_shares_resolved_state(self):
+        child = self.client.a._('b')
+        self.assertIs(type(child), Client)
+        self.assertIs(child._get_base_headers(),
+                      self.client._get_base_headers())
+        self.assertIs(child.codec, self.client.codec)
+        self.assertEqual(child._url_path, ['a', 'b'])
+        self.assertEqual(self.client._url_path, [])
+
+    def test__getattr__memoized(self):
+        self.assertIs(self.client.mail.send, self.client.mail.send)
+        self.assertIsNot(self.client._('mail'), self.client._('mail'))
+
+    def test__getattr__memoized_version(self):
+        mail = self.client.mail
+        self.assertEqual(mail.version(4)._version, 4)
+        self.assertIsNot(self.client.mail, mail)
+        self.assertEqual(self.client.mail._version, 3)
+
+        send = self.client.mail.send
+        self.client.version(5)
+        self.assertIsNot(self.client.mail.send, send)
+        self.assertEqual(self.client.mail.send._version, 5)
+
+    def test__getattr__memoized_settings(self):
+        transport = LoopbackTransport(body={'ok': True})
+        client = Client(host=self.host, transport=transport)
+        client.mail.send.post()
+        client.request_headers = {'X-Test': '1'}
+        client.timeout = 5
+        with mock.patch.object(transport, 'open',
+                               wraps=transport.open) as transport_open:
+            client.mail.send.post()
+        request, = transport_open.call_args[0]
+        self.assertEqual(request.headers['X-test'], '1')
+        self.assertEqual(transport_open.call_args[1]['timeout'], 5)
+
+        client._update_headers({'X-Other': '2'})
+        client.mail.send.post()
+        self.assertEqual(transport.last_request.headers['X-other'], '2')
+
+    def test__getattr__memoized_child_settings(self):
+        mail = self.client.mail
+        mail.timeout = 3
+        mail.append_slash = True
+        self.assertIsNot(self.client.mail, mail)
+        self.assertIsNone(self.client.mail.timeout)
+        self.assertFalse(self.client.mail.append_slash)
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_endpoint(self, maker):
+        endpoint = self.client.endpoint('/mail/send/')
+        self.assertIsInstance(endpoint, Endpoint)
+        self.assertFalse(hasattr(endpoint, '__dict__'))
+        for verb in ('get', 'post', 'put', 'patch', 'delete'):
+            getattr(endpoint, verb)(query_params={'limit': 1})
+            request = maker.call_args[0][0]
+            self.assertEqual(request.get_method(), verb.upper())
+            self.assertEqual(request.get_full_url(),
+                             '{}/v3/mail/send?limit=1'.format(self.host))
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_endpoint_request_body(self, maker):
+        self.client.endpoint('mail/send').post(
+            request_body={'sample': 'data'}, timeout=5)
+        request = maker.call_args[0][0]
+        self.assertEqual(self.client.codec.loads(request.data),
+                         {'sample': 'data'})
+        self.assertEqual(maker.call_args[1], {'timeout': 5})
+
     @mock.patch('python_http_client.client.Client._make_request')
     def test__urllib_headers(self, maker):
         self.client._update_headers({'X-test': 'Test'})
@@ -138,7 +1628,46 @@ class TestClient(unittest.TestCase):
         request_headers = {'X-Test': 'Test'}
         self.client._update_headers(request_headers)
         self.assertIn('X-Test', self.client.request_headers)
-        self.client.request_headers.pop('X-Test', None)
+
+    def test_request_headers_read_only(self):
+        request_headers = {'X-Test': 'Test'}
+        client = Client(host=self.host, request_headers=request_headers)
+        with self.assertRaises(TypeError):
+            client.request_headers['X-Test'] = 'Other'
+        request_headers['X-Test'] = 'Other'
+        self.assertEqual(client.request_headers, {'X-Test': 'Test'})
+        self.assertIs(client.a.request_headers, client.request_headers)
+
+    def test__update_headers_copy_on_write(self):
+        request_headers = {'X-Test': 'Test'}
+        client = Client(host=self.host, request_headers=request_headers)
+        child = client.a
+        child._update_headers({'X-Child': 'yes'})
+        self.assertEqual(child.request_headers,
+                         {'X-Test': 'Test', 'X-Child': 'yes'})
+        self.assertEqual(client.request_headers, {'X-Test': 'Test'})
+        self.assertEqual(request_headers, {'X-Test': 'Test'})
+
+    def test_base_headers_normalized(self):
+        client = Client(host=self.host,
+                        request_headers={'X-TEST': 1, 'accept': 'a/b'})
+        base = client._get_base_headers()
+        self.assertEqual(dict(base), {'X-test': '1', 'Accept': 'a/b',
+                                      'Accept-encoding': ACCEPT_ENCODING})
+        self.assertIs(client._get_base_headers(), base)
+        with self.assertRaises(TypeError):
+            base['X-test'] = '2'
+        client._update_headers({'X-Other': 2})
+        self.assertEqual(client._get_base_headers()['X-other'], '2')
+
+    @mock.patch('python_http_client.client.Client._make_request')
+    def test_content_type_default_not_shared(self, maker):
+        client = Client(host=self.host, request_headers={'X-Test': 'Test'})
+        client.post(request_body={'a': 1})
+        request = maker.call_args[0][0]
+        self.assertEqual(request.headers['Content-type'], 'application/json')
+        self.assertNotIn('Content-type', client._get_base_headers())
+        self.assertEqual(client.request_headers, {'X-Test': 'Test'})
 
     def test__build_client(self):
         new_client = self.client._build_client('test')
@@ -202,11 +1731,28 @@ class TestClient(unittest.TestCase):
     def test_client_pickle_unpickle(self):
         pickled_client = pickle.dumps(self.client)
         unpickled_client = pickle.loads(pickled_client)
+        # Live connections and the opener don't travel, they are rebuilt
+        rebuilt = dict(connection_pool=None, opener=None, transport=None)
+        state = dict(self.client.__dict__, **rebuilt)
+        unpickled_state = dict(unpickled_client.__dict__, **rebuilt)
         self.assertDictEqual(
-            self.client.__dict__,
-            unpickled_client.__dict__,
+            state,
+            unpickled_state,
             "original client and unpickled client must have the same state"
         )
+        self.assertIsInstance(unpickled_client.connection_pool,
+                              ConnectionPool)
+        self.assertIsInstance(unpickled_client.opener,
+                              urllib.OpenerDirector)
+        self.assertIs(unpickled_client.transport.opener,
+                      unpickled_client.opener)
+
+    def test_client_pickle_after_request_headers_built(self):
+        client = Client(host=self.host, request_headers={'X-Test': 1})
+        client._get_base_headers()
+        unpickled_client = pickle.loads(pickle.dumps(client))
+        self.assertEqual(dict(unpickled_client._get_base_headers()),
+                         {'X-test': '1', 'Accept-encoding': ACCEPT_ENCODING})
 
 
 if __name__ == '__main__':